@@ -12,6 +12,14 @@ import app.models.state_machine  # noqa
 import app.models.requirement  # noqa
 import app.models.sample_file  # noqa
 import app.models.sample_requirement  # noqa
+import app.models.job  # noqa
+import app.models.llm_cache_entry  # noqa
+import app.models.requirements_snapshot  # noqa
+import app.models.conversation_summary  # noqa
+import app.models.project_state  # noqa
+import app.models.project_version  # noqa
+import app.models.requirement_counter  # noqa
+import app.models.sample_content  # noqa
 
 config = context.config
 if config.config_file_name is not None:
@@ -0,0 +1,40 @@
+"""job table
+
+Revision ID: 3b9e1c2d4a10
+Revises: 7706cb92c32b
+Create Date: 2026-10-16 09:12:40.518231
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+revision: str = '3b9e1c2d4a10'
+down_revision: Union[str, None] = '7706cb92c32b'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('result', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+    sa.Column('error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_project_id'), 'job', ['project_id'], unique=False)
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_job_project_id'), table_name='job')
+    op.drop_table('job')
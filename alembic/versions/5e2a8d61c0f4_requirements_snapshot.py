@@ -0,0 +1,89 @@
+"""requirements snapshot table
+
+Revision ID: 5e2a8d61c0f4
+Revises: 9c41f7e2b8d3
+Create Date: 2026-10-16 11:20:37.918402
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+revision: str = '5e2a8d61c0f4'
+down_revision: Union[str, None] = '9c41f7e2b8d3'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+requirement = sa.table(
+    'requirement',
+    sa.column('id', sa.Integer), sa.column('project_id', sa.Integer), sa.column('category', sa.String),
+    sa.column('number', sa.Integer), sa.column('description', sa.String),
+)
+project = sa.table('project', sa.column('id', sa.Integer))
+snapshot = sa.table(
+    'requirementssnapshot',
+    sa.column('project_id', sa.Integer), sa.column('version', sa.Integer), sa.column('items', sa.JSON),
+    sa.column('text_es', sa.String), sa.column('text_en', sa.String), sa.column('updated_at', sa.DateTime),
+)
+
+CATEGORY_ORDER = ["FUNCTIONAL", "PERFORMANCE", "USABILITY", "SECURITY", "TECHNICAL"]
+
+
+def _render(lines, es):
+    # Copia congelada de ``render_requirements`` en el momento de la migración
+    buckets = {}
+    for cat, number, description in lines:
+        buckets.setdefault(cat.upper(), []).append((number, description))
+    if not buckets:
+        return "Sin requisitos." if es else "No requirements."
+    out = []
+    for cat in CATEGORY_ORDER:
+        out.append(f"{cat}:")
+        items = buckets.get(cat, [])
+        if items:
+            out.extend(f"{number}. {description}" for number, description in items)
+        else:
+            out.append("(sin elementos)" if es else "(empty)")
+        out.append("")
+    return "\n".join(out).strip()
+
+
+def upgrade() -> None:
+    op.create_table('requirementssnapshot',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('items', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+    sa.Column('text_es', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('text_en', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+
+    # Backfill: una fila por proyecto existente, para que ninguna escritura ni
+    # lectura tenga que crearla después
+    conn = op.get_bind()
+    by_project = {}
+    for rid, project_id, category, number, description in conn.execute(
+        sa.select(requirement.c.id, requirement.c.project_id, requirement.c.category,
+                  requirement.c.number, requirement.c.description)
+    ):
+        by_project.setdefault(project_id, {})[str(rid)] = [category, number, description]
+    now = datetime.utcnow()
+    rows = []
+    for (project_id,) in conn.execute(sa.select(project.c.id)):
+        items = by_project.get(project_id, {})
+        lines = sorted(items.values(), key=lambda r: (r[0], r[1]))
+        rows.append({
+            "project_id": project_id, "version": 1, "items": items,
+            "text_es": _render(lines, True), "text_en": _render(lines, False), "updated_at": now,
+        })
+    if rows:
+        conn.execute(snapshot.insert(), rows)
+
+def downgrade() -> None:
+    op.drop_table('requirementssnapshot')
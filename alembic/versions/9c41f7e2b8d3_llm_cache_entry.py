@@ -0,0 +1,32 @@
+"""llm cache entry table
+
+Revision ID: 9c41f7e2b8d3
+Revises: 3b9e1c2d4a10
+Create Date: 2026-10-16 10:02:11.204877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+revision: str = '9c41f7e2b8d3'
+down_revision: Union[str, None] = '3b9e1c2d4a10'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    op.create_table('llmcacheentry',
+    sa.Column('key', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('model', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('response', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_llmcacheentry_expires_at'), 'llmcacheentry', ['expires_at'], unique=False)
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_llmcacheentry_expires_at'), table_name='llmcacheentry')
+    op.drop_table('llmcacheentry')
@@ -0,0 +1,32 @@
+"""per-project requirement number counter
+
+Revision ID: a9d1e4b7c362
+Revises: f3b6c8d2a4e1
+Create Date: 2026-10-16 14:52:39.120554
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'a9d1e4b7c362'
+down_revision: Union[str, None] = 'f3b6c8d2a4e1'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    op.create_table('requirementcounter',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('last_number', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+    # Se inicializa con el máximo actual de cada proyecto (la única vez que se escanea)
+    op.execute("""
+        INSERT INTO requirementcounter (project_id, last_number)
+        SELECT project_id, MAX(number) FROM requirement GROUP BY project_id
+    """)
+
+def downgrade() -> None:
+    op.drop_table('requirementcounter')
@@ -0,0 +1,31 @@
+"""conversation summary table
+
+Revision ID: b71d4f0a9e25
+Revises: 5e2a8d61c0f4
+Create Date: 2026-10-16 12:05:11.204871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+revision: str = 'b71d4f0a9e25'
+down_revision: Union[str, None] = '5e2a8d61c0f4'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    op.create_table('conversationsummary',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('summary', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+
+def downgrade() -> None:
+    op.drop_table('conversationsummary')
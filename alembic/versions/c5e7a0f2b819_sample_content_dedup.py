@@ -0,0 +1,112 @@
+"""deduplicated sample file content
+
+Revision ID: c5e7a0f2b819
+Revises: a9d1e4b7c362
+Create Date: 2026-10-16 15:40:12.774302
+
+"""
+import hashlib
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+revision: str = 'c5e7a0f2b819'
+down_revision: Union[str, None] = 'a9d1e4b7c362'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+samplefile = sa.table('samplefile', sa.column('id', sa.Integer), sa.column('content_id', sa.Integer))
+samplerequirement = sa.table(
+    'samplerequirement',
+    sa.column('id', sa.Integer), sa.column('text', sa.String),
+    sa.column('file_id', sa.Integer), sa.column('content_id', sa.Integer),
+)
+samplecontent = sa.table(
+    'samplecontent',
+    sa.column('id', sa.Integer), sa.column('sha256', sa.String), sa.column('size', sa.Integer),
+    sa.column('line_count', sa.Integer), sa.column('ref_count', sa.Integer), sa.column('created_at', sa.DateTime),
+)
+
+
+def upgrade() -> None:
+    op.create_table('samplecontent',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('line_count', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_samplecontent_sha256'), 'samplecontent', ['sha256'], unique=True)
+    op.add_column('samplefile', sa.Column('content_id', sa.Integer(), nullable=True))
+    op.add_column('samplerequirement', sa.Column('content_id', sa.Integer(), nullable=True))
+
+    # Backfill: los ficheros existentes no guardan los bytes originales, así que
+    # se agrupan por el hash de sus líneas; los idénticos comparten contenido.
+    conn = op.get_bind()
+    lines_by_file = {}
+    for file_id, text in conn.execute(
+        sa.select(samplerequirement.c.file_id, samplerequirement.c.text).order_by(samplerequirement.c.id)
+    ):
+        lines_by_file.setdefault(file_id, []).append(text)
+    content_by_hash = {}
+    for (file_id,) in conn.execute(sa.select(samplefile.c.id).order_by(samplefile.c.id)):
+        lines = lines_by_file.get(file_id, [])
+        data = "".join(f"{line}\n" for line in lines).encode("utf-8")
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 in content_by_hash:
+            content_id = content_by_hash[sha256]
+            conn.execute(samplecontent.update().where(samplecontent.c.id == content_id)
+                         .values(ref_count=samplecontent.c.ref_count + 1))
+            conn.execute(samplerequirement.delete().where(samplerequirement.c.file_id == file_id))
+        else:
+            content_id = conn.execute(samplecontent.insert().values(
+                sha256=sha256, size=len(data), line_count=len(lines), ref_count=1, created_at=datetime.utcnow(),
+            ).returning(samplecontent.c.id)).scalar()
+            content_by_hash[sha256] = content_id
+            conn.execute(samplerequirement.update().where(samplerequirement.c.file_id == file_id)
+                         .values(content_id=content_id))
+        conn.execute(samplefile.update().where(samplefile.c.id == file_id).values(content_id=content_id))
+
+    with op.batch_alter_table('samplefile') as batch_op:
+        batch_op.alter_column('content_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_samplefile_content_id_samplecontent', 'samplecontent', ['content_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_samplefile_content_id'), ['content_id'], unique=False)
+    with op.batch_alter_table('samplerequirement') as batch_op:
+        batch_op.alter_column('content_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_samplerequirement_content_id_samplecontent', 'samplecontent', ['content_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_samplerequirement_content_id'), ['content_id'], unique=False)
+        batch_op.drop_column('file_id')
+
+
+def downgrade() -> None:
+    op.add_column('samplerequirement', sa.Column('file_id', sa.Integer(), nullable=True))
+    # Cada fichero vuelve a tener su propia copia de las líneas
+    conn = op.get_bind()
+    lines_by_content = {}
+    for content_id, text in conn.execute(
+        sa.select(samplerequirement.c.content_id, samplerequirement.c.text).order_by(samplerequirement.c.id)
+    ):
+        lines_by_content.setdefault(content_id, []).append(text)
+    conn.execute(samplerequirement.delete())
+    for file_id, content_id in conn.execute(sa.select(samplefile.c.id, samplefile.c.content_id)).all():
+        rows = [{"text": text, "file_id": file_id, "content_id": content_id} for text in lines_by_content.get(content_id, [])]
+        if rows:
+            conn.execute(samplerequirement.insert(), rows)
+
+    with op.batch_alter_table('samplerequirement') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_samplerequirement_content_id'))
+        batch_op.drop_constraint('fk_samplerequirement_content_id_samplecontent', type_='foreignkey')
+        batch_op.drop_column('content_id')
+        batch_op.alter_column('file_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_samplerequirement_file_id_samplefile', 'samplefile', ['file_id'], ['id'])
+    with op.batch_alter_table('samplefile') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_samplefile_content_id'))
+        batch_op.drop_constraint('fk_samplefile_content_id_samplecontent', type_='foreignkey')
+        batch_op.drop_column('content_id')
+    op.drop_index(op.f('ix_samplecontent_sha256'), table_name='samplecontent')
+    op.drop_table('samplecontent')
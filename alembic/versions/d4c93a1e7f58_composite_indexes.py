@@ -0,0 +1,31 @@
+"""composite indexes for latest state, history and requirements
+
+Revision ID: d4c93a1e7f58
+Revises: b71d4f0a9e25
+Create Date: 2026-10-16 12:48:02.551730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'd4c93a1e7f58'
+down_revision: Union[str, None] = 'b71d4f0a9e25'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    # Los índices compuestos empiezan por project_id, así que sustituyen a los simples
+    op.create_index('ix_statemachine_project_id_last_updated', 'statemachine', ['project_id', 'last_updated'], unique=False)
+    op.drop_index('ix_statemachine_project_id', table_name='statemachine')
+    op.create_index('ix_chatmessage_project_id_timestamp', 'chatmessage', ['project_id', 'timestamp'], unique=False)
+    op.drop_index('ix_chatmessage_project_id', table_name='chatmessage')
+    op.create_index('ix_requirement_project_id_category_number', 'requirement', ['project_id', 'category', 'number'], unique=False)
+
+def downgrade() -> None:
+    op.drop_index('ix_requirement_project_id_category_number', table_name='requirement')
+    op.create_index('ix_chatmessage_project_id', 'chatmessage', ['project_id'], unique=False)
+    op.drop_index('ix_chatmessage_project_id_timestamp', table_name='chatmessage')
+    op.create_index('ix_statemachine_project_id', 'statemachine', ['project_id'], unique=False)
+    op.drop_index('ix_statemachine_project_id_last_updated', table_name='statemachine')
@@ -0,0 +1,44 @@
+"""project state head pointer
+
+Revision ID: e8a2f5c3d917
+Revises: d4c93a1e7f58
+Create Date: 2026-10-16 13:31:44.086120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+revision: str = 'e8a2f5c3d917'
+down_revision: Union[str, None] = 'd4c93a1e7f58'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    op.create_table('projectstate',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('state_machine_id', sa.Integer(), nullable=False),
+    sa.Column('state', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.ForeignKeyConstraint(['state_machine_id'], ['statemachine.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+    # Backfill: la última fila del histórico de cada proyecto (desempate por id)
+    op.execute("""
+        INSERT INTO projectstate (project_id, state_machine_id, state, version, updated_at)
+        SELECT sm.project_id, sm.id, sm.state, 1, sm.last_updated
+        FROM statemachine sm
+        WHERE sm.id = (
+            SELECT s2.id FROM statemachine s2
+            WHERE s2.project_id = sm.project_id
+            ORDER BY s2.last_updated DESC, s2.id DESC
+            LIMIT 1
+        )
+    """)
+
+def downgrade() -> None:
+    op.drop_table('projectstate')
@@ -0,0 +1,35 @@
+"""project version counters for etags
+
+Revision ID: f3b6c8d2a4e1
+Revises: e8a2f5c3d917
+Create Date: 2026-10-16 14:10:27.663015
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'f3b6c8d2a4e1'
+down_revision: Union[str, None] = 'e8a2f5c3d917'
+branch_labels: Union[str, Sequence[str]] = None
+depends_on: Union[str, Sequence[str]] = None
+
+def upgrade() -> None:
+    op.create_table('projectversion',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('messages', sa.Integer(), nullable=False),
+    sa.Column('requirements', sa.Integer(), nullable=False),
+    sa.Column('state', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.PrimaryKeyConstraint('project_id')
+    )
+    # Una fila por proyecto existente (versión 0)
+    op.execute(
+        "INSERT INTO projectversion (project_id, messages, requirements, state, updated_at) "
+        "SELECT id, 0, 0, 0, CURRENT_TIMESTAMP FROM project"
+    )
+
+def downgrade() -> None:
+    op.drop_table('projectversion')
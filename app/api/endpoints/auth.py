@@ -2,13 +2,15 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from sqlmodel import Session, select
 from app.models.user import User
 from app.schemas.user import UserCreate, UserRead, Token, UserPreferences, UserUpdate
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core.security import verify_and_update_password, get_password_hash, create_access_token
 from app.database import get_session
 from app.core.config import Settings
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime
 from app.utils.preferences import parse_user_preferences
+from app.utils.user_cache import get_user_cache
+from sqlalchemy.orm import make_transient_to_detached
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -46,10 +48,18 @@ def register(user_in: UserCreate, session: Session = Depends(get_session)):
 @router.post("/login", response_model=Token)
 def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
     user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    valid, new_hash = verify_and_update_password(form_data.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     if not user.active:
         raise HTTPException(status_code=403, detail="User inactive")
+    if new_hash:
+        # El coste de bcrypt cambió: se guarda el hash recalculado de forma transparente
+        user.password_hash = new_hash
+        session.add(user)
+        session.commit()
     token = create_access_token({"sub": str(user.id)})
     return Token(access_token=token)
 
@@ -62,9 +72,21 @@ def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Dep
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = session.get(User, int(user_id))
+
+    cache = get_user_cache()
+    key = (int(user_id), payload.get("iat"))
+    cached = cache.get(*key)
+    if cached is not None:
+        # Se reconstruye como instancia "detached" y se asocia a la sesión sin consultar la BD
+        user = User(**cached)
+        make_transient_to_detached(user)
+        session.add(user)
+        return user
+
+    user = session.get(User, key[0])
     if user is None:
         raise credentials_exception
+    cache.set(*key, user.model_dump())
     return user
 
 @router.get("/me", response_model=UserRead)
@@ -101,6 +123,7 @@ def update_me(
     current_user.updated_date = datetime.utcnow()
     session.add(current_user)
     session.commit()
+    get_user_cache().invalidate(current_user.id)
     session.refresh(current_user)
 
     user_prefs = parse_user_preferences(current_user.preferences)
@@ -129,4 +152,5 @@ def update_preferences(
     current_user.updated_date = datetime.utcnow()
     session.add(current_user)
     session.commit()
+    get_user_cache().invalidate(current_user.id)
     return preferences
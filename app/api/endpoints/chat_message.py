@@ -1,25 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import logging
+import weakref
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, or_
 from sqlmodel import Session, select
-from typing import List
+from typing import Callable, List, Optional, Union
 from app.database import get_session
 from app.api.endpoints.auth import get_current_user
 from app.models.user import User
-from app.models.state_machine import StateMachine
 from app.models.chat_message import ChatMessage
 from app.schemas.chat_message import ChatMessageCreate, ChatMessageRead, ChatMessageUpdate
+from app.schemas.job import JobRead
+from app.api.endpoints.jobs import submit_job
+from app.utils.ollama_client import call_ollama, stream_ollama
+from app.utils.ollama_pool import OllamaError
 
-from app.services.chat_flow import (
-    handle_init,
-    handle_software_questions,
-    finish_questions_generate_reqs,
-    handle_analyze_reply,
-    handle_stall,
-    save_ai_message,
-    save_generic,
-)
+from app.services.admission import hold_llm_slot, llm_slot
+from app.services.chat_flow import PendingReply, dispatch_message
+from app.services.project_version import not_modified, project_etag
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 500
+
 
 @router.post("/", response_model=ChatMessageRead)
 def create_message(
@@ -27,45 +33,187 @@ def create_message(
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
-    state_machine = session.exec(
-        select(StateMachine)
-        .where(StateMachine.project_id == message_in.project_id)
-        .order_by(StateMachine.last_updated.desc())
-    ).first()
-    state = state_machine.state if state_machine else "init"
-
-    if message_in.sender == "user" and state == "init":
-        return handle_init(session, current_user, message_in, state_machine)
-
-    if message_in.sender == "user" and state == "software_questions":
-        progressed = handle_software_questions(session, current_user, message_in, state_machine)
-        if progressed is not None:
-            return progressed
-        return finish_questions_generate_reqs(session, current_user, message_in, state_machine)
+    result = dispatch_message(session, current_user, message_in)
+    if isinstance(result, PendingReply):
+        # Las ramas de IA sólo persisten en ``finish``: un 429 aquí no deja nada a medias
+        with llm_slot(current_user):
+            text = call_ollama(result.prompt)
+        return result.finish(session, text)
+    return result
 
-    if message_in.sender == "ai":
-        return save_ai_message(session, message_in, state)
 
-    if message_in.sender == "user" and state == "analyze_requisites":
-        return handle_analyze_reply(session, current_user, message_in, state_machine)
-
-    if message_in.sender == "user" and state == "stall":
-        return handle_stall(session, current_user, message_in, state_machine)
-
-    return save_generic(session, message_in, state)
+@router.post("/async", response_model=JobRead, status_code=status.HTTP_202_ACCEPTED)
+def create_message_async(
+    message_in: ChatMessageCreate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Igual que ``POST /chat_messages/`` pero la generación de la IA se ejecuta en
+    la cola de trabajos. Devuelve el Job; consultar ``GET /jobs/{id}`` hasta que
+    ``status`` sea ``succeeded`` (``result`` contiene el ChatMessage).
+    """
+    result = dispatch_message(session, current_user, message_in)
+    return submit_job(
+        session,
+        kind="chat_message",
+        project_id=message_in.project_id,
+        owner_id=current_user.id,
+        reply=result,
+        generate=call_ollama,
+        serialize=lambda m: ChatMessageRead.model_validate(m).model_dump(mode="json"),
+    )
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_reply(bind, result: Union[ChatMessage, PendingReply], release: Optional[Callable[[], None]] = None):
+    """Emite los tokens como eventos SSE y, al terminar, el mensaje persistido.
+
+    ``release`` libera el hueco de admisión al acabar o cerrarse el stream.
+    """
+    if isinstance(result, PendingReply):
+        chunks: List[str] = []
+        try:
+            # La sesión de la petición ya puede estar cerrada: usamos una propia
+            with Session(bind) as session:
+                try:
+                    for token in stream_ollama(result.prompt):
+                        chunks.append(token)
+                        yield _sse("token", {"text": token})
+                    message = result.finish(session, "".join(chunks))
+                    data = ChatMessageRead.model_validate(message).model_dump(mode="json")
+                except Exception as exc:
+                    # Con el stream ya abierto no cabe otro código HTTP: se avisa con un evento
+                    session.rollback()
+                    # Mismo detalle genérico que las respuestas no streaming: ni URLs
+                    # de los nodos ni el texto del error llegan al navegador
+                    if isinstance(exc, OllamaError):
+                        logger.warning("Streaming reply failed: %s", exc)
+                        payload = {"detail": "AI service unavailable"}
+                        if exc.retry_after:
+                            payload["retry_after"] = exc.retry_after
+                    else:
+                        logger.exception("Streaming reply failed")
+                        payload = {"detail": "Internal error"}
+                    yield _sse("error", payload)
+                    return
+        finally:
+            if release is not None:
+                release()
+    else:
+        data = ChatMessageRead.model_validate(result).model_dump(mode="json")
+    yield _sse("message", data)
+
+
+@router.post("/stream")
+def create_message_stream(
+    message_in: ChatMessageCreate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Variante en streaming (Server-Sent Events) de ``POST /chat_messages/``.
+    - ``event: token`` por cada fragmento generado por la IA.
+    - ``event: message`` con el ChatMessage final una vez persistido.
+    - ``event: error`` si la generación falla.
+    """
+    result = dispatch_message(session, current_user, message_in)
+    release = None
+    if isinstance(result, PendingReply):
+        # El hueco se toma antes de abrir el stream para que el rechazo sea un 429
+        release = hold_llm_slot(current_user)
+    stream = _stream_reply(session.get_bind(), result, release)
+    if release is not None:
+        # Un generador que nunca llega a arrancar no ejecuta su finally
+        weakref.finalize(stream, release)
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _cursor(session: Session, project_id: int, message_id: int) -> ChatMessage:
+    msg = session.get(ChatMessage, message_id)
+    if not msg or msg.project_id != project_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return msg
 
 
 @router.get("/project/{project_id}", response_model=List[ChatMessageRead])
 def get_project_messages(
     project_id: int,
+    request: Request,
+    response: Response,
+    before: Optional[int] = Query(None, description="id de mensaje: devuelve los anteriores"),
+    after: Optional[int] = Query(None, description="id de mensaje: devuelve los posteriores"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    tail: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="sólo los N más recientes"),
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
-    messages = session.exec(
-        select(ChatMessage)
-        .where(ChatMessage.project_id == project_id)
-        .order_by(ChatMessage.timestamp)
-    ).all()
+    """
+    Historial del proyecto en orden estable ``(timestamp, id)`` ascendente.
+
+    - Sin parámetros devuelve la conversación completa.
+    - ``after=<id>`` / ``before=<id>`` paginan por cursor (keyset) a partir de
+      un mensaje ya recibido; ``limit`` acota la página.
+    - ``tail=N`` devuelve sólo los N más recientes (equivale a ``before`` sin cursor).
+
+    Con ``limit`` o ``tail`` la cabecera ``X-Has-More`` indica si quedan más
+    mensajes en la dirección pedida.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after")
+
+    # Los cursores se validan antes del ETag: un cursor inválido es un 400, no un 304
+    after_msg = _cursor(session, project_id, after) if after is not None else None
+    before_msg = _cursor(session, project_id, before) if before is not None else None
+    page_size = tail or limit
+    # Sólo una página acotada hacia atrás se lee de más reciente a más antiguo;
+    # sin tamaño de página se devuelve todo en orden ascendente
+    newest_first = page_size is not None and (before is not None or tail is not None)
+
+    variant = ";".join(
+        f"{name}={value}"
+        for name, value in (("after", after), ("before", before), ("limit", page_size))
+        if value is not None
+    )
+    if newest_first:
+        variant += ";desc"
+    cached = not_modified(request, response, project_etag(session, project_id, "messages", variant))
+    if cached:
+        return cached
+
+    q = select(ChatMessage).where(ChatMessage.project_id == project_id)
+    if after_msg is not None:
+        q = q.where(or_(
+            ChatMessage.timestamp > after_msg.timestamp,
+            and_(ChatMessage.timestamp == after_msg.timestamp, ChatMessage.id > after_msg.id),
+        ))
+    if before_msg is not None:
+        q = q.where(or_(
+            ChatMessage.timestamp < before_msg.timestamp,
+            and_(ChatMessage.timestamp == before_msg.timestamp, ChatMessage.id < before_msg.id),
+        ))
+
+    if newest_first:
+        q = q.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    else:
+        q = q.order_by(ChatMessage.timestamp, ChatMessage.id)
+
+    if page_size is None:
+        return session.exec(q).all()
+
+    # Se pide uno de más para saber si hay otra página
+    messages = list(session.exec(q.limit(page_size + 1)).all())
+    response.headers["X-Has-More"] = "true" if len(messages) > page_size else "false"
+    messages = messages[:page_size]
+    if newest_first:
+        messages.reverse()
     return messages
 
 
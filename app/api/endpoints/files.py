@@ -8,6 +8,8 @@ from app.models.user import User
 from app.models.sample_file import SampleFile
 from app.models.sample_requirement import SampleRequirement
 from app.schemas.sample_file import SampleFileRead
+from app.core.config import get_settings
+from app.services.sample_ingest import SampleIngestError, release_sample_file, store_sample_file
 
 router = APIRouter()
 
@@ -27,17 +29,18 @@ def upload_sample_file(
     if len(existing_files) >= 5:
         raise HTTPException(status_code=400, detail="Maximum number of files reached")
 
-    file_record = SampleFile(filename=uploaded_file.filename, owner_id=current_user.id)
-    session.add(file_record)
-    session.commit()
-    session.refresh(file_record)
+    max_bytes = get_settings().sample_max_bytes
+    if uploaded_file.size is not None and uploaded_file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File is larger than {max_bytes} bytes")
 
-    content = uploaded_file.file.read().decode("utf-8")
-    for line in content.splitlines():
-        line = line.strip()
-        if line:
-            session.add(SampleRequirement(text=line, file_id=file_record.id))
+    # Fichero, contenido y líneas en una sola transacción: si la ingesta falla no queda nada
+    try:
+        file_record = store_sample_file(session, uploaded_file.filename, current_user.id, uploaded_file.file)
+    except SampleIngestError as exc:
+        session.rollback()
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
     session.commit()
+    session.refresh(file_record)
 
     return file_record
 
@@ -63,7 +66,22 @@ def get_sample_requirements(
     if not file_record or file_record.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="File not found")
 
-    reqs = session.exec(
-        select(SampleRequirement).where(SampleRequirement.file_id == file_id)
+    texts = session.exec(
+        select(SampleRequirement.text)
+        .where(SampleRequirement.content_id == file_record.content_id)
+        .order_by(SampleRequirement.id)
     ).all()
-    return [r.text for r in reqs]
+    return list(texts)
+
+
+@router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_sample_file(
+    file_id: int,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    file_record = session.get(SampleFile, file_id)
+    if not file_record or file_record.owner_id != current_user.id:
+        raise HTTPException(status_code=404, detail="File not found")
+    release_sample_file(session, file_record)
+    session.commit()
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session
+
+from app.database import get_session
+from app.api.endpoints.auth import get_current_user
+from app.models.user import User
+from app.models.job import Job
+from app.schemas.job import JobRead
+from app.services.job_queue import PENDING_STATUSES, JobQueueFull, fail_orphaned_jobs, get_job_queue
+
+router = APIRouter()
+
+
+def submit_job(session: Session, **kwargs) -> Job:
+    """Encola un trabajo traduciendo la cola llena a un 429."""
+    try:
+        return get_job_queue().submit(session, **kwargs)
+    except JobQueueFull:
+        raise HTTPException(status_code=429, detail="Too many pending jobs", headers={"Retry-After": "5"})
+
+
+@router.get("/{job_id}", response_model=JobRead)
+def get_job(
+    job_id: int,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    job = session.get(Job, job_id)
+    if not job or job.owner_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Un trabajo sin latido no va a terminar nunca: se informa como fallido
+    if job.status in PENDING_STATUSES and fail_orphaned_jobs(session.get_bind(), job_id=job.id):
+        session.refresh(job)
+    return job
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends
+from typing import Any, Dict
+
+from app.api.endpoints.auth import get_current_user
+from app.models.user import User
+from app.services.admission import get_admission_controller
+from app.utils.ollama_client import get_ollama_client
+from app.utils.password_hasher import get_password_hasher
+from app.utils.user_cache import get_user_cache
+
+router = APIRouter()
+
+
+@router.get("/")
+def get_metrics(current_user: User = Depends(get_current_user)) -> Dict[str, Any]:
+    """Contadores internos del proceso (caché de la IA, etc.)."""
+    client = get_ollama_client()
+    return {
+        "llm_cache": client.cache.stats() if client.cache is not None else None,
+        "ollama_backends": client.pool.stats(),
+        "ollama_requests": client.stats(),
+        "llm_single_flight": client.single_flight.stats() if client.single_flight is not None else None,
+        "llm_admission": get_admission_controller().stats(),
+        "user_cache": get_user_cache().stats(),
+        "password_hasher": get_password_hasher().stats(),
+    }
@@ -8,6 +8,7 @@ from app.database import get_session
 from app.models.user import User
 from app.models.chat_message import ChatMessage
 from app.utils.message_loader import load_message
+from app.services.requirements_snapshot import rebuild_snapshot
 from datetime import datetime
 
 router = APIRouter()
@@ -48,6 +49,8 @@ def create_project(
     )
     session.add(msg1)
     session.add(msg2)
+    # Snapshot vacío desde el principio: los prompts nunca tienen que crearlo
+    rebuild_snapshot(session, project.id)
     session.commit()
 
     return project
@@ -1,8 +1,8 @@
 # api/endpoints/requirements.py
 
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select, func
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlmodel import Session, select
 from typing import List
 from app.models.requirement import Requirement
 from app.schemas.requirement import (
@@ -10,20 +10,30 @@ from app.schemas.requirement import (
     RequirementRead,
     RequirementUpdate,
     RequirementAIGenerateRequest,
+    RequirementBatchRequest,
+    RequirementBatchResponse,
 )
 from app.schemas.chat_message import ChatMessageRead
 from app.api.endpoints.auth import get_current_user
 from app.database import get_session
 from app.models.user import User
 from app.models.project import Project
-from app.models.state_machine import StateMachine
+from app.services.admission import llm_slot
+from app.services.project_state import get_current_state
+from app.services.project_version import not_modified, project_etag
 from app.models.chat_message import ChatMessage
-from app.services.context_builder import get_project_description, format_requirements
+from app.services.context_builder import load_project_context
 from app.services.language import resolve_lang, is_es
 from app.services.chat_flow import build_example_block
-from app.services.requirement_service import parse_requirements_block, append_requirements
+from app.services.requirement_service import (
+    parse_requirements_block,
+    append_requirements,
+    apply_requirement_batch,
+    reserve_requirement_numbers,
+)
+from app.services.requirements_snapshot import apply_requirement_changes
 from app.utils.prompt_loader import load_prompt
-from app.utils.message_loader import load_message
+from app.utils.message_loader import load_localized_message
 from app.utils.ollama_client import call_ollama
 
 router = APIRouter()
@@ -35,11 +45,8 @@ def create_requirement(
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
-    # Calcular número correlativo dentro del proyecto
-    last_number = session.exec(
-        select(func.max(Requirement.number)).where(Requirement.project_id == project_id)
-    ).first() or 0
-    new_number = last_number + 1
+    # Número correlativo dentro del proyecto (reserva atómica)
+    new_number = reserve_requirement_numbers(session, project_id)
 
     requirement = Requirement(
         description=requirement_in.description,
@@ -52,13 +59,38 @@ def create_requirement(
         owner_id=current_user.id,
     )
     session.add(requirement)
+    apply_requirement_changes(session, project_id, upserted=[requirement])
     session.commit()
     session.refresh(requirement)
     return requirement
 
+@router.post("/project/{project_id}/batch", response_model=RequirementBatchResponse)
+def batch_requirements(
+    project_id: int,
+    batch: RequirementBatchRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Aplica una lista de operaciones ``create``/``update``/``delete`` sobre los
+    requisitos del proyecto en una sola transacción y devuelve el resultado de
+    cada una (en el mismo orden). Con ``atomic=true`` cualquier error anula el
+    lote y se responde 409 con el detalle.
+    """
+    project = session.get(Project, project_id)
+    if not project or project.owner_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    result = apply_requirement_batch(session, project_id, batch.operations, current_user.id, atomic=batch.atomic)
+    if batch.atomic and result.failed:
+        raise HTTPException(status_code=409, detail=result.model_dump(mode="json"))
+    return result
+
 @router.get("/project/{project_id}", response_model=List[RequirementRead])
 def list_requirements(
     project_id: int,
+    request: Request,
+    response: Response,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
@@ -66,6 +98,10 @@ def list_requirements(
     if not project or project.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    cached = not_modified(request, response, project_etag(session, project_id, "requirements"))
+    if cached:
+        return cached
+
     requirements = (
         session.exec(
             select(Requirement)
@@ -82,11 +118,7 @@ def generate_requirements_ai(
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
-    sm = session.exec(
-        select(StateMachine)
-        .where(StateMachine.project_id == req.project_id)
-        .order_by(StateMachine.last_updated.desc())
-    ).first()
+    sm = get_current_state(session, req.project_id)
     if not sm or sm.state != "stall":
         raise HTTPException(status_code=400, detail="State machine not in stall")
 
@@ -96,8 +128,9 @@ def generate_requirements_ai(
     if category not in allowed:
         raise HTTPException(status_code=400, detail="Invalid category")
 
-    desc = get_project_description(session, req.project_id) or ""
-    reqs_block = format_requirements(session, req.project_id, lang)
+    ctx = load_project_context(session, req.project_id, lang, history_limit=0)
+    desc = ctx.description or ""
+    reqs_block = ctx.requirements_block()
     ejemplo_block = build_example_block(req.example_samples)
 
     base = load_prompt(
@@ -107,7 +140,8 @@ def generate_requirements_ai(
         requisitos_actuales=reqs_block,
         ejemplo_requisitos_block=ejemplo_block,
     )
-    text = call_ollama(f"Responde SIEMPRE en {lang}.\n\n{base}") or ""
+    with llm_slot(current_user):
+        text = call_ollama(f"Responde SIEMPRE en {lang}.\n\n{base}") or ""
     items = parse_requirements_block(text)
     items = [it for it in items if it["category"] == category]
     append_requirements(session, req.project_id, items, current_user.id)
@@ -127,8 +161,7 @@ def generate_requirements_ai(
         "technical": "technical",
     }
     cat_label = cat_es.get(category, category) if is_es(lang) else cat_en.get(category, category)
-    message_file = "add_req_done_es.txt" if is_es(lang) else "add_req_done_en.txt"
-    content = load_message(message_file, category=cat_label)
+    content = load_localized_message("add_req_done", lang, category=cat_label)
 
     ai = ChatMessage(
         content=content,
@@ -157,6 +190,7 @@ def update_requirement(
         setattr(req, key, value)
     req.updated_at = datetime.utcnow()
     session.add(req)
+    apply_requirement_changes(session, req.project_id, upserted=[req])
     session.commit()
     session.refresh(req)
     return req
@@ -171,4 +205,5 @@ def delete_requirement(
     if not req:
         raise HTTPException(status_code=404, detail="Requirement not found")
     session.delete(req)
+    apply_requirement_changes(session, req.project_id, deleted_ids=[req.id])
     session.commit()
@@ -1,6 +1,6 @@
 # app/api/endpoints/state_machine.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlmodel import Session, select
 from datetime import datetime
 from typing import Dict, Any, List
@@ -10,12 +10,19 @@ from app.api.endpoints.auth import get_current_user
 from app.models.user import User
 from app.models.state_machine import StateMachine
 from app.schemas.state_machine import StateMachineRead, StateMachineUpdate
+from app.schemas.job import JobRead
 from app.models.chat_message import ChatMessage
-from app.models.requirement import Requirement
 
 from app.utils.prompt_loader import load_prompt
 from app.utils.ollama_client import call_ollama
 from app.services.qa_parser import parse_analyze_output
+from app.services.admission import llm_slot
+from app.services.chat_flow import PendingReply
+from app.services.requirements_snapshot import get_requirements_block
+from app.services.project_state import get_current_state
+from app.services.project_version import not_modified, project_etag
+from app.services.prompt_budget import PromptSection, assemble_prompt
+from app.api.endpoints.jobs import submit_job
 from app.utils.message_loader import load_message  # por si lo necesitas más adelante
 
 router = APIRouter()
@@ -36,80 +43,46 @@ def resolve_lang_from_sm(update: StateMachineUpdate, last_sm: StateMachine) -> s
 @router.get("/project/{project_id}", response_model=StateMachineRead)
 def get_state_machine(
     project_id: int,
+    request: Request,
+    response: Response,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
-    state_machine = session.exec(
-        select(StateMachine)
-        .where(StateMachine.project_id == project_id)
-        .order_by(StateMachine.last_updated.desc())
-    ).first()
+    cached = not_modified(request, response, project_etag(session, project_id, "state"))
+    if cached:
+        return cached
+    state_machine = get_current_state(session, project_id)
     if not state_machine:
         raise HTTPException(status_code=404, detail="StateMachine not found")
     return state_machine
 
 
-@router.post("/project/{project_id}", response_model=StateMachineRead)
-def post_state_machine(
-    project_id: int,
-    update: StateMachineUpdate,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
-):
+def prepare_analyze_requisites(
+    session: Session, project_id: int, update: StateMachineUpdate, last_sm: StateMachine
+) -> PendingReply:
     """
-    - Si state == 'analyze_requisites':
+    Prepara la transición a 'analyze_requisites':
         * Construye contexto (requisitos actuales formateados)
-        * Llama a IA con prompt analyze_requisites.txt (forzando idioma)
-        * Separa COMENTARIOS y PREGUNTAS con parse_analyze_output
-        * Publica COMENTARIOS (si existen) como ChatMessage (sender='ai')
-        * Guarda preguntas en StateMachine.extra (questions/current/answers/lang)
-        * Inserta ChatMessage con la primera pregunta
-        * Devuelve el nuevo StateMachine
-    - En otros casos, sólo registra entrada histórica con el 'state' y 'extra' recibidos.
+        * Prompt analyze_requisites.txt (forzando idioma)
+    y devuelve un PendingReply cuyo ``finish`` separa COMENTARIOS y PREGUNTAS,
+    publica los mensajes y crea la nueva entrada de StateMachine.
     """
-    last_sm = session.exec(
-        select(StateMachine)
-        .where(StateMachine.project_id == project_id)
-        .order_by(StateMachine.last_updated.desc())
-    ).first()
+    lang = resolve_lang_from_sm(update, last_sm)
 
-    if update.state == "analyze_requisites":
-        lang = resolve_lang_from_sm(update, last_sm)
-
-        # 1) REQUISITOS ACTUALES (formateados por categoría)
-        reqs = session.exec(
-            select(Requirement)
-            .where(Requirement.project_id == project_id)
-            .order_by(Requirement.category, Requirement.number)
-        ).all()
-
-        def format_requirements(req_list: List[Requirement]) -> str:
-            if not req_list:
-                return "Sin requisitos." if lang.startswith("es") else "No requirements."
-            buckets: Dict[str, List[Requirement]] = {}
-            for r in req_list:
-                buckets.setdefault(r.category.upper(), []).append(r)
-            lines: List[str] = []
-            for cat in ["FUNCTIONAL", "PERFORMANCE", "USABILITY", "SECURITY", "TECHNICAL"]:
-                items = buckets.get(cat, [])
-                lines.append(f"{cat}:")
-                if items:
-                    for r in items:
-                        lines.append(f"{r.number}. {r.description}")
-                else:
-                    lines.append("(sin elementos)" if lang.startswith("es") else "(empty)")
-                lines.append("")  # línea en blanco
-            return "\n".join(lines).strip()
-
-        lista_requisitos = format_requirements(reqs)
-
-        # 2) PROMPT DE ANÁLISIS (forzando idioma)
-        base_prompt = load_prompt("analyze_requisites.txt", lista_requisitos=lista_requisitos)
-        prompt = f"Responde SIEMPRE en {lang}.\n\n{base_prompt}"
-
-        # 3) LLAMADA A OLLAMA → comentarios + preguntas
-        raw = call_ollama(prompt)
-        comments_text, questions_list = parse_analyze_output(raw)
+    # 1) REQUISITOS ACTUALES (bloque materializado por categoría)
+    lista_requisitos = get_requirements_block(session, project_id, lang)
+
+    # 2) PROMPT DE ANÁLISIS (forzando idioma)
+    prompt = assemble_prompt(
+        "analyze_requisites.txt",
+        sections=[PromptSection("lista_requisitos", lista_requisitos, priority=1)],
+        prefix=f"Responde SIEMPRE en {lang}.\n\n",
+        loader=load_prompt,
+    ).text
+
+    def finish(session: Session, raw: str) -> StateMachine:
+        # 3) RESPUESTA DE OLLAMA → comentarios + preguntas
+        comments_text, questions_list = parse_analyze_output(raw or "")
 
         # Red de seguridad: por si no hay preguntas
         if not questions_list:
@@ -158,9 +131,18 @@ def post_state_machine(
         )
         session.add(ai_q)
         session.commit()
+        session.refresh(analyze_state)
 
         return analyze_state
 
+    return PendingReply(prompt=prompt, finish=finish)
+
+
+def _last_state(session: Session, project_id: int):
+    return get_current_state(session, project_id)
+
+
+def record_state(session: Session, project_id: int, update: StateMachineUpdate, last_sm: StateMachine) -> StateMachine:
     # --- Fallback genérico: registrar entrada histórica con el estado recibido ---
     # Conserva lang previo si existía
     lang_prev = resolve_lang_from_sm(update, last_sm)
@@ -178,3 +160,62 @@ def post_state_machine(
     session.commit()
     session.refresh(new_state)
     return new_state
+
+
+@router.post("/project/{project_id}", response_model=StateMachineRead)
+def post_state_machine(
+    project_id: int,
+    update: StateMachineUpdate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    - Si state == 'analyze_requisites':
+        * Llama a IA con el prompt de análisis (ver prepare_analyze_requisites)
+        * Publica COMENTARIOS (si existen) como ChatMessage (sender='ai')
+        * Guarda preguntas en StateMachine.extra (questions/current/answers/lang)
+        * Inserta ChatMessage con la primera pregunta
+        * Devuelve el nuevo StateMachine
+    - En otros casos, sólo registra entrada histórica con el 'state' y 'extra' recibidos.
+    """
+    last_sm = _last_state(session, project_id)
+
+    if update.state == "analyze_requisites":
+        pending = prepare_analyze_requisites(session, project_id, update, last_sm)
+        with llm_slot(current_user):
+            raw = call_ollama(pending.prompt)
+        return pending.finish(session, raw)
+
+    return record_state(session, project_id, update, last_sm)
+
+
+@router.post(
+    "/project/{project_id}/async",
+    response_model=JobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+def post_state_machine_async(
+    project_id: int,
+    update: StateMachineUpdate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Igual que ``POST /state_machine/project/{id}`` pero la llamada a la IA de
+    'analyze_requisites' se ejecuta en la cola de trabajos. ``result`` del Job
+    contiene el StateMachine resultante.
+    """
+    last_sm = _last_state(session, project_id)
+    if update.state == "analyze_requisites":
+        reply = prepare_analyze_requisites(session, project_id, update, last_sm)
+    else:
+        reply = record_state(session, project_id, update, last_sm)
+    return submit_job(
+        session,
+        kind="analyze_requisites" if update.state == "analyze_requisites" else "state_machine",
+        project_id=project_id,
+        owner_id=current_user.id,
+        reply=reply,
+        generate=call_ollama,
+        serialize=lambda sm: StateMachineRead.model_validate(sm).model_dump(mode="json"),
+    )
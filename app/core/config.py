@@ -1,11 +1,50 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 
 class Settings(BaseSettings):
     secret_key: str
     database_url: str
     backend_cors_origins: str = "http://localhost:5173"
     ollama_url: str = "http://localhost:11434"
+    ollama_model: str = "llama3:8b"
+    ollama_backends: str = ""              # "url|modelo1;modelo2|peso,url2" (vacío: sólo ollama_url)
+    ollama_health_interval: float = 15.0   # segundos entre comprobaciones de salud de los nodos
+    ollama_retries: int = 2                # reintentos ante errores de conexión y 5xx
+    ollama_retry_backoff: float = 0.5      # base de la espera exponencial (con jitter)
+    ollama_retry_backoff_max: float = 5.0
+    ollama_breaker_failures: int = 5       # fallos seguidos que abren el cortacircuitos del nodo
+    ollama_breaker_reset_seconds: float = 30.0
+    ollama_hedge: bool = False             # segunda petición a otro nodo si se supera el p95
+    ollama_hedge_initial_delay: float = 10.0  # espera de cobertura hasta tener muestras de latencia
+    ollama_connect_timeout: float = 5.0
+    ollama_read_timeout: float = 60.0
+    ollama_max_connections: int = 20
+    ollama_max_keepalive: int = 10
+    llm_cache_enabled: bool = True
+    llm_cache_max_entries: int = 512
+    llm_cache_ttl_seconds: int = 3600
+    llm_cache_persistent: bool = False
+    llm_single_flight: bool = True         # agrupa generaciones idénticas simultáneas
+    llm_context_tokens: int = 8192
+    llm_context_windows: str = ""          # "modelo=tokens,modelo2=tokens"
+    llm_response_reserve_tokens: int = 1024
+    llm_job_workers: int = 2
+    llm_job_max_pending: int = 100
+    llm_job_orphan_seconds: float = 120.0  # sin latido de su proceso, un trabajo pendiente se da por perdido
+    llm_max_concurrent: int = 4            # generaciones síncronas simultáneas en el proceso
+    llm_max_per_user: int = 1
+    llm_max_waiting: int = 8               # peticiones en espera antes de responder 429
+    llm_admission_wait_seconds: float = 10.0
+    llm_summary_every: int = 12            # mensajes nuevos antes de rehacer el resumen
+    llm_summary_keep_recent: int = 6       # turnos que se envían siempre en crudo
+    bcrypt_rounds: int = 12                # al cambiarlo los hashes se rehacen en el login
+    password_hash_workers: int = 2         # procesos de bcrypt; 0 hashea en el propio proceso
+    password_hash_max_concurrency: int = 8
+    user_cache_ttl_seconds: float = 30.0  # 0 desactiva la caché de usuarios
+    user_cache_max_entries: int = 1024
+    sample_max_bytes: int = 5 * 1024 * 1024
+    sample_max_lines: int = 20000
     sql_echo: bool = False
 
     class Config:
@@ -15,3 +54,18 @@ class Settings(BaseSettings):
     @property
     def cors_origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.backend_cors_origins.split(",") if origin.strip()]
+
+    @property
+    def llm_context_windows_map(self) -> Dict[str, int]:
+        windows: Dict[str, int] = {}
+        for item in self.llm_context_windows.split(","):
+            model, sep, tokens = item.partition("=")
+            if sep and model.strip() and tokens.strip().isdigit():
+                windows[model.strip()] = int(tokens.strip())
+        return windows
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Settings compartidos (se leen del entorno una sola vez)."""
+    return Settings()
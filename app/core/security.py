@@ -1,22 +1,30 @@
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
 
 from app.core.config import Settings
+from app.utils.password_hasher import get_password_hasher
 
 settings = Settings()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGORITHM = "HS256"
 
+# bcrypt se ejecuta en el pool de procesos de PasswordHasher, no en el worker HTTP
+
 def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
+    return get_password_hasher().verify_and_update(plain, hashed)[0]
+
+def verify_and_update_password(plain, hashed) -> Tuple[bool, Optional[str]]:
+    """Como ``verify_password`` pero devuelve un hash nuevo si cambió ``bcrypt_rounds``."""
+    return get_password_hasher().verify_and_update(plain, hashed)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_password_hasher().hash(password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=60))
+    now = datetime.utcnow()
+    expire = now + (expires_delta or timedelta(minutes=60))
     to_encode = data.copy()
-    to_encode.update({"exp": expire})
+    # iat forma parte de la clave de la caché de usuarios
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, settings.secret_key, algorithm=ALGORITHM)
@@ -1,17 +1,52 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from app.api.endpoints import auth
 from app.api.endpoints import projects
 from app.api.endpoints import chat_message
 from app.api.endpoints import state_machine
 from app.api.endpoints import requirements
 from app.api.endpoints import files
+from app.api.endpoints import jobs
+from app.api.endpoints import metrics
 
 
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import Settings
+from app.utils.ollama_client import close_ollama_client
+from app.services.admission import AdmissionRejected
+from app.services.job_queue import fail_orphaned_jobs, shutdown_job_queue
+from app.utils.ollama_pool import OllamaError
+from app.utils.password_hasher import shutdown_password_hasher
+from app.utils.prompt_loader import prompts
+from app.utils.message_loader import messages
 
 settings = Settings()   # 
 app = FastAPI()
+# Plantillas precargadas y validadas: una plantilla rota impide arrancar
+app.add_event_handler("startup", prompts.load_all)
+app.add_event_handler("startup", messages.load_all)
+# Trabajos cuyo proceso murió (sin latido): los de otros workers vivos no se tocan
+app.add_event_handler("startup", fail_orphaned_jobs)
+app.add_event_handler("shutdown", close_ollama_client)
+app.add_event_handler("shutdown", shutdown_job_queue)
+app.add_event_handler("shutdown", shutdown_password_hasher)
+
+
+@app.exception_handler(AdmissionRejected)
+def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    # Sin hueco para otra generación: se rechaza rápido en vez de esperar al timeout
+    return JSONResponse(
+        status_code=429,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(OllamaError)
+def ollama_error_handler(request: Request, exc: OllamaError):
+    # Ollama caído o con el cortacircuitos abierto tras agotar los reintentos
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": "AI service unavailable"}, headers=headers)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,6 +54,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cabeceras que el frontend necesita leer en respuestas CORS
+    expose_headers=["X-Has-More", "ETag"],
 )
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -27,3 +64,5 @@ app.include_router(chat_message.router, prefix="/chat_messages", tags=["chat_mes
 app.include_router(state_machine.router, prefix="/state_machine", tags=["state_machine"])
 app.include_router(requirements.router, prefix="/requirements", tags=["requirements"])
 app.include_router(files.router, prefix="/files", tags=["files"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
@@ -1,11 +1,14 @@
 from typing import Optional
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from datetime import datetime
 
 class ChatMessage(SQLModel, table=True):
+    __table_args__ = (Index("ix_chatmessage_project_id_timestamp", "project_id", "timestamp"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     content: str
     sender: str  # "user" | "ai"
     timestamp: datetime = Field(default_factory=datetime.utcnow)
-    project_id: int = Field(foreign_key="project.id", index=True) 
+    project_id: int = Field(foreign_key="project.id")
     state: str  # "init" | "software_questions" | "new_requisites" | "analyze_requisites" | "stall"
@@ -0,0 +1,16 @@
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+
+
+class ConversationSummary(SQLModel, table=True):
+    """Resumen acumulado de la conversación de un proyecto.
+
+    Cubre todos los mensajes con ``id <= last_message_id``; los posteriores se
+    envían en crudo como "últimos turnos".
+    """
+
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    summary: str = ""
+    last_message_id: int = 0
+    message_count: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
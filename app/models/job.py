@@ -0,0 +1,18 @@
+from typing import Optional, Dict, Any
+from sqlmodel import SQLModel, Field, Column
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSON
+
+class Job(SQLModel, table=True):
+    """Trabajo en segundo plano que ejecuta una generación de la IA."""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str                       # "chat_message" | "analyze_requisites"
+    status: str = "queued"          # "queued" | "running" | "succeeded" | "failed"
+    progress: int = 0               # 0-100
+    project_id: int = Field(foreign_key="project.id", index=True)
+    owner_id: int = Field(foreign_key="user.id")
+    result: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
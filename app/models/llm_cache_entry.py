@@ -0,0 +1,13 @@
+from typing import Optional
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+
+
+class LLMCacheEntry(SQLModel, table=True):
+    """Respuesta de Ollama cacheada por hash de (modelo, prompt, opciones)."""
+
+    key: str = Field(primary_key=True)   # sha256 hex
+    model: str
+    response: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: Optional[datetime] = Field(default=None, index=True)
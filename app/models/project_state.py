@@ -0,0 +1,17 @@
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+
+
+class ProjectState(SQLModel, table=True):
+    """Puntero al estado actual de un proyecto.
+
+    ``statemachine`` es un histórico append-only; esta fila apunta a su última
+    entrada para leer el estado actual por clave primaria. La mantienen los
+    eventos de ``StateMachine`` (ver ``app/models/state_machine.py``).
+    """
+
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    state_machine_id: int = Field(foreign_key="statemachine.id")
+    state: str
+    version: int = 1
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,68 @@
+from typing import Dict, Iterable, Set
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from app.models.chat_message import ChatMessage
+from app.models.requirement import Requirement
+from app.models.state_machine import StateMachine
+from app.utils.bulk_insert import upsert_insert
+
+
+class ProjectVersion(SQLModel, table=True):
+    """Contadores de cambios por proyecto, usados como ETag en los GET.
+
+    Se incrementan en cada escritura de mensajes, requisitos o estados; si la
+    fila no existe aún el proyecto no ha cambiado desde su creación (versión 0).
+    """
+
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    messages: int = 0
+    requirements: int = 0
+    state: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+COUNTERS = ("messages", "requirements", "state")
+
+# Modelo -> contador que invalida
+TRACKED = {ChatMessage: "messages", Requirement: "requirements", StateMachine: "state"}
+
+_table = ProjectVersion.__table__
+
+
+def bump_project_version(connection, project_id: int, counters: Iterable[str]) -> None:
+    """Incrementa ``counters`` del proyecto sobre ``connection`` (Connection o Session).
+
+    Las escrituras ORM ya lo hacen solas; hay que llamarlo tras sentencias
+    masivas (``delete``/``insert`` directos) que no pasan por el flush.
+    """
+    counters = sorted(set(counters))
+    if not counters:
+        return
+    now = datetime.utcnow()
+    # Un único INSERT ... ON CONFLICT DO UPDATE: dos primeras escrituras
+    # concurrentes no chocan en la clave primaria
+    stmt = upsert_insert(connection, _table).values(
+        project_id=project_id, updated_at=now,
+        **{name: 1 if name in counters else 0 for name in COUNTERS},
+    )
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[_table.c.project_id],
+        set_={"updated_at": now, **{name: _table.c[name] + 1 for name in counters}},
+    ))
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _bump_on_flush(session, flush_context) -> None:
+    changed: Dict[int, Set[str]] = {}
+    for obj in list(session.new) + list(session.deleted) + [o for o in session.dirty if session.is_modified(o)]:
+        counter = TRACKED.get(type(obj))
+        if counter and obj.project_id is not None:
+            changed.setdefault(obj.project_id, set()).add(counter)
+    if not changed:
+        return
+    connection = session.connection()
+    for project_id, counters in sorted(changed.items()):
+        bump_project_version(connection, project_id, counters)
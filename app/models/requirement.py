@@ -2,9 +2,12 @@
 
 from typing import Optional
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from datetime import datetime
 
 class Requirement(SQLModel, table=True):
+    __table_args__ = (Index("ix_requirement_project_id_category_number", "project_id", "category", "number"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     description: str
     status: str = "draft"          # 'draft', 'approved', 'rejected', 'in-review'
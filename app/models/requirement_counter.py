@@ -0,0 +1,12 @@
+from sqlmodel import SQLModel, Field
+
+
+class RequirementCounter(SQLModel, table=True):
+    """Último número de requisito asignado en cada proyecto.
+
+    Se reservan rangos con un ``UPDATE ... RETURNING`` atómico, de modo que
+    altas concurrentes nunca reciben el mismo número.
+    """
+
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    last_number: int = 0
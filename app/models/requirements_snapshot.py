@@ -0,0 +1,20 @@
+from typing import Optional, Dict, Any
+from sqlmodel import SQLModel, Field, Column
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSON
+
+
+class RequirementsSnapshot(SQLModel, table=True):
+    """Bloque de requisitos ya renderizado para los prompts de un proyecto.
+
+    Se mantiene al día en cada alta/edición/baja de requisitos, de modo que los
+    prompts lo leen con una lectura por clave primaria.
+    """
+
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    version: int = 0
+    # {"<requirement_id>": [category, number, description]}
+    items: Optional[Dict[str, Any]] = Field(default_factory=dict, sa_column=Column(JSON))
+    text_es: str = ""
+    text_en: str = ""
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
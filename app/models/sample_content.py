@@ -0,0 +1,18 @@
+from typing import Optional
+from sqlmodel import SQLModel, Field
+from datetime import datetime
+
+
+class SampleContent(SQLModel, table=True):
+    """Contenido de un fichero de ejemplo, compartido por todas las subidas idénticas.
+
+    Las líneas (``SampleRequirement``) cuelgan de aquí; ``ref_count`` cuenta los
+    ``SampleFile`` que lo usan y al llegar a 0 se borra con sus líneas.
+    """
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sha256: str = Field(index=True, unique=True)
+    size: int = 0
+    line_count: int = 0
+    ref_count: int = 1
+    created_at: datetime = Field(default_factory=datetime.utcnow)
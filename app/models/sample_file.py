@@ -8,3 +8,4 @@ class SampleFile(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str
     owner_id: int = Field(foreign_key="user.id")
+    content_id: int = Field(foreign_key="samplecontent.id", index=True)
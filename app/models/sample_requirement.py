@@ -3,8 +3,11 @@ from sqlmodel import SQLModel, Field
 
 
 class SampleRequirement(SQLModel, table=True):
-    """A single sample requirement line parsed from an uploaded file."""
+    """A single sample requirement line parsed from an uploaded file.
+
+    Lines belong to the (deduplicated) ``SampleContent``, not to each upload.
+    """
 
     id: Optional[int] = Field(default=None, primary_key=True)
     text: str
-    file_id: int = Field(foreign_key="samplefile.id")
+    content_id: int = Field(foreign_key="samplecontent.id", index=True)
@@ -1,11 +1,46 @@
 from typing import Optional, Dict, Any
 from sqlmodel import SQLModel, Field, Column
+from sqlalchemy import Index, event
 from datetime import datetime
 from sqlalchemy.dialects.postgresql import JSON
+from app.models.project_state import ProjectState
+from app.utils.bulk_insert import upsert_insert
 
 class StateMachine(SQLModel, table=True):
+    # Estado actual = última fila por proyecto: el índice sirve el ORDER BY sin ordenar
+    __table_args__ = (Index("ix_statemachine_project_id_last_updated", "project_id", "last_updated"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    project_id: int = Field(foreign_key="project.id", index=True)  # sin unique!
+    project_id: int = Field(foreign_key="project.id")  # sin unique!
     state: str
     last_updated: datetime = Field(default_factory=datetime.utcnow)
     extra: Optional[Dict[str, Any]] = Field(default_factory=dict, sa_column=Column(JSON))
+
+
+# --- Puntero al estado actual (ProjectState) ---
+# Se actualiza en la misma transacción que la fila del histórico, así que
+# cualquier alta de StateMachine (transiciones, tests, scripts) lo mantiene al día.
+_head = ProjectState.__table__
+
+
+@event.listens_for(StateMachine, "after_insert")
+def _move_head(mapper, connection, target: StateMachine) -> None:
+    values = {"state_machine_id": target.id, "state": target.state, "updated_at": datetime.utcnow()}
+    # Upsert en una sola sentencia: la primera transición de dos peticiones a la
+    # vez no choca en la clave primaria
+    stmt = upsert_insert(connection, _head).values(project_id=target.project_id, version=1, **values)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[_head.c.project_id],
+        set_={"version": _head.c.version + 1, **values},
+    ))
+
+
+@event.listens_for(StateMachine, "after_update")
+def _touch_head(mapper, connection, target: StateMachine) -> None:
+    # Cambios in situ de ``extra`` (avance de preguntas) sobre la fila actual
+    connection.execute(
+        _head.update()
+        .where(_head.c.project_id == target.project_id)
+        .where(_head.c.state_machine_id == target.id)
+        .values(version=_head.c.version + 1, state=target.state, updated_at=datetime.utcnow())
+    )
@@ -1,6 +1,7 @@
 from typing import List, Optional
 from sqlmodel import SQLModel, Field, Relationship, Column
 from datetime import datetime
+from sqlalchemy import event
 from sqlalchemy.dialects.postgresql import JSON
 
 
@@ -17,3 +18,12 @@ class User(SQLModel, table=True):
     active: bool = True
     preferences: Optional[dict] = Field(default_factory=dict, sa_column=Column(JSON))
     # Notas: projects y exampleFiles se añadirán después como relaciones
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: User) -> None:
+    # Red de seguridad para escrituras fuera de los endpoints de /auth (p. ej. desactivaciones)
+    from app.utils.user_cache import get_user_cache
+
+    get_user_cache().invalidate(target.id)
@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import Optional, Dict, Any
+from datetime import datetime
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress: int
+    project_id: int
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
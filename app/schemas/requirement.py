@@ -1,7 +1,7 @@
 # schemas/requirement.py
 
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
 from datetime import datetime
 
 class RequirementCreate(BaseModel):
@@ -40,3 +40,34 @@ class RequirementAIGenerateRequest(BaseModel):
     category: str
     language: Optional[str] = None
     example_samples: Optional[List[str]] = None
+
+
+class RequirementBatchOp(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None               # obligatorio en update/delete
+    description: Optional[str] = None      # obligatorio en create
+    status: Optional[str] = None
+    category: Optional[str] = None
+    priority: Optional[str] = None
+    visual_reference: Optional[str] = None
+
+
+class RequirementBatchRequest(BaseModel):
+    operations: List[RequirementBatchOp] = Field(..., min_length=1, max_length=500)
+    # Si es True, cualquier operación fallida anula todo el lote
+    atomic: bool = False
+
+
+class RequirementBatchItemResult(BaseModel):
+    index: int
+    op: str
+    ok: bool
+    requirement: Optional[RequirementRead] = None
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class RequirementBatchResponse(BaseModel):
+    applied: int
+    failed: int
+    results: List[RequirementBatchItemResult]
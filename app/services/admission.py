@@ -0,0 +1,185 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from sqlalchemy import inspect
+
+from app.core.config import get_settings
+
+
+class AdmissionRejected(Exception):
+    """No hay hueco para otra generación de la IA; se traduce a un 429."""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Control de admisión de las generaciones síncronas de la IA.
+
+    Limita las generaciones en curso a ``max_concurrent`` en todo el proceso y
+    a ``max_per_user`` por usuario (contando también las que esperan). Si no
+    hay hueco, la petición espera como mucho ``wait_seconds`` en una cola de
+    ``max_waiting`` plazas; si la cola está llena o se agota la espera se
+    rechaza enseguida con ``AdmissionRejected`` en lugar de acabar en timeout.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_per_user: int = 1,
+        max_waiting: int = 8,
+        wait_seconds: float = 10.0,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_user = max(1, max_per_user)
+        self.max_waiting = max(0, max_waiting)
+        self.wait_seconds = wait_seconds
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._per_user: Dict[Any, int] = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.max_waiting_seen = 0
+        self.wait_seconds_total = 0.0
+        self._hold_avg = 0.0  # media móvil de la duración de una generación
+
+    def _retry_after(self) -> int:
+        # Estimación: lo que tardan en liberarse las generaciones por delante
+        per_slot = self._hold_avg or self.wait_seconds or 1.0
+        ahead = (self._waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(per_slot * ahead))
+
+    def _reject(self, detail: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(detail, self._retry_after())
+
+    def acquire(self, user_id: Any) -> None:
+        start = time.monotonic()
+        with self._cond:
+            if self._per_user.get(user_id, 0) >= self.max_per_user:
+                raise self._reject("Too many concurrent AI requests for this user")
+            if self._active >= self.max_concurrent or self._waiting:
+                if self._waiting >= self.max_waiting:
+                    raise self._reject("AI service busy, try again later")
+                self._waiting += 1
+                self.max_waiting_seen = max(self.max_waiting_seen, self._waiting)
+                self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+                deadline = start + self.wait_seconds
+                try:
+                    while self._active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            if self._active < self.max_concurrent:
+                                break
+                            self._release_user(user_id)
+                            raise self._reject("AI service busy, try again later")
+                finally:
+                    self._waiting -= 1
+                    # Despierta al siguiente por si este se ha ido sin ocupar hueco
+                    self._cond.notify()
+            else:
+                self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self._active += 1
+            self.admitted += 1
+            self.wait_seconds_total += time.monotonic() - start
+
+    def _release_user(self, user_id: Any) -> None:
+        count = self._per_user.get(user_id, 0) - 1
+        if count > 0:
+            self._per_user[user_id] = count
+        else:
+            self._per_user.pop(user_id, None)
+
+    def release(self, user_id: Any, held: Optional[float] = None) -> None:
+        with self._cond:
+            self._active -= 1
+            self._release_user(user_id)
+            if held is not None:
+                self._hold_avg = held if not self._hold_avg else 0.8 * self._hold_avg + 0.2 * held
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, user_id: Any) -> Iterator[None]:
+        """Ocupa un hueco durante el bloque (lanza ``AdmissionRejected`` si no lo hay)."""
+        self.acquire(user_id)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(user_id, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_waiting": self.max_waiting,
+                "max_waiting_seen": self.max_waiting_seen,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.admitted, 3) if self.admitted else 0.0,
+                "hold_ms_avg": round(self._hold_avg * 1000, 3),
+            }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Controlador compartido por el proceso (se crea en el primer uso)."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                settings = get_settings()
+                _controller = AdmissionController(
+                    max_concurrent=settings.llm_max_concurrent,
+                    max_per_user=settings.llm_max_per_user,
+                    max_waiting=settings.llm_max_waiting,
+                    wait_seconds=settings.llm_admission_wait_seconds,
+                )
+    return _controller
+
+
+def _user_key(user: Any) -> Any:
+    # Clave de identidad sin refrescar la instancia (puede llegar expirada o detached)
+    state = inspect(user, raiseerr=False)
+    if state is not None and state.identity:
+        return state.identity[0]
+    return getattr(user, "id", user)
+
+
+def llm_slot(user: Any):
+    """Atajo para ``with llm_slot(current_user): call_ollama(...)``."""
+    return get_admission_controller().slot(_user_key(user))
+
+
+def hold_llm_slot(user: Any) -> Callable[[], None]:
+    """Ocupa un hueco y devuelve la función que lo libera (idempotente).
+
+    Para respuestas en streaming, donde la generación sigue después de que
+    termine el endpoint; lanza ``AdmissionRejected`` igual que ``llm_slot``.
+    """
+    controller = get_admission_controller()
+    key = _user_key(user)
+    controller.acquire(key)
+    start = time.monotonic()
+    released = threading.Event()
+    guard = threading.Lock()
+
+    def release() -> None:
+        with guard:
+            if released.is_set():
+                return
+            released.set()
+        controller.release(key, time.monotonic() - start)
+
+    return release
@@ -1,5 +1,6 @@
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable, Union, Any
 from sqlmodel import Session, select
 from app.models.chat_message import ChatMessage
 from app.models.state_machine import StateMachine
@@ -8,15 +9,28 @@ from app.models.user import User
 from app.schemas.chat_message import ChatMessageCreate
 from app.utils.prompt_loader import load_prompt
 from app.utils.message_loader import load_message
-from app.utils.ollama_client import call_ollama
 
 from app.services.language import resolve_lang, is_es
-from app.services.context_builder import (
-    get_project_description,
-    format_requirements,
-    get_recent_history,
-)
+from app.services.context_builder import get_project_description, load_project_context
 from app.services.requirement_service import parse_requirements_block, replace_requirements
+from app.services.prompt_budget import PromptSection, assemble_prompt
+from app.services.conversation_summary import schedule_summary_refresh
+from app.services.project_state import get_current_state
+
+
+@dataclass
+class PendingReply:
+    """Respuesta que depende de una generación de la IA.
+
+    ``prompt`` es el texto a enviar a Ollama y ``finish(session, texto)``
+    persiste el resultado (mensajes, estado, requisitos) y devuelve el objeto
+    final. Separar ambas fases permite generar de forma bloqueante, en
+    streaming o en segundo plano reutilizando la misma lógica.
+    """
+
+    prompt: str
+    finish: Callable[[Session, str], Any]
+
 
 # ---------- helper para ejemplo de estilo ----------
 def build_example_block(lines: Optional[List[str]]) -> str:
@@ -29,41 +43,71 @@ def build_example_block(lines: Optional[List[str]]) -> str:
     return f'\nEJEMPLO DE ESTILO:\n"""\n{joined}\n"""\n'
 # ---------------------------------------------------
 
-def handle_init(session: Session, current_user: User, msg: ChatMessageCreate, sm: Optional[StateMachine]):
-    lang = resolve_lang(msg.language, sm)
-    new_sm = StateMachine(
-        project_id=msg.project_id,
-        state="software_questions",
-        last_updated=datetime.utcnow(),
-        extra={"lang": lang},
-    )
-    session.add(new_sm)
-    session.commit()
-    session.refresh(new_sm)
+def dispatch_message(
+    session: Session, current_user: User, message_in: ChatMessageCreate
+) -> Union[ChatMessage, PendingReply]:
+    """Enruta el mensaje según el estado actual del proyecto.
 
-    base_prompt = load_prompt("project_questions.txt", descripcion_usuario=msg.content)
-    questions_txt = call_ollama(f"Responde SIEMPRE en {lang}.\n\n{base_prompt}")
-    questions = [q.strip() for q in (questions_txt or "").splitlines() if q.strip()]
-    new_sm.extra = {"lang": lang, "questions": questions, "current": 0, "answers": []}
-    session.add(new_sm)
-    session.commit()
+    Devuelve el ``ChatMessage`` ya persistido cuando no hace falta la IA, o un
+    ``PendingReply`` cuando la respuesta requiere una generación.
+    """
+    state_machine = get_current_state(session, message_in.project_id)
+    state = state_machine.state if state_machine else "init"
 
-    session.add(ChatMessage(
-        content=msg.content, sender="user",
-        project_id=msg.project_id, state="init",
-        timestamp=datetime.utcnow(),
-    ))
+    if message_in.sender == "user" and state == "init":
+        return handle_init(session, current_user, message_in, state_machine)
 
-    first_q = questions[0] if questions else ("No se generaron preguntas." if is_es(lang) else "No questions were generated.")
-    ai = ChatMessage(
-        content=first_q, sender="ai",
-        project_id=msg.project_id, state="software_questions",
-        timestamp=datetime.utcnow(),
-    )
-    session.add(ai)
-    session.commit()
-    session.refresh(ai)
-    return ai
+    if message_in.sender == "user" and state == "software_questions":
+        progressed = handle_software_questions(session, current_user, message_in, state_machine)
+        if progressed is not None:
+            return progressed
+        return finish_questions_generate_reqs(session, current_user, message_in, state_machine)
+
+    if message_in.sender == "ai":
+        return save_ai_message(session, message_in, state)
+
+    if message_in.sender == "user" and state == "analyze_requisites":
+        return handle_analyze_reply(session, current_user, message_in, state_machine)
+
+    if message_in.sender == "user" and state == "stall":
+        return handle_stall(session, current_user, message_in, state_machine)
+
+    return save_generic(session, message_in, state)
+
+def handle_init(session: Session, current_user: User, msg: ChatMessageCreate, sm: Optional[StateMachine]) -> PendingReply:
+    lang = resolve_lang(msg.language, sm)
+    project_id = msg.project_id
+    content = msg.content
+    received_at = datetime.utcnow()
+
+    base_prompt = load_prompt("project_questions.txt", descripcion_usuario=content)
+
+    def finish(session: Session, questions_txt: str) -> ChatMessage:
+        questions = [q.strip() for q in (questions_txt or "").splitlines() if q.strip()]
+        session.add(StateMachine(
+            project_id=project_id,
+            state="software_questions",
+            last_updated=datetime.utcnow(),
+            extra={"lang": lang, "questions": questions, "current": 0, "answers": []},
+        ))
+        session.add(ChatMessage(
+            content=content, sender="user",
+            project_id=project_id, state="init",
+            timestamp=received_at,
+        ))
+
+        first_q = questions[0] if questions else ("No se generaron preguntas." if is_es(lang) else "No questions were generated.")
+        ai = ChatMessage(
+            content=first_q, sender="ai",
+            project_id=project_id, state="software_questions",
+            timestamp=datetime.utcnow(),
+        )
+        session.add(ai)
+        session.commit()
+        session.refresh(ai)
+        return ai
+
+    return PendingReply(prompt=f"Responde SIEMPRE en {lang}.\n\n{base_prompt}", finish=finish)
 
 def handle_software_questions(session: Session, current_user: User, msg: ChatMessageCreate, sm: StateMachine):
     extra = sm.extra or {}
@@ -75,6 +119,11 @@ def handle_software_questions(session: Session, current_user: User, msg: ChatMes
     ans.append(msg.content)
     idx += 1
 
+    if idx >= len(qs):
+        # Última respuesta: se guarda en el ``finish`` de la generación, así un
+        # 429 o un fallo de la IA no la deja registrada a medias
+        return None
+
     session.add(ChatMessage(
         content=msg.content, sender="user",
         project_id=msg.project_id, state="software_questions",
@@ -82,33 +131,32 @@ def handle_software_questions(session: Session, current_user: User, msg: ChatMes
     ))
     session.commit()
 
-    if idx < len(qs):
-        extra.update({"current": idx, "answers": ans, "lang": lang})
-        sm.extra = extra
-        sm.last_updated = datetime.utcnow()
-        session.add(sm)
-        session.commit()
-
-        ai = ChatMessage(
-            content=qs[idx], sender="ai",
-            project_id=msg.project_id, state="software_questions",
-            timestamp=datetime.utcnow(),
-        )
-        session.add(ai)
-        session.commit()
-        session.refresh(ai)
-        return ai
-
-    sm.extra = {"lang": lang, "questions": qs, "answers": ans}
+    extra.update({"current": idx, "answers": ans, "lang": lang})
+    sm.extra = extra
+    sm.last_updated = datetime.utcnow()
     session.add(sm)
     session.commit()
-    return None
 
-def finish_questions_generate_reqs(session: Session, current_user: User, msg: ChatMessageCreate, sm: StateMachine):
+    ai = ChatMessage(
+        content=qs[idx], sender="ai",
+        project_id=msg.project_id, state="software_questions",
+        timestamp=datetime.utcnow(),
+    )
+    session.add(ai)
+    session.commit()
+    session.refresh(ai)
+    return ai
+
+def finish_questions_generate_reqs(session: Session, current_user: User, msg: ChatMessageCreate, sm: StateMachine) -> PendingReply:
     lang = sm.extra.get("lang", "es")
-    desc = get_project_description(session, msg.project_id) or ""
+    project_id = msg.project_id
+    owner_id = current_user.id
+    sm_id = sm.id
+    content = msg.content
+    received_at = datetime.utcnow()
+    desc = get_project_description(session, project_id) or ""
     qs = sm.extra.get("questions", [])
-    ans = sm.extra.get("answers", [])
+    ans = list(sm.extra.get("answers", [])) + [content]
     qa_block = "\n".join(f"{q}\n{a}" for q, a in zip(qs, ans))
 
     # NUEVO: ejemplo de estilo desde el mensaje del usuario (si lo envía)
@@ -120,30 +168,44 @@ def finish_questions_generate_reqs(session: Session, current_user: User, msg: Ch
         preguntas_y_respuestas=qa_block,
         ejemplo_estilo_block=ejemplo_estilo_block,
     )
-    text = call_ollama(f"Responde SIEMPRE en {lang}.\n\n{base}")
-    items = parse_requirements_block(text or "")
 
-    replace_requirements(session, msg.project_id, items, current_user.id)
+    def finish(session: Session, text: str) -> ChatMessage:
+        items = parse_requirements_block(text or "")
+
+        session.add(ChatMessage(
+            content=content, sender="user",
+            project_id=project_id, state="software_questions",
+            timestamp=received_at,
+        ))
+        questions_sm = session.get(StateMachine, sm_id)
+        if questions_sm is not None:
+            questions_sm.extra = {"lang": lang, "questions": qs, "answers": ans}
+            session.add(questions_sm)
+
+        replace_requirements(session, project_id, items, owner_id)
+
+        session.add(StateMachine(
+            project_id=project_id, state="new_requisites",
+            last_updated=datetime.utcnow(),
+            extra={"lang": lang, "questions": qs, "answers": ans},
+        ))
+        session.commit()
 
-    session.add(StateMachine(
-        project_id=msg.project_id, state="new_requisites",
-        last_updated=datetime.utcnow(),
-        extra={"lang": lang, "questions": qs, "answers": ans},
-    ))
-    session.commit()
+        ai = ChatMessage(
+            content=load_message("new_req_end.txt"),
+            sender="ai", project_id=project_id,
+            state="new_requisites", timestamp=datetime.utcnow(),
+        )
+        session.add(ai)
+        session.commit()
+        session.refresh(ai)
+        return ai
 
-    ai = ChatMessage(
-        content=load_message("new_req_end.txt"),
-        sender="ai", project_id=msg.project_id,
-        state="new_requisites", timestamp=datetime.utcnow(),
-    )
-    session.add(ai)
-    session.commit()
-    session.refresh(ai)
-    return ai
+    return PendingReply(prompt=f"Responde SIEMPRE en {lang}.\n\n{base}", finish=finish)
 
 def handle_analyze_reply(session: Session, current_user: User, msg: ChatMessageCreate, sm: StateMachine):
-    analyze_sm = session.exec(
+    # Normalmente la sesión de análisis es el propio estado actual
+    analyze_sm = sm if sm is not None and sm.state == "analyze_requisites" else session.exec(
         select(StateMachine)
         .where(StateMachine.project_id == msg.project_id)
         .where(StateMachine.state == "analyze_requisites")
@@ -158,18 +220,18 @@ def handle_analyze_reply(session: Session, current_user: User, msg: ChatMessageC
     idx: int = int(extra.get("current", 0))
     answers: List[str] = list(extra.get("answers", []))
 
-    # Guarda respuesta del usuario
-    session.add(ChatMessage(
-        content=msg.content, sender="user",
-        project_id=msg.project_id, state="analyze_requisites",
-        timestamp=datetime.utcnow(),
-    ))
-    session.commit()
-
     answers.append(msg.content)
     idx += 1
 
     if idx < len(questions):
+        # Guarda respuesta del usuario
+        session.add(ChatMessage(
+            content=msg.content, sender="user",
+            project_id=msg.project_id, state="analyze_requisites",
+            timestamp=datetime.utcnow(),
+        ))
+        session.commit()
+
         extra.update({"answers": answers, "current": idx, "lang": lang})
         analyze_sm.extra = extra
         analyze_sm.last_updated = datetime.utcnow()
@@ -187,80 +249,114 @@ def handle_analyze_reply(session: Session, current_user: User, msg: ChatMessageC
         return ai
 
     # No quedan preguntas -> mejorar requisitos y pasar a stall
-    desc = get_project_description(session, msg.project_id) or ""
-    reqs_block = format_requirements(session, msg.project_id, lang)
+    project_id = msg.project_id
+    owner_id = current_user.id
+    content = msg.content
+    received_at = datetime.utcnow()
+    ctx = load_project_context(session, project_id, lang, history_limit=0)
+    desc = ctx.description or ""
+    reqs_block = ctx.requirements_block()
     qa_block = "\n".join(f"{q}\n{a}" for q, a in zip(questions, answers))
 
     # NUEVO: ejemplo de estilo desde el mensaje del usuario en esta última respuesta (si lo envía)
     ejemplo_estilo_block = build_example_block(msg.example_samples)
 
-    base = load_prompt(
+    # Se recortan primero el ejemplo de estilo y las respuestas más antiguas.
+    # Los requisitos actuales nunca se recortan: la respuesta sustituye a la
+    # lista completa y lo que el modelo no vea se borraría.
+    assembled = assemble_prompt(
         "improve_requisites.txt",
-        descripcion_usuario=desc,
-        preguntas_y_respuestas=qa_block,
-        requisitos_actuales=reqs_block,
-        ejemplo_estilo_block=ejemplo_estilo_block,
+        sections=[
+            PromptSection("ejemplo_estilo_block", ejemplo_estilo_block, priority=1, keep="none"),
+            PromptSection("preguntas_y_respuestas", qa_block, priority=2, keep="end"),
+            PromptSection("requisitos_actuales", reqs_block, priority=3, keep="never"),
+            PromptSection("descripcion_usuario", desc, priority=4),
+        ],
+        prefix=f"Responde SIEMPRE en {lang}.\n\n",
     )
-    text = call_ollama(f"Responde SIEMPRE en {lang}.\n\n{base}")
-    items = parse_requirements_block(text or "")
+    prompt = assembled.text
+    # Si aun así no cabe, el modelo puede perder parte de la lista: no se borra nada
+    fits = assembled.tokens <= assembled.budget
+
+    def finish(session: Session, text: str) -> ChatMessage:
+        # Guarda respuesta del usuario
+        session.add(ChatMessage(
+            content=content, sender="user",
+            project_id=project_id, state="analyze_requisites",
+            timestamp=received_at,
+        ))
+        session.commit()
 
-    replace_requirements(session, msg.project_id, items, current_user.id)
+        items = parse_requirements_block(text or "")
 
-    session.add(StateMachine(
-        project_id=msg.project_id, state="stall",
-        last_updated=datetime.utcnow(),
-        extra={"from": "analyze_requisites", "answers_count": len(answers), "lang": lang},
-    ))
-    session.commit()
+        replace_requirements(session, project_id, items, owner_id, delete_missing=fits)
 
-    final_text = (
-        "Análisis completado y requisitos actualizados. Puedes seguir editando y pulsar **Analizar con IA** cuando quieras iterar de nuevo."
-        if is_es(lang) else
-        "Analysis completed and requirements updated. You can keep editing and press **Analyze with AI** to iterate again."
-    )
-    ai = ChatMessage(
-        content=final_text, sender="ai",
-        project_id=msg.project_id, state="stall",
-        timestamp=datetime.utcnow(),
-    )
-    session.add(ai)
-    session.commit()
-    session.refresh(ai)
-    return ai
+        session.add(StateMachine(
+            project_id=project_id, state="stall",
+            last_updated=datetime.utcnow(),
+            extra={"from": "analyze_requisites", "answers_count": len(answers), "lang": lang},
+        ))
+        session.commit()
 
-def handle_stall(session: Session, current_user: User, msg: ChatMessageCreate, sm: StateMachine):
-    lang = resolve_lang(msg.language, sm)
-    user_msg = ChatMessage(
-        content=msg.content, sender="user",
-        project_id=msg.project_id, state="stall",
-        timestamp=datetime.utcnow(),
-    )
-    session.add(user_msg)
-    session.commit()
-    session.refresh(user_msg)
+        final_text = (
+            "Análisis completado y requisitos actualizados. Puedes seguir editando y pulsar **Analizar con IA** cuando quieras iterar de nuevo."
+            if is_es(lang) else
+            "Analysis completed and requirements updated. You can keep editing and press **Analyze with AI** to iterate again."
+        )
+        ai = ChatMessage(
+            content=final_text, sender="ai",
+            project_id=project_id, state="stall",
+            timestamp=datetime.utcnow(),
+        )
+        session.add(ai)
+        session.commit()
+        session.refresh(ai)
+        return ai
 
-    desc = get_project_description(session, msg.project_id) or ("(sin descripción)" if is_es(lang) else "(no description)")
-    reqs_block = format_requirements(session, msg.project_id, lang)
-    history = get_recent_history(session, msg.project_id, exclude_id=user_msg.id, limit=14, lang=lang)
+    return PendingReply(prompt=prompt, finish=finish)
 
-    base_prompt = load_prompt(
+def handle_stall(session: Session, current_user: User, msg: ChatMessageCreate, sm: StateMachine) -> PendingReply:
+    lang = resolve_lang(msg.language, sm)
+    project_id = msg.project_id
+    content = msg.content
+    received_at = datetime.utcnow()
+
+    # Todo lo que el resumen aún no cubre (lo acota el propio refresco del
+    # resumen); si no cabe, el presupuesto recorta lo más antiguo
+    ctx = load_project_context(session, project_id, lang, history_limit=None, use_summary=True)
+    desc = ctx.description or ("(sin descripción)" if is_es(lang) else "(no description)")
+    reqs_block = ctx.requirements_block()
+    history = ctx.conversation_block()
+
+    # El historial antiguo es lo primero que se sacrifica si no cabe en el contexto
+    base_prompt = assemble_prompt(
         "stall_chat.txt",
-        lang=lang,
-        descripcion_usuario=desc,
-        requisitos_actuales=reqs_block,
-        historial_chat=history,
-        mensaje_usuario=msg.content,
-    )
-    ai_text = call_ollama(base_prompt) or ""
-    ai = ChatMessage(
-        content=ai_text.strip(), sender="ai",
-        project_id=msg.project_id, state="stall",
-        timestamp=datetime.utcnow(),
-    )
-    session.add(ai)
-    session.commit()
-    session.refresh(ai)
-    return ai
+        sections=[
+            PromptSection("historial_chat", history, priority=1, keep="end"),
+            PromptSection("requisitos_actuales", reqs_block, priority=2),
+            PromptSection("descripcion_usuario", desc, priority=3),
+        ],
+        fixed={"lang": lang, "mensaje_usuario": content},
+    ).text
+
+    def finish(session: Session, ai_text: str) -> ChatMessage:
+        session.add(ChatMessage(
+            content=content, sender="user",
+            project_id=project_id, state="stall",
+            timestamp=received_at,
+        ))
+        ai = ChatMessage(
+            content=(ai_text or "").strip(), sender="ai",
+            project_id=project_id, state="stall",
+            timestamp=datetime.utcnow(),
+        )
+        session.add(ai)
+        session.commit()
+        session.refresh(ai)
+        schedule_summary_refresh(session, project_id, lang)
+        return ai
+
+    return PendingReply(prompt=base_prompt, finish=finish)
 
 def save_ai_message(session: Session, msg: ChatMessageCreate, state: str):
     ai = ChatMessage(
@@ -1,8 +1,16 @@
-from typing import List, Dict, Optional
+from dataclasses import dataclass
+from typing import List, Optional, Iterable, Tuple
 from datetime import datetime
+from sqlalchemy import Integer, String, cast, func, literal, null, union_all
 from sqlmodel import Session, select
 from app.models.chat_message import ChatMessage
-from app.models.requirement import Requirement
+from app.models.conversation_summary import ConversationSummary
+from app.models.requirements_snapshot import RequirementsSnapshot
+from app.services.language import is_es
+from app.services.requirements_snapshot import get_requirements_block
+
+# (sender, content)
+HistoryLine = Tuple[str, str]
 
 def get_project_description(session: Session, project_id: int) -> Optional[str]:
     msg = session.exec(
@@ -14,30 +22,19 @@ def get_project_description(session: Session, project_id: int) -> Optional[str]:
     ).first()
     return msg.content if msg else None
 
+def render_history(rows: Iterable[HistoryLine], lang: str = "es") -> str:
+    def who(s: str) -> str:
+        if lang.lower().startswith("es"):
+            return "Usuario" if s == "user" else "IA"
+        return "User" if s == "user" else "AI"
+
+    rows = list(rows)
+    if not rows:
+        return "(sin historial)" if lang.lower().startswith("es") else "(no history)"
+    return "\n".join(f"{who(sender)}: {content}" for sender, content in rows)
+
 def format_requirements(session: Session, project_id: int, lang: str = "es") -> str:
-    reqs = session.exec(
-        select(Requirement)
-        .where(Requirement.project_id == project_id)
-        .order_by(Requirement.category, Requirement.number)
-    ).all()
-    if not reqs:
-        return "Sin requisitos." if lang.lower().startswith("es") else "No requirements."
-
-    buckets: Dict[str, List[Requirement]] = {}
-    for r in reqs:
-        buckets.setdefault(r.category.upper(), []).append(r)
-
-    lines: List[str] = []
-    for cat in ["FUNCTIONAL", "PERFORMANCE", "USABILITY", "SECURITY", "TECHNICAL"]:
-        items = buckets.get(cat, [])
-        lines.append(f"{cat}:")
-        if items:
-            for r in items:
-                lines.append(f"{r.number}. {r.description}")
-        else:
-            lines.append("(sin elementos)" if lang.lower().startswith("es") else "(empty)")
-        lines.append("")
-    return "\n".join(lines).strip()
+    return get_requirements_block(session, project_id, lang)
 
 def get_recent_history(
     session: Session,
@@ -51,12 +48,147 @@ def get_recent_history(
         q = q.where(ChatMessage.id != exclude_id)
     rows = session.exec(q.limit(limit)).all()
     rows = list(reversed(rows))
+    return render_history(((m.sender, m.content) for m in rows), lang)
 
-    def who(s: str) -> str:
-        if lang.lower().startswith("es"):
-            return "Usuario" if s == "user" else "IA"
-        return "User" if s == "user" else "AI"
 
-    if not rows:
-        return "(sin historial)" if lang.lower().startswith("es") else "(no history)"
-    return "\n".join(f"{who(m.sender)}: {m.content}" for m in rows)
+@dataclass(frozen=True)
+class ProjectContext:
+    """Instantánea inmutable del contexto de un proyecto para montar prompts."""
+
+    project_id: int
+    lang: str
+    description: Optional[str]
+    requirements_text: str
+    requirements_version: int
+    history: Tuple[HistoryLine, ...]
+    summary: Optional[str] = None
+
+    def requirements_block(self) -> str:
+        return self.requirements_text
+
+    def history_block(self) -> str:
+        return render_history(self.history, self.lang)
+
+    def conversation_block(self) -> str:
+        """Resumen acumulado (si existe) seguido de los últimos turnos en crudo."""
+        if not self.summary:
+            return self.history_block()
+        if is_es(self.lang):
+            return f"Resumen de la conversación anterior:\n{self.summary}\n\nÚltimos mensajes:\n{self.history_block()}"
+        return f"Summary of the earlier conversation:\n{self.summary}\n\nLatest messages:\n{self.history_block()}"
+
+
+def load_project_context(
+    session: Session,
+    project_id: int,
+    lang: str = "es",
+    history_limit: Optional[int] = 14,
+    exclude_id: Optional[int] = None,
+    use_summary: bool = False,
+) -> ProjectContext:
+    """Carga descripción, requisitos e historial reciente en una sola consulta.
+
+    Las lecturas se combinan con ``UNION ALL`` en filas homogéneas
+    ``(kind, id, label, number, text, ts)`` para ahorrar idas y vueltas a la BD.
+    Los requisitos llegan ya renderizados desde ``RequirementsSnapshot``.
+    Con ``use_summary`` se añade el ``ConversationSummary`` del proyecto y el
+    historial se limita a los mensajes que el resumen aún no cubre.
+    ``history_limit=None`` no acota el número de mensajes.
+    """
+    desc_sq = (
+        select(ChatMessage.id, ChatMessage.sender, ChatMessage.content, ChatMessage.timestamp)
+        .where(ChatMessage.project_id == project_id)
+        .where(ChatMessage.sender == "user")
+        .where(ChatMessage.state == "init")
+        .order_by(ChatMessage.timestamp)
+        .limit(1)
+        .subquery()
+    )
+    parts = [
+        select(
+            literal("description").label("kind"),
+            desc_sq.c.id,
+            desc_sq.c.sender.label("label"),
+            cast(null(), Integer).label("number"),
+            desc_sq.c.content.label("text"),
+            desc_sq.c.timestamp.label("ts"),
+        ),
+        select(
+            literal("requirements").label("kind"),
+            RequirementsSnapshot.project_id.label("id"),
+            cast(null(), String).label("label"),
+            RequirementsSnapshot.version.label("number"),
+            (RequirementsSnapshot.text_es if is_es(lang) else RequirementsSnapshot.text_en).label("text"),
+            RequirementsSnapshot.updated_at.label("ts"),
+        ).where(RequirementsSnapshot.project_id == project_id),
+    ]
+    if history_limit is None or history_limit > 0:
+        hist_q = (
+            select(ChatMessage.id, ChatMessage.sender, ChatMessage.content, ChatMessage.timestamp)
+            .where(ChatMessage.project_id == project_id)
+        )
+        if exclude_id:
+            hist_q = hist_q.where(ChatMessage.id != exclude_id)
+        if use_summary:
+            covered = (
+                select(ConversationSummary.last_message_id)
+                .where(ConversationSummary.project_id == project_id)
+                .scalar_subquery()
+            )
+            hist_q = hist_q.where(ChatMessage.id > func.coalesce(covered, 0))
+        hist_q = hist_q.order_by(ChatMessage.timestamp.desc())
+        if history_limit is not None:
+            hist_q = hist_q.limit(history_limit)
+        hist_sq = hist_q.subquery()
+        parts.append(
+            select(
+                literal("history").label("kind"),
+                hist_sq.c.id,
+                hist_sq.c.sender.label("label"),
+                cast(null(), Integer).label("number"),
+                hist_sq.c.content.label("text"),
+                hist_sq.c.timestamp.label("ts"),
+            )
+        )
+
+    if use_summary:
+        parts.append(
+            select(
+                literal("summary").label("kind"),
+                ConversationSummary.project_id.label("id"),
+                cast(null(), String).label("label"),
+                ConversationSummary.last_message_id.label("number"),
+                ConversationSummary.summary.label("text"),
+                ConversationSummary.updated_at.label("ts"),
+            ).where(ConversationSummary.project_id == project_id)
+        )
+
+    description: Optional[str] = None
+    summary: Optional[str] = None
+    requirements_text: Optional[str] = None
+    requirements_version = 0
+    history: List[Tuple[datetime, int, str, str]] = []
+    for kind, _id, label, number, text, ts in session.exec(union_all(*parts)).all():
+        if kind == "description":
+            description = text
+        elif kind == "requirements":
+            requirements_text, requirements_version = text, number
+        elif kind == "summary":
+            summary = text or None
+        else:
+            history.append((ts, _id, label, text))
+
+    if requirements_text is None:
+        # Proyecto sin snapshot todavía: se construye una vez
+        requirements_text = get_requirements_block(session, project_id, lang)
+
+    history.sort(key=lambda h: (h[0], h[1]))
+    return ProjectContext(
+        project_id=project_id,
+        lang=lang,
+        description=description,
+        requirements_text=requirements_text,
+        requirements_version=requirements_version,
+        history=tuple((sender, content) for _, _, sender, content in history),
+        summary=summary,
+    )
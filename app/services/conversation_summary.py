@@ -0,0 +1,91 @@
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.core.config import get_settings
+from app.models.chat_message import ChatMessage
+from app.models.conversation_summary import ConversationSummary
+from app.services.context_builder import render_history
+from app.services.language import is_es
+from app.services.prompt_budget import PromptSection, assemble_prompt
+from app.utils.ollama_client import call_ollama
+
+
+def summary_due(session: Session, project_id: int) -> bool:
+    """Indica si hay suficientes mensajes sin resumir como para rehacer el resumen."""
+    settings = get_settings()
+    current = session.get(ConversationSummary, project_id)
+    after = current.last_message_id if current else 0
+    pending = session.exec(
+        select(func.count(ChatMessage.id))
+        .where(ChatMessage.project_id == project_id)
+        .where(ChatMessage.id > after)
+    ).one()
+    return pending >= settings.llm_summary_every + settings.llm_summary_keep_recent
+
+
+def refresh_summary(
+    session: Session,
+    project_id: int,
+    lang: str,
+    generate: Callable[[str], str],
+) -> Optional[ConversationSummary]:
+    """Incorpora al resumen los mensajes nuevos salvo los ``llm_summary_keep_recent`` últimos."""
+    keep_recent = get_settings().llm_summary_keep_recent
+    current = session.get(ConversationSummary, project_id)
+    after = current.last_message_id if current else 0
+    rows = session.exec(
+        select(ChatMessage)
+        .where(ChatMessage.project_id == project_id)
+        .where(ChatMessage.id > after)
+        .order_by(ChatMessage.id)
+    ).all()
+    to_fold = rows[:-keep_recent] if keep_recent else rows
+    if not to_fold:
+        return current
+
+    previous = current.summary if current and current.summary else (
+        "(sin resumen)" if is_es(lang) else "(no summary)"
+    )
+    prompt = assemble_prompt(
+        "summarize_chat.txt",
+        sections=[
+            PromptSection("nuevos_mensajes", render_history(((m.sender, m.content) for m in to_fold), lang), priority=1, keep="end"),
+            PromptSection("resumen_previo", previous, priority=2),
+        ],
+        fixed={"lang": lang},
+    ).text
+    text = (generate(prompt) or "").strip()
+    if not text:
+        return current
+
+    if current is None:
+        current = ConversationSummary(project_id=project_id)
+    current.summary = text
+    current.last_message_id = to_fold[-1].id
+    current.message_count += len(to_fold)
+    current.updated_at = datetime.utcnow()
+    session.add(current)
+    session.commit()
+    session.refresh(current)
+    return current
+
+
+def _refresh_in_background(bind, project_id: int, lang: str) -> None:
+    with Session(bind) as session:
+        if summary_due(session, project_id):
+            refresh_summary(session, project_id, lang, call_ollama)
+
+
+def schedule_summary_refresh(session: Session, project_id: int, lang: str) -> bool:
+    """Encola la actualización del resumen si toca; nunca bloquea la respuesta."""
+    if not summary_due(session, project_id):
+        return False
+    # Import diferido: job_queue depende de chat_flow, que usa este módulo
+    from app.services.job_queue import get_job_queue
+
+    return get_job_queue().submit_task(
+        f"summary:{project_id}", _refresh_in_background, session.get_bind(), project_id, lang
+    )
@@ -0,0 +1,285 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session
+
+from app.core.config import get_settings
+from app.models.job import Job
+from app.services.chat_flow import PendingReply
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Se lanza cuando hay demasiados trabajos pendientes para aceptar otro."""
+
+
+class JobQueue:
+    """Pool acotado de workers para las generaciones de la IA.
+
+    Cada trabajo queda registrado en la tabla ``job`` con su estado y progreso,
+    de modo que la concurrencia contra Ollama se dimensiona con ``max_workers``
+    independientemente de los workers HTTP.
+
+    Mientras tiene trabajos pendientes, la cola renueva su ``updated_at`` cada
+    ``heartbeat_seconds`` (latido) y marca como fallidos los de otros procesos
+    que llevan más de ``orphan_seconds`` sin latido.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 100,
+        orphan_seconds: float = 120.0,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.orphan_seconds = orphan_seconds
+        self.heartbeat_seconds = orphan_seconds / 4
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-job")
+        self._futures: Dict[int, Future] = {}
+        self._binds: Dict[int, Any] = {}   # job_id -> engine, para el latido
+        self._tasks: Dict[str, Future] = {}
+        self._reserved = 0      # plazas apartadas mientras se crea la fila del trabajo
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending()
+
+    def _pending(self) -> int:
+        return len(self._futures) + len(self._tasks) + self._reserved
+
+    def submit(
+        self,
+        session: Session,
+        *,
+        kind: str,
+        project_id: int,
+        owner_id: int,
+        reply: Any,
+        generate: Callable[[str], str],
+        serialize: Callable[[Any], Dict[str, Any]],
+    ) -> Job:
+        """Registra un trabajo y lo encola si ``reply`` es un ``PendingReply``.
+
+        Si la respuesta ya está disponible (no requiere IA) el trabajo se
+        guarda directamente como completado.
+        """
+        if not isinstance(reply, PendingReply):
+            job = Job(
+                kind=kind, status="succeeded", progress=100,
+                project_id=project_id, owner_id=owner_id,
+                result=serialize(reply),
+            )
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+            return job
+
+        # Comprobar y apartar la plaza bajo el mismo lock: dos peticiones a la
+        # vez no pueden superar ``max_pending``
+        with self._lock:
+            if self._pending() >= self.max_pending:
+                raise JobQueueFull("Too many pending jobs")
+            self._reserved += 1
+
+        try:
+            job = Job(kind=kind, project_id=project_id, owner_id=owner_id)
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+        except BaseException:
+            with self._lock:
+                self._reserved -= 1
+            raise
+
+        bind = session.get_bind()
+        job_id = job.id
+        with self._lock:
+            self._reserved -= 1
+            future = self._executor.submit(self._run, bind, job_id, reply, generate, serialize)
+            self._futures[job_id] = future
+            self._binds[job_id] = bind
+            self._start_heartbeat()
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return job
+
+    def submit_task(self, key: str, fn: Callable[..., Any], *args) -> bool:
+        """Encola una tarea interna (sin registro en ``job``) compartiendo los workers.
+
+        Devuelve ``False`` si ya hay una tarea con la misma ``key`` en curso o
+        la cola está llena; estas tareas son prescindibles y no se reintentan.
+        """
+        with self._lock:
+            if key in self._tasks or self._pending() >= self.max_pending:
+                return False
+            future = self._executor.submit(self._run_task, key, fn, *args)
+            self._tasks[key] = future
+        future.add_done_callback(lambda _: self._forget_task(key))
+        return True
+
+    def wait_task(self, key: str, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            future = self._tasks.get(key)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def wait(self, job_id: int, timeout: Optional[float] = None) -> None:
+        """Espera a que termine un trabajo en curso (útil en tests y apagado)."""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._stop.set()
+        self._executor.shutdown(wait=wait)
+
+    def beat(self) -> None:
+        """Renueva el latido de los trabajos de este proceso y falla los huérfanos ajenos."""
+        with self._lock:
+            by_bind: Dict[Any, List[int]] = {}
+            for job_id, bind in self._binds.items():
+                by_bind.setdefault(bind, []).append(job_id)
+        job = Job.__table__
+        for bind, job_ids in by_bind.items():
+            try:
+                with Session(bind) as session:
+                    session.execute(
+                        update(job)
+                        .where(job.c.id.in_(job_ids))
+                        .where(job.c.status.in_(PENDING_STATUSES))
+                        .values(updated_at=datetime.utcnow())
+                    )
+                    session.commit()
+            except SQLAlchemyError:
+                logger.warning("Job heartbeat failed", exc_info=True)
+                continue
+            fail_orphaned_jobs(bind, orphan_seconds=self.orphan_seconds)
+
+    def _start_heartbeat(self) -> None:
+        # Se llama con ``self._lock`` tomado
+        if self._heartbeat is not None or self.heartbeat_seconds <= 0:
+            return
+
+        def loop():
+            while not self._stop.wait(self.heartbeat_seconds):
+                self.beat()
+
+        self._heartbeat = threading.Thread(target=loop, name="llm-job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _forget(self, job_id: int) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._binds.pop(job_id, None)
+
+    def _forget_task(self, key: str) -> None:
+        with self._lock:
+            self._tasks.pop(key, None)
+
+    @staticmethod
+    def _run_task(key: str, fn: Callable[..., Any], *args) -> None:
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("Background task %s failed", key)
+
+    def _run(self, bind, job_id: int, reply: PendingReply, generate, serialize) -> None:
+        _update_job(bind, job_id, status="running", progress=10)
+        try:
+            text = generate(reply.prompt)
+            _update_job(bind, job_id, progress=80)
+            with Session(bind) as session:
+                result = serialize(reply.finish(session, text))
+        except Exception as exc:
+            logger.exception("Job %s failed", job_id)
+            _update_job(bind, job_id, status="failed", error=str(exc))
+            return
+        _update_job(bind, job_id, status="succeeded", progress=100, result=result)
+
+
+def _update_job(bind, job_id: int, **fields) -> None:
+    with Session(bind) as session:
+        job = session.get(Job, job_id)
+        if job is None:
+            return
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        session.commit()
+
+
+PENDING_STATUSES = ("queued", "running")
+
+
+def fail_orphaned_jobs(bind=None, job_id: Optional[int] = None, orphan_seconds: Optional[float] = None) -> int:
+    """Marca como ``failed`` los trabajos pendientes cuyo proceso ya no existe.
+
+    La cola vive en memoria: lo que estaba ``queued`` o ``running`` al parar un
+    proceso ya no lo va a ejecutar nadie. Un trabajo se considera huérfano si
+    lleva ``orphan_seconds`` sin latido; los de otros workers vivos lo renuevan
+    y no se tocan. Se llama al arrancar, desde el latido y al consultar un
+    trabajo (``job_id``).
+    """
+    if bind is None:
+        from app.database import engine as bind
+    if orphan_seconds is None:
+        orphan_seconds = get_settings().llm_job_orphan_seconds
+    now = datetime.utcnow()
+    job = Job.__table__
+    stmt = (
+        update(job)
+        .where(job.c.status.in_(PENDING_STATUSES))
+        .where(job.c.updated_at < now - timedelta(seconds=orphan_seconds))
+        .values(status="failed", error="Interrupted by server restart", updated_at=now)
+    )
+    if job_id is not None:
+        stmt = stmt.where(job.c.id == job_id)
+    try:
+        with Session(bind) as session:
+            count = session.execute(stmt).rowcount
+            session.commit()
+    except SQLAlchemyError:
+        logger.warning("Could not mark orphaned jobs as failed", exc_info=True)
+        return 0
+    if count:
+        logger.warning("Marked %s orphaned jobs as failed", count)
+    return count
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Devuelve la cola compartida por el proceso (se crea en el primer uso)."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                settings = get_settings()
+                _queue = JobQueue(
+                    max_workers=settings.llm_job_workers,
+                    max_pending=settings.llm_job_max_pending,
+                    orphan_seconds=settings.llm_job_orphan_seconds,
+                )
+    return _queue
+
+
+def shutdown_job_queue() -> None:
+    global _queue
+    if _queue is not None:
+        _queue.shutdown(wait=False)
+        _queue = None
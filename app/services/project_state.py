@@ -0,0 +1,23 @@
+from typing import Optional
+from sqlmodel import Session, select
+from app.models.project_state import ProjectState
+from app.models.state_machine import StateMachine
+
+
+def get_current_state(session: Session, project_id: int) -> Optional[StateMachine]:
+    """Última entrada de StateMachine del proyecto, vía el puntero ``ProjectState``.
+
+    Sin puntero (datos previos a la migración) se recurre al histórico ordenado.
+    """
+    current = session.exec(
+        select(StateMachine)
+        .join(ProjectState, ProjectState.state_machine_id == StateMachine.id)
+        .where(ProjectState.project_id == project_id)
+    ).first()
+    if current is not None:
+        return current
+    return session.exec(
+        select(StateMachine)
+        .where(StateMachine.project_id == project_id)
+        .order_by(StateMachine.last_updated.desc())
+    ).first()
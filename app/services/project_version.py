@@ -0,0 +1,25 @@
+from typing import Optional
+from fastapi import Request, Response
+from sqlmodel import Session
+from app.models.project_version import ProjectVersion
+
+
+def project_etag(session: Session, project_id: int, counter: str, variant: str = "") -> str:
+    """ETag débil a partir del contador ``counter`` del proyecto (lectura por PK).
+
+    ``variant`` distingue respuestas distintas del mismo recurso (p. ej. la
+    página pedida) para que no compartan ETag.
+    """
+    version = session.get(ProjectVersion, project_id)
+    value = getattr(version, counter) if version else 0
+    suffix = f";{variant}" if variant else ""
+    return f'W/"{project_id}-{counter}-{value}{suffix}"'
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Devuelve un 304 si el cliente ya tiene ``etag``; si no, lo añade a ``response``."""
+    candidates = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
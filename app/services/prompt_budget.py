@@ -0,0 +1,118 @@
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import get_settings
+from app.utils.prompt_loader import load_prompt
+
+
+logger = logging.getLogger(__name__)
+
+# Aproximación habitual para modelos tipo Llama: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+TRIM_MARKER = "[...]"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def prompt_budget(model: Optional[str] = None) -> int:
+    """Tokens disponibles para el prompt: ventana del modelo menos la reserva de respuesta."""
+    settings = get_settings()
+    model = model or settings.ollama_model
+    window = settings.llm_context_windows_map.get(model, settings.llm_context_tokens)
+    return max(window - settings.llm_response_reserve_tokens, 0)
+
+
+@dataclass
+class PromptSection:
+    """Parte variable de un prompt (un placeholder de la plantilla).
+
+    - ``priority``: las secciones con prioridad más baja se recortan antes.
+    - ``keep``: ``"end"`` conserva las últimas líneas (historial, Q&A),
+      ``"start"`` conserva las primeras, ``"none"`` permite eliminarla entera
+      y ``"never"`` impide recortarla (contenido que debe llegar completo).
+    """
+
+    name: str
+    text: str
+    priority: int
+    keep: str = "start"
+
+
+@dataclass
+class AssembledPrompt:
+    text: str
+    tokens: int
+    budget: int
+    trimmed: List[str] = field(default_factory=list)
+
+
+def _trim(section: PromptSection, excess_tokens: int) -> str:
+    """Recorta la sección para liberar ``excess_tokens``, respetando líneas completas."""
+    if section.keep == "none":
+        return ""
+    text = section.text
+    to_remove = excess_tokens * CHARS_PER_TOKEN + len(TRIM_MARKER) + 1
+    if to_remove >= len(text):
+        return TRIM_MARKER
+    if section.keep == "end":
+        cut = text[to_remove:]
+        newline = cut.find("\n")
+        if newline != -1:
+            cut = cut[newline + 1:]
+        return f"{TRIM_MARKER}\n{cut}"
+    cut = text[:len(text) - to_remove]
+    newline = cut.rfind("\n")
+    if newline > 0:
+        cut = cut[:newline]
+    return f"{cut}\n{TRIM_MARKER}"
+
+
+def assemble_prompt(
+    template: str,
+    sections: List[PromptSection],
+    fixed: Optional[Dict[str, str]] = None,
+    prefix: str = "",
+    model: Optional[str] = None,
+    budget: Optional[int] = None,
+    loader: Callable[..., str] = load_prompt,
+) -> AssembledPrompt:
+    """Renderiza ``template`` ajustando las secciones al presupuesto de tokens.
+
+    Si el prompt completo no cabe, recorta primero las secciones de menor
+    prioridad (historial antiguo, ejemplos...) y sólo pasa a la siguiente
+    cuando la anterior ya no da más de sí. Las secciones ``keep="never"`` no
+    se tocan, así que el resultado puede quedar por encima del presupuesto
+    (``tokens > budget``); el llamador decide qué hacer en ese caso.
+    """
+    budget = prompt_budget(model) if budget is None else budget
+    values = {s.name: s.text for s in sections}
+    fixed = fixed or {}
+
+    def render() -> str:
+        return prefix + loader(template, **fixed, **values)
+
+    text = render()
+    tokens = estimate_tokens(text)
+    trimmed: List[str] = []
+    for section in sorted(sections, key=lambda s: s.priority):
+        if tokens <= budget:
+            break
+        if section.keep == "never":
+            continue
+        current = PromptSection(section.name, values[section.name], section.priority, section.keep)
+        values[section.name] = _trim(current, tokens - budget)
+        trimmed.append(section.name)
+        text = render()
+        tokens = estimate_tokens(text)
+
+    if tokens > budget:
+        logger.warning("Prompt %s still over budget after trimming: ~%d/%d tokens", template, tokens, budget)
+    elif trimmed:
+        logger.info("Prompt %s trimmed (%s) to ~%d/%d tokens", template, ", ".join(trimmed), tokens, budget)
+    else:
+        logger.debug("Prompt %s ~%d/%d tokens", template, tokens, budget)
+    return AssembledPrompt(text=text, tokens=tokens, budget=budget, trimmed=trimmed)
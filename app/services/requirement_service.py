@@ -1,7 +1,68 @@
 import re
+from datetime import datetime
+from difflib import SequenceMatcher
 from typing import List, Dict
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select, func, delete
 from app.models.requirement import Requirement
+from app.models.requirement_counter import RequirementCounter
+from app.schemas.requirement import (
+    RequirementBatchOp,
+    RequirementBatchItemResult,
+    RequirementBatchResponse,
+    RequirementRead,
+)
+from app.models.project_version import bump_project_version
+from app.utils.bulk_insert import bulk_insert
+from app.services.requirements_snapshot import rebuild_snapshot, apply_requirement_changes
+
+def reserve_requirement_numbers(session: Session, project_id: int, count: int = 1) -> int:
+    """Reserva ``count`` números correlativos y devuelve el primero.
+
+    Un único ``UPDATE ... RETURNING`` sobre la fila del contador: la fila queda
+    bloqueada hasta el commit, así que dos reservas concurrentes no se solapan.
+    La primera vez se inicializa con el ``max(number)`` existente.
+    """
+    counter = RequirementCounter.__table__
+    bump = (
+        update(counter)
+        .where(counter.c.project_id == project_id)
+        .values(last_number=counter.c.last_number + count)
+        .returning(counter.c.last_number)
+    )
+    last = session.execute(bump).scalar()
+    if last is None:
+        current = session.exec(
+            select(func.max(Requirement.number)).where(Requirement.project_id == project_id)
+        ).first() or 0
+        try:
+            with session.begin_nested():
+                session.execute(insert(counter).values(project_id=project_id, last_number=current + count))
+            last = current + count
+        except IntegrityError:
+            # Otra transacción creó el contador a la vez: se reserva sobre el suyo
+            last = session.execute(bump).scalar()
+    return last - count + 1
+
+
+def reset_requirement_numbers(session: Session, project_id: int, last_number: int) -> None:
+    """Fija el último número asignado (tras reemplazar todos los requisitos)."""
+    counter = RequirementCounter.__table__
+    updated = session.execute(
+        update(counter).where(counter.c.project_id == project_id).values(last_number=last_number)
+    ).rowcount
+    if not updated:
+        session.execute(insert(counter).values(project_id=project_id, last_number=last_number))
+
+
+# Parecido mínimo para considerar que un requisito reformulado es el mismo
+SIMILARITY_THRESHOLD = 0.6
+# Con el mismo número basta un parecido menor; por debajo es otro requisito
+NUMBER_MATCH_FLOOR = 0.4
+
+# Columnas NOT NULL que una edición por lotes no puede poner a null
+NON_NULLABLE_FIELDS = ("description", "status", "category", "priority")
 
 CATS = ["FUNCTIONAL", "PERFORMANCE", "USABILITY", "SECURITY", "TECHNICAL"]
 CAT_RE = re.compile(r"^(\w+):\s*$", re.IGNORECASE)
@@ -34,45 +95,276 @@ def parse_requirements_block(text: str) -> List[Dict]:
             num += 1
     return items
 
-def replace_requirements(session: Session, project_id: int, parsed_items: List[Dict], owner_id: int):
-    """Reemplaza los requisitos de un proyecto de forma atómica."""
-    with session.begin():
-        session.exec(delete(Requirement).where(Requirement.project_id == project_id))
-        for it in parsed_items:
-            session.add(
-                Requirement(
-                    description=it["description"],
-                    status=it["status"],
-                    category=it["category"],
-                    priority=it["priority"],
-                    visual_reference=None,
-                    number=it["number"],
-                    project_id=project_id,
-                    owner_id=owner_id,
-                )
-            )
+def replace_requirements(
+    session: Session,
+    project_id: int,
+    parsed_items: List[Dict],
+    owner_id: int,
+    reconcile: bool = True,
+    delete_missing: bool = True,
+) -> Dict[str, int]:
+    """Reemplaza los requisitos de un proyecto de forma atómica.
+
+    Por defecto reconcilia (``reconcile_requirements``) y sólo escribe las
+    filas que cambian; con ``reconcile=False`` borra y reinserta todo.
+    Con ``delete_missing=False`` se reconcilia sin borrar los requisitos que
+    no aparecen en ``parsed_items`` (p. ej. si el modelo no los vio todos).
+    """
+    if reconcile or not delete_missing:
+        stats = reconcile_requirements(session, project_id, parsed_items, owner_id, delete_missing)
+        session.commit()
+        return stats
+
+    # Un único commit: funciona tanto si la sesión ya tiene una transacción
+    # abierta (lecturas previas) como si no.
+    deleted = session.exec(delete(Requirement).where(Requirement.project_id == project_id)).rowcount
+    # El delete masivo no pasa por el flush del ORM: se versiona a mano
+    bump_project_version(session, project_id, ["requirements"])
+    reset_requirement_numbers(session, project_id, max((it["number"] for it in parsed_items), default=0))
+    insert_requirements(session, project_id, parsed_items, owner_id)
+    rebuild_snapshot(session, project_id)
+    session.commit()
+    return {"inserted": len(parsed_items), "updated": 0, "deleted": deleted, "unchanged": 0}
+
+
+def insert_requirements(session: Session, project_id: int, items: List[Dict], owner_id: int) -> list:
+    """Inserta requisitos ya numerados con ``bulk_insert`` (sin un flush por fila).
+
+    Devuelve filas ``(id, category, number, description)``, suficientes para
+    actualizar el snapshot. No hace commit.
+    """
+    if not items:
+        return []
+    now = datetime.utcnow()
+    rows = [
+        {
+            "description": it["description"],
+            "status": it.get("status") or "draft",
+            "category": it.get("category") or "functional",
+            "priority": it.get("priority") or "must",
+            "visual_reference": it.get("visual_reference"),
+            "number": it["number"],
+            "project_id": project_id,
+            "owner_id": owner_id,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for it in items
+    ]
+    inserted = bulk_insert(
+        session, Requirement, rows,
+        returning=(Requirement.id, Requirement.category, Requirement.number, Requirement.description),
+    )
+    # El INSERT masivo no pasa por el flush del ORM: se versiona a mano
+    bump_project_version(session, project_id, ["requirements"])
+    return inserted
+
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def reconcile_requirements(
+    session: Session, project_id: int, parsed_items: List[Dict], owner_id: int, delete_missing: bool = True
+) -> Dict[str, int]:
+    """Empareja los requisitos parseados con los existentes y aplica sólo la diferencia.
+
+    Emparejamiento, dentro de cada categoría y en este orden:
+      1. mismo texto (normalizado),
+      2. texto parecido (``difflib``, ratio >= ``SIMILARITY_THRESHOLD``),
+      3. mismo número con un parecido mínimo (ratio >= ``NUMBER_MATCH_FLOOR``).
+    Un texto completamente distinto es un requisito nuevo aunque ocupe el
+    mismo número: no hereda id, estado ni prioridad del anterior.
+    Las filas emparejadas conservan id, ``created_at``, estado y prioridad; sólo
+    se actualizan descripción/número si cambian. El resto se inserta o borra
+    (o se conserva, con ``delete_missing=False``). No hace commit.
+    """
+    existing = list(session.exec(select(Requirement).where(Requirement.project_id == project_id)).all())
+    pending = list(range(len(parsed_items)))
+    matches: Dict[int, Requirement] = {}     # índice parseado -> fila existente
+    free = {r.id: r for r in existing}
+
+    def match_by(key) -> None:
+        index: Dict[tuple, List[Requirement]] = {}
+        for r in sorted(free.values(), key=lambda r: r.id):
+            index.setdefault(key(r.category, r.number, r.description), []).append(r)
+        for i in list(pending):
+            it = parsed_items[i]
+            candidates = index.get(key(it["category"], it["number"], it["description"]))
+            if candidates:
+                r = candidates.pop(0)
+                matches[i] = r
+                del free[r.id]
+                pending.remove(i)
+
+    def match_similar(threshold: float, same_number: bool = False) -> None:
+        # Mejores parejas primero, sólo dentro de la misma categoría
+        pairs = []
+        for i in pending:
+            it = parsed_items[i]
+            target = _norm(it["description"])
+            for r in free.values():
+                if r.category != it["category"] or (same_number and r.number != it["number"]):
+                    continue
+                matcher = SequenceMatcher(None, target, _norm(r.description))
+                if matcher.quick_ratio() < threshold:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= threshold:
+                    pairs.append((ratio, i, r.id))
+        for _, i, rid in sorted(pairs, key=lambda p: -p[0]):
+            if i in matches or rid not in free:
+                continue
+            matches[i] = free.pop(rid)
+            pending.remove(i)
+
+    match_by(lambda cat, num, desc: (cat, _norm(desc)))
+    match_similar(SIMILARITY_THRESHOLD)
+    match_similar(NUMBER_MATCH_FLOOR, same_number=True)
+
+    now = datetime.utcnow()
+    changed: List[Requirement] = []
+    for i, r in matches.items():
+        it = parsed_items[i]
+        if r.description == it["description"] and r.number == it["number"]:
+            continue
+        r.description = it["description"]
+        r.number = it["number"]
+        r.updated_at = now
+        session.add(r)
+        changed.append(r)
+
+    inserted = insert_requirements(session, project_id, [parsed_items[i] for i in sorted(pending)], owner_id)
+
+    deleted_ids = list(free) if delete_missing else []
+    for rid in deleted_ids:
+        session.delete(free[rid])
+    kept = [] if delete_missing else list(free.values())
+
+    last_number = max([it["number"] for it in parsed_items] + [r.number for r in kept], default=0)
+    reset_requirement_numbers(session, project_id, last_number)
+    if changed or inserted or deleted_ids:
+        apply_requirement_changes(session, project_id, upserted=changed + inserted, deleted_ids=deleted_ids)
+    return {
+        "inserted": len(inserted),
+        "updated": len(changed),
+        "deleted": len(deleted_ids),
+        "unchanged": len(matches) - len(changed),
+    }
 
 
 def append_requirements(session: Session, project_id: int, parsed_items: List[Dict], owner_id: int):
     """Añade nuevos requisitos al proyecto manteniendo los existentes."""
-    last_number = (
-        session.exec(
-            select(func.max(Requirement.number)).where(Requirement.project_id == project_id)
-        ).first()
-        or 0
-    )
-    for it in parsed_items:
-        last_number += 1
-        session.add(
-            Requirement(
-                description=it["description"],
-                status=it["status"],
-                category=it["category"],
-                priority=it["priority"],
-                visual_reference=None,
-                number=last_number,
+    if not parsed_items:
+        return
+    first = reserve_requirement_numbers(session, project_id, len(parsed_items))
+    numbered = [dict(it, number=first + offset) for offset, it in enumerate(parsed_items)]
+    added = insert_requirements(session, project_id, numbered, owner_id)
+    apply_requirement_changes(session, project_id, upserted=added)
+    session.commit()
+
+
+def apply_requirement_batch(
+    session: Session,
+    project_id: int,
+    operations: List[RequirementBatchOp],
+    owner_id: int,
+    atomic: bool = False,
+) -> RequirementBatchResponse:
+    """Aplica un lote de altas/ediciones/bajas en una sola transacción.
+
+    - Una sola consulta para cargar los requisitos referenciados y, si hay
+      altas, una única reserva de números para numerarlas de forma correlativa.
+    - Las operaciones inválidas se informan por elemento; con ``atomic`` una
+      sola falla deshace todo el lote.
+    - El snapshot de requisitos se actualiza una vez al final.
+    """
+    ids = {op.id for op in operations if op.id is not None}
+    existing: Dict[int, Requirement] = {}
+    if ids:
+        existing = {
+            r.id: r for r in session.exec(
+                select(Requirement)
+                .where(Requirement.project_id == project_id)
+                .where(Requirement.id.in_(ids))
+            ).all()
+        }
+
+    # Un único rango reservado para todas las altas válidas del lote
+    creates = sum(1 for op in operations if op.op == "create" and (op.description or "").strip())
+    next_number = reserve_requirement_numbers(session, project_id, creates) - 1 if creates else 0
+    now = datetime.utcnow()
+    touched: Dict[int, Requirement] = {}     # id(obj) -> obj, altas y ediciones
+    deleted: List[int] = []
+    outcome: List[tuple] = []                # (op, requirement | None, error | None)
+
+    for op in operations:
+        if op.op == "create":
+            if not (op.description or "").strip():
+                outcome.append((op, None, "description is required"))
+                continue
+            next_number += 1
+            req = Requirement(
+                description=op.description,
+                status=op.status or "draft",
+                category=op.category or "functional",
+                priority=op.priority or "must",
+                visual_reference=op.visual_reference,
+                number=next_number,
                 project_id=project_id,
                 owner_id=owner_id,
             )
+            session.add(req)
+            touched[id(req)] = req
+            outcome.append((op, req, None))
+            continue
+
+        if op.id is None:
+            outcome.append((op, None, "id is required"))
+            continue
+        req = existing.get(op.id)
+        if req is None:
+            outcome.append((op, None, "Requirement not found"))
+            continue
+
+        if op.op == "update":
+            changes = op.model_dump(exclude_unset=True, exclude={"op", "id"})
+            # Un null explícito en una columna NOT NULL haría fallar el flush de todo el lote
+            null_field = next((k for k in NON_NULLABLE_FIELDS if k in changes and changes[k] is None), None)
+            if null_field:
+                outcome.append((op, None, f"{null_field} cannot be null"))
+                continue
+            for key, value in changes.items():
+                setattr(req, key, value)
+            req.updated_at = now
+            session.add(req)
+            touched[id(req)] = req
+            outcome.append((op, req, None))
+        else:
+            session.delete(req)
+            del existing[op.id]
+            touched.pop(id(req), None)
+            deleted.append(op.id)
+            outcome.append((op, None, None))
+
+    failed = sum(1 for _, _, error in outcome if error)
+    if atomic and failed:
+        session.rollback()
+        results = [
+            RequirementBatchItemResult(index=i, op=op.op, ok=False, id=op.id, error=error or "Not applied")
+            for i, (op, _, error) in enumerate(outcome)
+        ]
+        return RequirementBatchResponse(applied=0, failed=len(outcome), results=results)
+
+    apply_requirement_changes(session, project_id, upserted=list(touched.values()), deleted_ids=deleted)
+    # Se serializa antes del commit para no recargar cada fila expirada
+    results = [
+        RequirementBatchItemResult(
+            index=i, op=op.op, ok=error is None, error=error,
+            id=req.id if req is not None else op.id,
+            requirement=RequirementRead.model_validate(req) if req is not None and error is None else None,
         )
+        for i, (op, req, error) in enumerate(outcome)
+    ]
     session.commit()
+    return RequirementBatchResponse(applied=len(outcome) - failed, failed=failed, results=results)
@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlmodel import Session, select
+from app.models.requirement import Requirement
+from app.models.requirements_snapshot import RequirementsSnapshot
+from app.services.language import is_es
+from app.utils.bulk_insert import upsert_insert
+
+CATEGORY_ORDER = ["FUNCTIONAL", "PERFORMANCE", "USABILITY", "SECURITY", "TECHNICAL"]
+
+# (category, number, description)
+RequirementLine = Tuple[str, int, str]
+
+
+def render_requirements(reqs: Iterable[RequirementLine], lang: str = "es") -> str:
+    """Bloque de requisitos agrupado por categoría tal y como lo esperan los prompts."""
+    buckets: Dict[str, List[RequirementLine]] = {}
+    for r in reqs:
+        buckets.setdefault(r[0].upper(), []).append(r)
+    if not buckets:
+        return "Sin requisitos." if lang.lower().startswith("es") else "No requirements."
+
+    lines: List[str] = []
+    for cat in CATEGORY_ORDER:
+        items = buckets.get(cat, [])
+        lines.append(f"{cat}:")
+        if items:
+            for _, number, description in items:
+                lines.append(f"{number}. {description}")
+        else:
+            lines.append("(sin elementos)" if lang.lower().startswith("es") else "(empty)")
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+
+def _render(snapshot: RequirementsSnapshot) -> None:
+    lines = sorted(
+        ((cat, number, desc) for cat, number, desc in (snapshot.items or {}).values()),
+        key=lambda r: (r[0], r[1]),
+    )
+    snapshot.text_es = render_requirements(lines, "es")
+    snapshot.text_en = render_requirements(lines, "en")
+    snapshot.updated_at = datetime.utcnow()
+
+
+def _locked_snapshot(session: Session, project_id: int) -> Optional[RequirementsSnapshot]:
+    # FOR UPDATE + populate_existing: se parte siempre de la fila vigente y
+    # bloqueada, no de la copia que pudiera haber en el identity map
+    return session.exec(
+        select(RequirementsSnapshot)
+        .where(RequirementsSnapshot.project_id == project_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).first()
+
+
+def _ensure_snapshot(session: Session, project_id: int) -> RequirementsSnapshot:
+    snapshot = _locked_snapshot(session, project_id)
+    if snapshot is None:
+        # ON CONFLICT DO NOTHING: si otra transacción la crea a la vez no hay
+        # error de clave primaria; luego se lee (y bloquea) la que haya quedado
+        session.execute(
+            upsert_insert(session, RequirementsSnapshot.__table__)
+            .values(project_id=project_id, version=0, items={}, text_es="", text_en="",
+                    updated_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["project_id"])
+        )
+        snapshot = _locked_snapshot(session, project_id)
+    return snapshot
+
+
+def rebuild_snapshot(session: Session, project_id: int) -> RequirementsSnapshot:
+    """Reconstruye el bloque leyendo todos los requisitos del proyecto.
+
+    Se usa al reemplazar la lista completa o cuando aún no existe snapshot
+    (la migración y el alta de proyectos ya la crean). No hace commit: se
+    persiste con el commit del llamante.
+    """
+    session.flush()
+    snapshot = _ensure_snapshot(session, project_id)
+    reqs = session.exec(select(Requirement).where(Requirement.project_id == project_id)).all()
+    snapshot.items = {str(r.id): [r.category, r.number, r.description] for r in reqs}
+    snapshot.version = (snapshot.version or 0) + 1
+    _render(snapshot)
+    session.add(snapshot)
+    return snapshot
+
+
+def apply_requirement_changes(
+    session: Session,
+    project_id: int,
+    upserted: Iterable[Requirement] = (),
+    deleted_ids: Iterable[int] = (),
+) -> RequirementsSnapshot:
+    """Aplica altas/ediciones/bajas sobre el snapshot sin volver a leer la tabla.
+
+    La fila se lee bloqueada hasta el commit del llamante para que dos cambios
+    concurrentes no se pisen el uno al otro.
+    """
+    session.flush()
+    snapshot = _locked_snapshot(session, project_id)
+    if snapshot is None:
+        return rebuild_snapshot(session, project_id)
+    items: Dict[str, List] = dict(snapshot.items or {})
+    for r in upserted:
+        items[str(r.id)] = [r.category, r.number, r.description]
+    for req_id in deleted_ids:
+        items.pop(str(req_id), None)
+    snapshot.items = items
+    snapshot.version = (snapshot.version or 0) + 1
+    _render(snapshot)
+    session.add(snapshot)
+    return snapshot
+
+
+def get_requirements_block(session: Session, project_id: int, lang: str = "es") -> str:
+    """Bloque de requisitos para prompts (lectura por clave primaria)."""
+    snapshot = session.get(RequirementsSnapshot, project_id)
+    if snapshot is None:
+        snapshot = rebuild_snapshot(session, project_id)
+    return snapshot.text_es if is_es(lang) else snapshot.text_en
@@ -0,0 +1,170 @@
+import codecs
+import hashlib
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app.core.config import get_settings
+from app.models.sample_content import SampleContent
+from app.models.sample_file import SampleFile
+from app.models.sample_requirement import SampleRequirement
+from app.utils.bulk_insert import bulk_insert
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class SampleIngestError(ValueError):
+    """Fichero de ejemplo rechazado; ``status_code`` es el código HTTP a devolver."""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def iter_sample_lines(
+    stream: BinaryIO,
+    max_bytes: Optional[int] = None,
+    max_lines: Optional[int] = None,
+    chunk_size: int = READ_CHUNK_SIZE,
+) -> Iterator[str]:
+    """Decodifica ``stream`` en UTF-8 por bloques y va devolviendo las líneas no vacías.
+
+    Nunca tiene en memoria más de un bloque y la línea en curso. Lanza
+    ``SampleIngestError`` si se supera ``max_bytes`` / ``max_lines`` (413) o si
+    el contenido no es UTF-8 válido (400).
+    """
+    settings = get_settings()
+    max_bytes = settings.sample_max_bytes if max_bytes is None else max_bytes
+    max_lines = settings.sample_max_lines if max_lines is None else max_lines
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="strict")
+    total = 0
+    count = 0
+    pending = ""
+
+    def emit(text: str) -> Iterator[str]:
+        nonlocal count
+        line = text.strip()
+        if line:
+            count += 1
+            if count > max_lines:
+                raise SampleIngestError(f"File has more than {max_lines} lines", status_code=413)
+            yield line
+
+    while True:
+        chunk = stream.read(chunk_size)
+        final = not chunk
+        total += len(chunk)
+        if total > max_bytes:
+            raise SampleIngestError(f"File is larger than {max_bytes} bytes", status_code=413)
+        try:
+            pending += decoder.decode(chunk, final=final)
+        except UnicodeDecodeError as exc:
+            raise SampleIngestError(f"File is not valid UTF-8 (byte {total - len(chunk) + exc.start})")
+        lines = pending.splitlines(keepends=True)
+        # La última línea puede estar incompleta hasta el siguiente bloque
+        pending = "" if final or not lines or lines[-1] != lines[-1].splitlines()[0] else lines.pop()
+        for text in lines:
+            yield from emit(text)
+        if final:
+            return
+
+
+def ingest_sample_lines(session: Session, content_id: int, stream: BinaryIO, **limits) -> int:
+    """Inserta por lotes las líneas de ``stream`` para ``content_id``. No hace commit."""
+    inserted = 0
+
+    def rows():
+        nonlocal inserted
+        for line in iter_sample_lines(stream, **limits):
+            inserted += 1
+            yield {"text": line, "content_id": content_id}
+
+    bulk_insert(session, SampleRequirement, rows())
+    return inserted
+
+
+def hash_stream(stream: BinaryIO, max_bytes: Optional[int] = None, chunk_size: int = READ_CHUNK_SIZE) -> Tuple[str, int]:
+    """SHA-256 y tamaño de ``stream`` leyendo por bloques (413 si supera ``max_bytes``)."""
+    max_bytes = get_settings().sample_max_bytes if max_bytes is None else max_bytes
+    digest = hashlib.sha256()
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return digest.hexdigest(), total
+        total += len(chunk)
+        if total > max_bytes:
+            raise SampleIngestError(f"File is larger than {max_bytes} bytes", status_code=413)
+        digest.update(chunk)
+
+
+def _reuse_content(session: Session, sha256: str) -> Optional[int]:
+    """Suma una referencia al contenido ``sha256`` si existe y devuelve su id."""
+    table = SampleContent.__table__
+    return session.execute(
+        update(table)
+        .where(table.c.sha256 == sha256)
+        .values(ref_count=table.c.ref_count + 1)
+        .returning(table.c.id)
+    ).scalar()
+
+
+def store_sample_file(
+    session: Session,
+    filename: str,
+    owner_id: int,
+    stream: BinaryIO,
+    max_bytes: Optional[int] = None,
+    max_lines: Optional[int] = None,
+) -> SampleFile:
+    """Registra una subida deduplicando por contenido.
+
+    Primera pasada: sólo se calcula el hash. Si ese contenido ya existe se
+    reutiliza (``ref_count + 1``) sin decodificar ni insertar ninguna línea;
+    si es nuevo, segunda pasada con ``ingest_sample_lines``. No hace commit.
+    """
+    sha256, size = hash_stream(stream, max_bytes)
+    content_id = _reuse_content(session, sha256)
+    if content_id is None:
+        content = SampleContent(sha256=sha256, size=size)
+        try:
+            with session.begin_nested():
+                session.add(content)
+                session.flush()
+        except IntegrityError:
+            # Otra subida idéntica se adelantó: se comparte la suya
+            content_id = _reuse_content(session, sha256)
+            if content_id is None:
+                raise
+        else:
+            stream.seek(0)
+            content.line_count = ingest_sample_lines(
+                session, content.id, stream, max_bytes=max_bytes, max_lines=max_lines
+            )
+            session.add(content)
+            content_id = content.id
+
+    file_record = SampleFile(filename=filename, owner_id=owner_id, content_id=content_id)
+    session.add(file_record)
+    session.flush()
+    return file_record
+
+
+def release_sample_file(session: Session, file_record: SampleFile) -> None:
+    """Borra la subida y, si era la última referencia, el contenido y sus líneas. No hace commit."""
+    content_id = file_record.content_id
+    session.delete(file_record)
+    session.flush()
+    table = SampleContent.__table__
+    remaining = session.execute(
+        update(table)
+        .where(table.c.id == content_id)
+        .values(ref_count=table.c.ref_count - 1)
+        .returning(table.c.ref_count)
+    ).scalar()
+    if remaining is not None and remaining <= 0:
+        session.execute(delete(SampleRequirement).where(SampleRequirement.content_id == content_id))
+        session.execute(delete(table).where(table.c.id == content_id))
@@ -0,0 +1,55 @@
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session
+
+# Filas por sentencia: acota la memoria y el tamaño de cada INSERT multi-fila
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_insert(
+    session: Session,
+    model,
+    rows: Iterable[Dict[str, Any]],
+    returning: Sequence[Any] = (),
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> List[Any]:
+    """Inserta ``rows`` (dicts con todas las columnas) en lotes, sin pasar por el flush del ORM.
+
+    SQLAlchemy agrupa cada lote en ``INSERT ... VALUES (...), (...)`` o en un
+    ``executemany`` según el driver. Con ``returning`` (columnas del modelo)
+    devuelve las filas insertadas en el mismo orden; si no, una lista vacía.
+
+    Al saltarse el flush no se disparan los eventos del ORM: los valores por
+    defecto de Python deben venir ya en ``rows`` y quien llame debe versionar
+    lo que corresponda (``bump_project_version``). No hace commit.
+    """
+    returned: List[Any] = []
+    for chunk in _chunks(rows, chunk_size):
+        if returning:
+            stmt = insert(model).returning(*returning, sort_by_parameter_order=True)
+            returned.extend(session.execute(stmt, chunk).all())
+        else:
+            session.execute(insert(model), chunk)
+    return returned
+
+
+def upsert_insert(connection, table):
+    """``INSERT`` del dialecto de ``connection`` (Connection o Session) con ``on_conflict_do_update``.
+
+    PostgreSQL y SQLite comparten la misma API de ``ON CONFLICT``.
+    """
+    dialect = connection.dialect if hasattr(connection, "dialect") else connection.get_bind().dialect
+    return (sqlite.insert if dialect.name == "sqlite" else postgresql.insert)(table)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlmodel import Session, delete
+
+from app.models.llm_cache_entry import LLMCacheEntry
+
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """Caché de respuestas de la IA direccionada por contenido.
+
+    - Nivel en memoria: LRU acotado a ``max_entries`` con TTL.
+    - Nivel persistente (opcional): tabla ``llmcacheentry`` compartida entre
+      procesos; los aciertos se promocionan a memoria.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_seconds: int = 3600,
+        persistent: bool = False,
+        engine=None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._engine = engine
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+        raw = json.dumps(
+            {"model": model, "prompt": prompt, "options": options or {}},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from app.database import engine
+            self._engine = engine
+        return self._engine
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._get_persistent(key) if self.persistent else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.persistent_hits += 1
+        self._set_memory(key, value)
+        return value
+
+    def set(self, key: str, value: str, model: str = "") -> None:
+        self._set_memory(key, value)
+        if self.persistent:
+            self._set_persistent(key, value, model)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.persistent,
+                "hits": self.hits,
+                "misses": self.misses,
+                "persistent_hits": self.persistent_hits,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    # ---------- nivel en memoria ----------
+    def _set_memory(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # ---------- nivel persistente ----------
+    def _get_persistent(self, key: str) -> Optional[str]:
+        try:
+            with Session(self.engine) as session:
+                row = session.get(LLMCacheEntry, key)
+                if row is None:
+                    return None
+                if row.expires_at is not None and row.expires_at <= datetime.utcnow():
+                    return None
+                return row.response
+        except Exception:
+            logger.exception("LLM cache lookup failed")
+            return None
+
+    def _set_persistent(self, key: str, value: str, model: str) -> None:
+        now = datetime.utcnow()
+        try:
+            with Session(self.engine) as session:
+                session.merge(LLMCacheEntry(
+                    key=key,
+                    model=model,
+                    response=value,
+                    created_at=now,
+                    expires_at=now + timedelta(seconds=self.ttl_seconds),
+                ))
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    session.exec(delete(LLMCacheEntry).where(LLMCacheEntry.expires_at <= now))
+                session.commit()
+        except Exception:
+            logger.exception("LLM cache store failed")
@@ -1,9 +1,23 @@
 import os
 
+from app.utils.template_registry import TemplateRegistry
+
 BASE_PATH = os.path.join(os.path.dirname(__file__), "..", "static", "messages")
 
+# Placeholders que cada mensaje debe contener (se validan al arrancar)
+MESSAGE_PLACEHOLDERS = {
+    "add_req_done_en.txt": {"category"},
+    "add_req_done_es.txt": {"category"},
+    "new_req_end.txt": set(),
+    "project_welcome_ia1.txt": {"project_name", "project_description"},
+    "project_welcome_ia2.txt": set(),
+}
+
+messages = TemplateRegistry(BASE_PATH, MESSAGE_PLACEHOLDERS)
+
 def load_message(filename: str, **kwargs):
-    path = os.path.join(BASE_PATH, filename)
-    with open(path, encoding="utf-8") as f:
-        text = f.read()
-    return text.format(**kwargs)
+    return messages.render(filename, **kwargs)
+
+def load_localized_message(key: str, lang: str, **kwargs):
+    """Carga la variante de idioma de un mensaje (p. ej. ``add_req_done`` → ``add_req_done_es.txt``)."""
+    return messages.render(messages.resolve(key, lang), **kwargs)
@@ -1,42 +1,572 @@
+import asyncio
+import json
 import logging
 import os
-from typing import Optional
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
 
-import requests
-from app.core.config import Settings
+import httpx
+from app.core.config import Settings, get_settings
+from app.utils.llm_cache import LLMCache
+from app.utils.ollama_pool import Lease, OllamaBackend, OllamaError, OllamaPool, parse_backends
+from app.utils.single_flight import SingleFlight
 
 
 logger = logging.getLogger(__name__)
 
+# Muestras de latencia necesarias antes de fiarse del p95 para la cobertura
+HEDGE_MIN_SAMPLES = 20
 
-def call_ollama(prompt: str, model: str = "llama3:8b", settings: Optional[Settings] = None) -> str:
-    """Llama al endpoint de generación de Ollama con el prompt indicado."""
-    base_url = os.environ.get("OLLAMA_URL")
-    if not base_url:
-        if settings is None:
-            settings = Settings()
-        base_url = getattr(settings, "ollama_url", "http://localhost:11434")
-
-    try:
-        response = requests.post(
-            base_url.rstrip("/") + "/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-            },
-            timeout=60,
+
+class OllamaClient:
+    """Cliente de Ollama con pool de conexiones persistente.
+
+    Mantiene un ``httpx.Client`` (síncrono) y un ``httpx.AsyncClient`` que se
+    crean bajo demanda y se reutilizan entre peticiones, de modo que las
+    conexiones keep-alive no se abren y cierran en cada generación.
+
+    Con ``backends`` las generaciones se reparten entre varios nodos
+    (:class:`OllamaPool`); sin ellos se usa sólo ``base_url``.
+
+    Los errores de conexión y los 5xx se reintentan ``retries`` veces con
+    espera exponencial aleatoria, y cuentan para el cortacircuitos del nodo.
+    Con ``hedge`` y más de un nodo, si la respuesta tarda más que el p95
+    reciente se lanza una segunda petición a otro nodo y gana la primera.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        default_model: str = "llama3:8b",
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        transport: Optional[httpx.BaseTransport] = None,
+        cache: Optional[LLMCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        backends: Optional[List[OllamaBackend]] = None,
+        retries: int = 0,
+        retry_backoff: float = 0.5,
+        retry_backoff_max: float = 5.0,
+        breaker_failures: int = 5,
+        breaker_reset_seconds: float = 30.0,
+        hedge: bool = False,
+        hedge_initial_delay: float = 10.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.pool = OllamaPool(
+            backends or [OllamaBackend(self.base_url)],
+            breaker_failures=breaker_failures,
+            breaker_reset_seconds=breaker_reset_seconds,
         )
-        response.raise_for_status()
-    except requests.RequestException as exc:
-        content = getattr(exc.response, "text", "")
+        self.retries = max(0, retries)
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.hedge = hedge
+        self.hedge_initial_delay = hedge_initial_delay
+        self._latencies: deque = deque(maxlen=200)
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self.retried = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.default_model = default_model
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        )
+        self._transport = transport
+        self.cache = cache
+        self.single_flight = single_flight
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "OllamaClient":
+        base_url = os.environ.get("OLLAMA_URL") or getattr(settings, "ollama_url", "http://localhost:11434")
+        cache = None
+        if settings.llm_cache_enabled:
+            cache = LLMCache(
+                max_entries=settings.llm_cache_max_entries,
+                ttl_seconds=settings.llm_cache_ttl_seconds,
+                persistent=settings.llm_cache_persistent,
+            )
+        return cls(
+            base_url=base_url,
+            default_model=settings.ollama_model,
+            connect_timeout=settings.ollama_connect_timeout,
+            read_timeout=settings.ollama_read_timeout,
+            max_connections=settings.ollama_max_connections,
+            max_keepalive=settings.ollama_max_keepalive,
+            cache=cache,
+            single_flight=SingleFlight() if settings.llm_single_flight else None,
+            backends=parse_backends(settings.ollama_backends) or None,
+            retries=settings.ollama_retries,
+            retry_backoff=settings.ollama_retry_backoff,
+            retry_backoff_max=settings.ollama_retry_backoff_max,
+            breaker_failures=settings.ollama_breaker_failures,
+            breaker_reset_seconds=settings.ollama_breaker_reset_seconds,
+            hedge=settings.ollama_hedge,
+            hedge_initial_delay=settings.ollama_hedge_initial_delay,
+        )
+
+    # ---------- clientes HTTP compartidos ----------
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        timeout=self._timeout,
+                        limits=self._limits,
+                        transport=self._transport,
+                    )
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = httpx.AsyncClient(
+                        timeout=self._timeout,
+                        limits=self._limits,
+                        transport=self._transport,
+                    )
+        return self._async_client
+
+    # ---------- generación ----------
+    def _payload(self, prompt: str, model: Optional[str], options: Optional[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": model or self.default_model,
+            "prompt": prompt,
+            "stream": stream,
+        }
+        if options:
+            payload["options"] = options
+        return payload
+
+    def _error(self, exc: httpx.HTTPError, backend: OllamaBackend) -> OllamaError:
+        response = getattr(exc, "response", None) if isinstance(exc, httpx.HTTPStatusError) else None
+        content = response.text if response is not None else ""
         if content:
             logger.error("Ollama request failed: %s", content)
         else:
             logger.error("Ollama request failed: %s", exc)
-        raise RuntimeError(
-            f"Error calling Ollama at {base_url}: {content or exc}"
-        ) from exc
+        unreachable = isinstance(exc, httpx.TransportError)
+        retryable = unreachable or (response is not None and response.status_code >= 500)
+        if retryable:
+            # Cuenta para el cortacircuitos; si es inalcanzable además sale de la rotación
+            self.pool.record_failure(backend, unreachable=unreachable)
+        return OllamaError(f"Error calling Ollama at {backend.url}: {content or exc}", retryable=retryable)
+
+    # ---------- reintentos y cobertura (hedging) ----------
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": evita que los reintentos de muchas peticiones se sincronicen
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * (2 ** attempt)))
+
+    def _record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _p95(self) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Espera antes de lanzar la petición de cobertura (``None``: no se cubre)."""
+        if not self.hedge or len(self.pool.backends) < 2:
+            return None
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_initial_delay
+        return self._p95()
+
+    def _count(self, attr: str) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=self._limits.max_connections or 20, thread_name_prefix="ollama-hedge"
+                )
+            return self._hedge_executor
+
+    def _with_retries(self, attempt: Callable[[], str]) -> str:
+        for n in range(self.retries + 1):
+            try:
+                return attempt()
+            except OllamaError as exc:
+                if not exc.retryable or n >= self.retries:
+                    raise
+                self._count("retried")
+                time.sleep(self._backoff(n))
+
+    async def _with_aretries(self, attempt: Callable[[], Any]) -> str:
+        for n in range(self.retries + 1):
+            try:
+                return await attempt()
+            except OllamaError as exc:
+                if not exc.retryable or n >= self.retries:
+                    raise
+                self._count("retried")
+                await asyncio.sleep(self._backoff(n))
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self._p95()
+        return {
+            "retries": self.retried,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_p95_ms": round(p95 * 1000, 3) if p95 is not None else None,
+        }
+
+    # ---------- nodos ----------
+    def _probe(self, backend: OllamaBackend) -> List[str]:
+        response = self.client.get(f"{backend.url}/api/tags", timeout=self._timeout.connect or 5.0)
+        response.raise_for_status()
+        return [m.get("name") for m in response.json().get("models", []) if m.get("name")]
+
+    def check_backends(self) -> None:
+        """Comprueba la salud (y el inventario de modelos) de todos los nodos."""
+        self.pool.check(self._probe)
+
+    def start_health_checks(self, interval: float) -> None:
+        self.pool.start_health_checks(self._probe, interval)
+
+    # ---------- caché ----------
+    def _cache_key(self, prompt: str, model: Optional[str], options: Optional[Dict[str, Any]], use_cache: bool) -> Optional[str]:
+        if self.cache is None or not use_cache:
+            return None
+        return self.cache.make_key(model or self.default_model, prompt, options)
+
+    def _flight_key(self, prompt: str, model: Optional[str], options: Optional[Dict[str, Any]], use_cache: bool) -> Optional[str]:
+        # use_cache=False pide una generación nueva: tampoco se comparte la que está en curso
+        if self.single_flight is None or not use_cache:
+            return None
+        return LLMCache.make_key(model or self.default_model, prompt, options)
+
+    def _store(self, key: Optional[str], text: str, model: Optional[str]) -> None:
+        if key is not None and text:
+            self.cache.set(key, text, model=model or self.default_model)
+
+    def generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+    ) -> str:
+        """Genera una respuesta completa (bloqueante) reutilizando el pool.
+
+        Las llamadas idénticas que coinciden en el tiempo comparten una sola
+        generación (``single_flight``).
+        """
+        key = self._cache_key(prompt, model, options, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        flight_key = self._flight_key(prompt, model, options, use_cache)
+        if flight_key is None:
+            return self._generate(prompt, model, options, key)
+        return self.single_flight.do(flight_key, self._generate, prompt, model, options, key)
+
+    def _generate(self, prompt: str, model: Optional[str], options: Optional[Dict[str, Any]], key: Optional[str]) -> str:
+        payload = self._payload(prompt, model, options, False)
+        text = self._with_retries(lambda: self._attempt(model or self.default_model, payload))
+        self._store(key, text, model)
+        return text
+
+    def _send(self, lease: Lease, payload: Dict[str, Any]) -> str:
+        """Una petición a un nodo ya elegido (libera el hueco al terminar)."""
+        backend = lease.backend
+        start = time.perf_counter()
+        try:
+            response = self.client.post(f"{backend.url}/api/generate", json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            raise self._error(exc, backend) from exc
+        finally:
+            self.pool.release(lease)
+        self._record_latency(time.perf_counter() - start)
+        self.pool.record_success(backend)
+        return response.json().get("response", "")
+
+    def _attempt(self, model: str, payload: Dict[str, Any]) -> str:
+        delay = self._hedge_delay()
+        primary = self.pool.pick(model)
+        if delay is None:
+            return self._send(primary, payload)
+
+        executor = self._get_hedge_executor()
+        first = executor.submit(self._send, primary, payload)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        try:
+            backup = self.pool.pick(model, exclude=(primary.backend,))
+        except OllamaError:
+            return first.result()
+        self._count("hedges")
+        second = executor.submit(self._send, backup, payload)
+        error: Optional[OllamaError] = None
+        # La perdedora sigue en segundo plano: httpx síncrono no se puede cancelar
+        for future in as_completed((first, second)):
+            try:
+                text = future.result()
+            except OllamaError as exc:
+                error = exc
+                continue
+            if future is second:
+                self._count("hedge_wins")
+            return text
+        raise error
+
+    async def agenerate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+    ) -> str:
+        """Versión ``async`` de :meth:`generate`; no ocupa un hilo del threadpool."""
+        key = self._cache_key(prompt, model, options, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        flight_key = self._flight_key(prompt, model, options, use_cache)
+        if flight_key is None:
+            return await self._agenerate(prompt, model, options, key)
+        return await self.single_flight.ado(flight_key, self._agenerate, prompt, model, options, key)
+
+    async def _agenerate(self, prompt: str, model: Optional[str], options: Optional[Dict[str, Any]], key: Optional[str]) -> str:
+        payload = self._payload(prompt, model, options, False)
+        text = await self._with_aretries(lambda: self._aattempt(model or self.default_model, payload))
+        self._store(key, text, model)
+        return text
+
+    async def _asend(self, lease: Lease, payload: Dict[str, Any]) -> str:
+        backend = lease.backend
+        start = time.perf_counter()
+        try:
+            response = await self.async_client.post(f"{backend.url}/api/generate", json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            raise self._error(exc, backend) from exc
+        finally:
+            self.pool.release(lease)
+        self._record_latency(time.perf_counter() - start)
+        self.pool.record_success(backend)
+        return response.json().get("response", "")
+
+    async def _aattempt(self, model: str, payload: Dict[str, Any]) -> str:
+        delay = self._hedge_delay()
+        primary = self.pool.pick(model)
+        if delay is None:
+            return await self._asend(primary, payload)
+
+        pending = {asyncio.ensure_future(self._asend(primary, payload))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+            try:
+                backup = self.pool.pick(model, exclude=(primary.backend,))
+            except OllamaError:
+                return await next(iter(pending))
+            self._count("hedges")
+            second = asyncio.ensure_future(self._asend(backup, payload))
+            pending.add(second)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    if not isinstance(task.exception(), OllamaError):
+                        raise task.exception()
+                    error = task.exception()
+            raise error
+        finally:
+            # La petición perdedora se cancela y libera su hueco en el nodo
+            for task in pending:
+                task.cancel()
+
+    def _token(self, line: str, backend: OllamaBackend) -> Optional[Dict[str, Any]]:
+        if not line.strip():
+            return None
+        data = json.loads(line)
+        if data.get("error"):
+            logger.error("Ollama stream failed: %s", data["error"])
+            raise OllamaError(f"Error calling Ollama at {backend.url}: {data['error']}")
+        return data
+
+    def stream_generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+    ) -> Iterator[str]:
+        """Itera los fragmentos de texto a medida que Ollama los genera (``stream=True``).
+
+        Con acierto en caché se emite la respuesta completa como único fragmento.
+        """
+        key = self._cache_key(prompt, model, options, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        with self.pool.route(model or self.default_model) as backend:
+            try:
+                with self.client.stream("POST", f"{backend.url}/api/generate", json=self._payload(prompt, model, options, True)) as response:
+                    if response.is_error:
+                        response.read()
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        data = self._token(line, backend)
+                        if data is None:
+                            continue
+                        if data.get("response"):
+                            chunks.append(data["response"])
+                            yield data["response"]
+                        if data.get("done"):
+                            self._store(key, "".join(chunks), model)
+                            self.pool.record_success(backend)
+                            break
+            except httpx.HTTPError as exc:
+                raise self._error(exc, backend) from exc
+
+    async def astream_generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """Versión ``async`` de :meth:`stream_generate`."""
+        key = self._cache_key(prompt, model, options, use_cache)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        with self.pool.route(model or self.default_model) as backend:
+            try:
+                async with self.async_client.stream("POST", f"{backend.url}/api/generate", json=self._payload(prompt, model, options, True)) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        data = self._token(line, backend)
+                        if data is None:
+                            continue
+                        if data.get("response"):
+                            chunks.append(data["response"])
+                            yield data["response"]
+                        if data.get("done"):
+                            self._store(key, "".join(chunks), model)
+                            self.pool.record_success(backend)
+                            break
+            except httpx.HTTPError as exc:
+                raise self._error(exc, backend) from exc
+
+    def close(self) -> None:
+        self.pool.stop_health_checks()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client(settings: Optional[Settings] = None) -> OllamaClient:
+    """Devuelve el cliente compartido por todo el proceso (se crea en el primer uso)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                settings = settings or get_settings()
+                _client = OllamaClient.from_settings(settings)
+                if len(_client.pool.backends) > 1:
+                    _client.start_health_checks(settings.ollama_health_interval)
+    return _client
+
+
+async def close_ollama_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def call_ollama(
+    prompt: str,
+    model: Optional[str] = None,
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+) -> str:
+    """Llama al endpoint de generación de Ollama con el prompt indicado.
+
+    ``use_cache=False`` fuerza una generación nueva aunque exista en caché.
+    """
+    return get_ollama_client(settings).generate(prompt, model=model, use_cache=use_cache)
+
+
+async def acall_ollama(
+    prompt: str,
+    model: Optional[str] = None,
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+) -> str:
+    """Igual que :func:`call_ollama` pero sin bloquear el event loop."""
+    return await get_ollama_client(settings).agenerate(prompt, model=model, use_cache=use_cache)
+
+
+def stream_ollama(
+    prompt: str,
+    model: Optional[str] = None,
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """Devuelve un iterador con los tokens de la respuesta según llegan."""
+    return get_ollama_client(settings).stream_generate(prompt, model=model, use_cache=use_cache)
+
 
-    result = response.json()
-    return result.get("response", "")
+def astream_ollama(
+    prompt: str,
+    model: Optional[str] = None,
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+) -> AsyncIterator[str]:
+    """Versión ``async`` de :func:`stream_ollama`."""
+    return get_ollama_client(settings).astream_generate(prompt, model=model, use_cache=use_cache)
@@ -0,0 +1,279 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaError(RuntimeError):
+    """Fallo al generar con Ollama.
+
+    ``retryable`` indica si tiene sentido reintentar (conexión, 5xx) y
+    ``retry_after`` una espera sugerida al cliente cuando se falla rápido.
+    """
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Cortacircuitos de un nodo: tras ``failure_threshold`` fallos seguidos se
+    abre y el nodo no recibe peticiones durante ``reset_seconds``; después deja
+    pasar una sola petición de prueba (semiabierto) que lo cierra o lo reabre.
+
+    ``trial`` guarda la ficha de la petición de prueba en curso (``None`` si no
+    hay ninguna) para que sólo ella la libere.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial: Optional[object] = None
+        self.opens = 0
+
+    def available(self, now: float) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.reset_seconds
+        return self.trial is None
+
+    def on_pick(self, now: float) -> Optional[object]:
+        """Apunta una petición; devuelve la ficha si es la de prueba."""
+        if self.state == self.CLOSED:
+            return None
+        self.state = self.HALF_OPEN
+        self.trial = object()
+        return self.trial
+
+    def end_trial(self, token: Optional[object]) -> None:
+        if token is not None and self.trial is token:
+            self.trial = None
+
+    def retry_after(self, now: float) -> int:
+        return max(1, int(self.opened_at + self.reset_seconds - now + 0.999))
+
+    def success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial = None
+
+    def failure(self, now: float) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = now
+        self.trial = None
+
+
+class Lease:
+    """Petición en curso en un nodo; se devuelve con ``OllamaPool.release``."""
+
+    __slots__ = ("backend", "trial")
+
+    def __init__(self, backend: "OllamaBackend", trial: Optional[object] = None):
+        self.backend = backend
+        self.trial = trial
+
+
+class OllamaBackend:
+    """Un nodo de Ollama: URL, modelos que sirve y peso relativo.
+
+    Sin ``models`` configurados se usa el inventario que devuelve el propio
+    nodo en ``/api/tags`` (y, mientras no se conozca, se asume que sirve todo).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        models: Optional[Iterable[str]] = None,
+        weight: float = 1.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.url = url.rstrip("/")
+        self.models = frozenset(models) if models else None
+        self.weight = weight if weight > 0 else 1.0
+        self.discovered: Optional[frozenset] = None
+        self.breaker = breaker or CircuitBreaker()
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_check: Optional[float] = None
+
+    def serves(self, model: str) -> bool:
+        inventory = self.models or self.discovered
+        return inventory is None or model in inventory
+
+    def stats(self) -> Dict[str, Any]:
+        inventory = self.models or self.discovered
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "models": sorted(inventory) if inventory is not None else None,
+        }
+
+
+def parse_backends(spec: str) -> List[OllamaBackend]:
+    """Interpreta ``OLLAMA_BACKENDS``: ``url|modelo1;modelo2|peso`` separados por comas.
+
+    Modelos y peso son opcionales: ``http://a:11434,http://b:11434|llama3:8b|2``.
+    """
+    backends: List[OllamaBackend] = []
+    for item in spec.split(","):
+        url, _, rest = item.strip().partition("|")
+        if not url.strip():
+            continue
+        models, _, weight = rest.partition("|")
+        try:
+            parsed_weight = float(weight) if weight.strip() else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid weight for Ollama backend {url.strip()}: {weight!r}")
+        backends.append(OllamaBackend(
+            url.strip(),
+            models=[m.strip() for m in models.split(";") if m.strip()],
+            weight=parsed_weight,
+        ))
+    return backends
+
+
+class OllamaPool:
+    """Reparte las generaciones entre varios nodos de Ollama.
+
+    Cada petición va al nodo sano que sirve el modelo con menos peticiones en
+    curso en proporción a su peso. Los nodos inalcanzables salen de la rotación
+    hasta que la comprobación de salud en segundo plano los recupera; si no
+    queda ninguno sano se sigue intentando con los que sirven el modelo. Los
+    nodos con el cortacircuitos abierto no se usan: si no queda otro se falla
+    enseguida con ``OllamaError``.
+    """
+
+    def __init__(
+        self,
+        backends: List[OllamaBackend],
+        breaker_failures: Optional[int] = None,
+        breaker_reset_seconds: Optional[float] = None,
+    ):
+        if not backends:
+            raise ValueError("OllamaPool needs at least one backend")
+        self.backends = backends
+        for backend in backends:
+            if breaker_failures is not None:
+                backend.breaker.failure_threshold = max(1, breaker_failures)
+            if breaker_reset_seconds is not None:
+                backend.breaker.reset_seconds = breaker_reset_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._checker: Optional[threading.Thread] = None
+
+    def pick(self, model: str, exclude: Collection[OllamaBackend] = ()) -> Lease:
+        """Elige nodo y le apunta una petición en curso (liberar con ``release``)."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b.serves(model) and b not in exclude]
+            if not candidates:
+                raise OllamaError(f"No Ollama backend serves model {model}")
+            closed = [b for b in candidates if b.breaker.available(now)]
+            if not closed:
+                raise OllamaError(
+                    f"Ollama unavailable for model {model}: circuit open",
+                    retry_after=min(b.breaker.retry_after(now) for b in candidates),
+                )
+            healthy = [b for b in closed if b.healthy] or closed
+            backend = min(healthy, key=lambda b: ((b.outstanding + 1) / b.weight, b.requests))
+            trial = backend.breaker.on_pick(now)
+            backend.outstanding += 1
+            backend.requests += 1
+            return Lease(backend, trial)
+
+    def release(self, lease: Lease) -> None:
+        with self._lock:
+            lease.backend.outstanding -= 1
+            # Una prueba semiabierta cancelada no debe bloquear el nodo; las
+            # demás peticiones en curso no tocan la prueba
+            lease.backend.breaker.end_trial(lease.trial)
+
+    def record_success(self, backend: OllamaBackend) -> None:
+        with self._lock:
+            if backend.breaker.state != CircuitBreaker.CLOSED:
+                logger.info("Ollama backend %s circuit closed", backend.url)
+            backend.breaker.success()
+            backend.healthy = True
+
+    def record_failure(self, backend: OllamaBackend, unreachable: bool = False) -> None:
+        """Apunta un fallo reintentable; ``unreachable`` además lo saca de la rotación."""
+        with self._lock:
+            backend.failures += 1
+            was_open = backend.breaker.state == CircuitBreaker.OPEN
+            backend.breaker.failure(time.monotonic())
+            if not was_open and backend.breaker.state == CircuitBreaker.OPEN:
+                logger.warning("Ollama backend %s circuit opened", backend.url)
+            if unreachable:
+                if backend.healthy and len(self.backends) > 1:
+                    logger.warning("Ollama backend %s marked unhealthy", backend.url)
+                backend.healthy = False
+
+    @contextmanager
+    def route(self, model: str, exclude: Collection[OllamaBackend] = ()) -> Iterator[OllamaBackend]:
+        lease = self.pick(model, exclude)
+        try:
+            yield lease.backend
+        finally:
+            self.release(lease)
+
+    # ---------- comprobaciones de salud ----------
+    def check(self, probe: Callable[[OllamaBackend], Optional[Iterable[str]]]) -> None:
+        """Sondea todos los nodos; ``probe`` devuelve los modelos del nodo o lanza si está caído."""
+        for backend in self.backends:
+            try:
+                models = probe(backend)
+            except Exception as exc:
+                logger.debug("Ollama backend %s health check failed: %s", backend.url, exc)
+                ok, models = False, None
+            else:
+                ok = True
+            with self._lock:
+                if ok and not backend.healthy:
+                    logger.info("Ollama backend %s back in rotation", backend.url)
+                backend.healthy = ok
+                backend.last_check = time.monotonic()
+                if models is not None:
+                    backend.discovered = frozenset(models)
+
+    def start_health_checks(self, probe: Callable[[OllamaBackend], Optional[Iterable[str]]], interval: float) -> None:
+        if interval <= 0 or self._checker is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.check(probe)
+
+        self._checker = threading.Thread(target=loop, name="ollama-health", daemon=True)
+        self._checker.start()
+
+    def stop_health_checks(self) -> None:
+        self._stop.set()
+        self._checker = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.stats() for b in self.backends]
@@ -0,0 +1,138 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+@lru_cache
+def _context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+# Funciones de nivel de módulo: se ejecutan en los procesos del pool y
+# devuelven además lo que tardó el hash en sí (para separar cola de CPU).
+
+def _hash(password: str, rounds: int) -> Tuple[str, float]:
+    start = time.perf_counter()
+    return _context(rounds).hash(password), time.perf_counter() - start
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> Tuple[Tuple[bool, Optional[str]], float]:
+    start = time.perf_counter()
+    return _context(rounds).verify_and_update(password, hashed), time.perf_counter() - start
+
+
+class PasswordHasher:
+    """Hash de contraseñas bcrypt fuera de los workers HTTP.
+
+    Cada bcrypt cuesta ~250 ms de CPU con el GIL tomado; aquí se ejecutan en
+    un ``ProcessPoolExecutor`` de ``max_workers`` procesos y un semáforo
+    limita cuántas peticiones pueden estar esperando a la vez. Con
+    ``max_workers=0`` se hashea en el propio proceso (útil en desarrollo).
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_concurrency: int = 8):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.rehashes = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # "spawn": el proceso padre tiene hilos (cola de trabajos, httpx) y fork no es seguro
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _run(self, fn: Callable[..., Tuple[Any, float]], *args) -> Any:
+        start = time.perf_counter()
+        with self._semaphore:
+            with self._lock:
+                self.in_flight += 1
+            try:
+                if self.max_workers > 0:
+                    result, cpu = self._get_executor().submit(fn, *args).result()
+                else:
+                    result, cpu = fn(*args)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+        waited = max(0.0, time.perf_counter() - start - cpu)
+        with self._lock:
+            self.calls += 1
+            self.queue_seconds_total += waited
+            self.queue_seconds_max = max(self.queue_seconds_max, waited)
+            self.hash_seconds_total += cpu
+        return result
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password, self.rounds)
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Verifica la contraseña y, si el hash usa otro coste, devuelve uno nuevo."""
+        ok, new_hash = self._run(_verify_and_update, password, hashed, self.rounds)
+        if new_hash:
+            with self._lock:
+                self.rehashes += 1
+        return ok, new_hash
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.max_workers,
+                "calls": self.calls,
+                "in_flight": self.in_flight,
+                "rehashes": self.rehashes,
+                "queue_ms_avg": round(self.queue_seconds_total * 1000 / self.calls, 3) if self.calls else 0.0,
+                "queue_ms_max": round(self.queue_seconds_max * 1000, 3),
+                "hash_ms_avg": round(self.hash_seconds_total * 1000 / self.calls, 3) if self.calls else 0.0,
+            }
+
+
+_hasher: Optional[PasswordHasher] = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Hasher compartido por el proceso (el pool se arranca en el primer uso)."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                from app.core.config import get_settings
+
+                settings = get_settings()
+                _hasher = PasswordHasher(
+                    rounds=settings.bcrypt_rounds,
+                    max_workers=settings.password_hash_workers,
+                    max_concurrency=settings.password_hash_max_concurrency,
+                )
+    return _hasher
+
+
+def shutdown_password_hasher() -> None:
+    global _hasher
+    if _hasher is not None:
+        _hasher.shutdown()
+        _hasher = None
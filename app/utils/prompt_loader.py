@@ -1,9 +1,21 @@
 import os
 
+from app.utils.template_registry import TemplateRegistry
+
 BASE_PATH = os.path.join(os.path.dirname(__file__), "..", "static", "prompts")
 
+# Placeholders que cada prompt debe contener (se validan al arrancar)
+PROMPT_PLACEHOLDERS = {
+    "add_requisites.txt": {"categoria_upper", "descripcion_usuario", "requisitos_actuales", "ejemplo_requisitos_block"},
+    "analyze_requisites.txt": {"lista_requisitos"},
+    "generate_new_requisites.txt": {"descripcion_usuario", "preguntas_y_respuestas", "ejemplo_estilo_block"},
+    "improve_requisites.txt": {"descripcion_usuario", "preguntas_y_respuestas", "requisitos_actuales", "ejemplo_estilo_block"},
+    "project_questions.txt": {"descripcion_usuario"},
+    "stall_chat.txt": {"lang", "descripcion_usuario", "requisitos_actuales", "historial_chat", "mensaje_usuario"},
+    "summarize_chat.txt": {"lang", "resumen_previo", "nuevos_mensajes"},
+}
+
+prompts = TemplateRegistry(BASE_PATH, PROMPT_PLACEHOLDERS)
+
 def load_prompt(filename: str, **kwargs):
-    path = os.path.join(BASE_PATH, filename)
-    with open(path, encoding="utf-8") as f:
-        text = f.read()
-    return text.format(**kwargs)
+    return prompts.render(filename, **kwargs)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una sola ejecución.
+
+    El primero que llega con una clave ejecuta la función; los que llegan
+    mientras sigue en curso esperan y reciben su resultado (o su excepción).
+    No guarda nada al terminar: de eso se encarga la caché.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[Tuple[int, str], "asyncio.Future"] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Versión ``async``: agrupa sólo llamadas del mismo event loop."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            existing = self._async_calls.get(flight_key)
+            if existing is not None:
+                self.coalesced += 1
+            else:
+                shared = self._async_calls[flight_key] = loop.create_future()
+                self.executions += 1
+        if existing is not None:
+            # shield: cancelar a un seguidor no debe cancelar la llamada compartida
+            return await asyncio.shield(existing)
+
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            shared.cancel()
+            raise
+        except BaseException as exc:
+            shared.set_exception(exc)
+            # Evita el aviso "exception was never retrieved" si nadie esperaba
+            shared.exception()
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._async_calls.pop(flight_key, None)
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._async_calls)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from string import Formatter
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+
+class TemplateError(ValueError):
+    """Plantilla inexistente o con placeholders distintos de los esperados."""
+
+
+def _placeholders(text: str) -> FrozenSet[str]:
+    return frozenset(
+        field.split(".")[0].split("[")[0]
+        for _, field, _, _ in Formatter().parse(text)
+        if field
+    )
+
+
+class Template:
+    """Plantilla cargada en memoria con sus placeholders ya analizados."""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.load()
+
+    def load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            self.text = f.read()
+        self.mtime = os.stat(self.path).st_mtime
+        self.fields = _placeholders(self.text)
+        self.checked_at = time.monotonic()
+
+    def render(self, **kwargs) -> str:
+        if not self.fields:
+            return self.text
+        return self.text.format(**kwargs)
+
+
+class TemplateRegistry:
+    """Registro de las plantillas ``.txt`` de un directorio.
+
+    - Carga y valida todas las plantillas una vez (``load_all``).
+    - Sirve el texto desde memoria; sólo hace ``stat`` del fichero como mucho
+      cada ``reload_interval`` segundos y lo recarga si cambió su mtime
+      (``reload_interval=0`` desactiva la recarga).
+    - ``required`` declara los placeholders que cada plantilla debe contener.
+    """
+
+    def __init__(self, base_path: str, required: Optional[Dict[str, Iterable[str]]] = None, reload_interval: float = 2.0):
+        self.base_path = base_path
+        self.required = {name: frozenset(fields) for name, fields in (required or {}).items()}
+        self.reload_interval = reload_interval
+        self._templates: Dict[str, Template] = {}
+        self._lock = threading.Lock()
+
+    def load_all(self) -> List[str]:
+        """Carga todas las plantillas y lanza ``TemplateError`` si alguna no es válida."""
+        with self._lock:
+            for filename in sorted(os.listdir(self.base_path)):
+                if filename.endswith(".txt"):
+                    self._templates[filename] = Template(filename, os.path.join(self.base_path, filename))
+        errors = self.validate()
+        if errors:
+            raise TemplateError("; ".join(errors))
+        return sorted(self._templates)
+
+    def validate(self) -> List[str]:
+        errors: List[str] = []
+        for name, expected in self.required.items():
+            template = self._templates.get(name)
+            if template is None:
+                errors.append(f"{name}: missing template")
+                continue
+            missing = expected - template.fields
+            unexpected = template.fields - expected
+            if missing:
+                errors.append(f"{name}: missing placeholders {sorted(missing)}")
+            if unexpected:
+                errors.append(f"{name}: unexpected placeholders {sorted(unexpected)}")
+        return errors
+
+    def get(self, name: str) -> Template:
+        template = self._templates.get(name)
+        if template is None:
+            path = os.path.join(self.base_path, name)
+            if not os.path.isfile(path):
+                raise TemplateError(f"{name}: missing template")
+            with self._lock:
+                template = self._templates.setdefault(name, Template(name, path))
+            return template
+        if self.reload_interval and time.monotonic() - template.checked_at >= self.reload_interval:
+            self._maybe_reload(template)
+        return template
+
+    def _maybe_reload(self, template: Template) -> None:
+        with self._lock:
+            template.checked_at = time.monotonic()
+            try:
+                mtime = os.stat(template.path).st_mtime
+            except OSError:
+                return
+            if mtime != template.mtime:
+                template.load()
+
+    def resolve(self, key: str, lang: str) -> str:
+        """Nombre de la variante de idioma de ``key`` (``key_es.txt``, ``key_en.txt``...).
+
+        Si no existe la variante del idioma se usa la inglesa y, en último
+        caso, ``key.txt``.
+        """
+        prefix = str(lang or "").strip().lower()[:2]
+        for candidate in (f"{key}_{prefix}.txt", f"{key}_en.txt", f"{key}.txt"):
+            if candidate in self._templates or os.path.isfile(os.path.join(self.base_path, candidate)):
+                return candidate
+        raise TemplateError(f"{key}: no template for language {lang!r}")
+
+    def render(self, name: str, **kwargs) -> str:
+        return self.get(name).render(**kwargs)
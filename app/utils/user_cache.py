@@ -0,0 +1,94 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import get_settings
+
+# (user_id, iat del token)
+UserKey = Tuple[int, Optional[int]]
+
+
+class UserCache:
+    """Caché en memoria de los usuarios autenticados (``get_current_user``).
+
+    Guarda una copia de las columnas del ``User`` por ``(id, iat)`` durante
+    ``ttl_seconds``: basta para absorber el polling sin servir datos viejos
+    mucho tiempo. Cualquier escritura del usuario debe llamar a ``invalidate``.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[UserKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, user_id: int, iat: Optional[int]) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((user_id, iat))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((user_id, iat))
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[(user_id, iat)]
+            self.misses += 1
+            return None
+
+    def set(self, user_id: int, iat: Optional[int], data: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[(user_id, iat)] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(data))
+            self._entries.move_to_end((user_id, iat))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        """Olvida todas las entradas del usuario (cualquier token)."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_cache: Optional[UserCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache() -> UserCache:
+    """Caché compartida por el proceso (se crea en el primer uso)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                settings = get_settings()
+                _cache = UserCache(
+                    max_entries=settings.user_cache_max_entries,
+                    ttl_seconds=settings.user_cache_ttl_seconds,
+                )
+    return _cache
@@ -0,0 +1,108 @@
+"""Benchmark: alta de filas vía ORM (``session.add`` + flush) frente a ``bulk_insert``.
+
+Compara, para distintos tamaños, el tiempo de insertar líneas de ejemplo
+(``SampleRequirement``) y requisitos con RETURNING (``insert_requirements``).
+
+Uso::
+
+    python scripts/bench_bulk_insert.py                        # sqlite temporal
+    python scripts/bench_bulk_insert.py --url postgresql://...   # BD vacía de pruebas
+    python scripts/bench_bulk_insert.py --sizes 1000 10000 100000
+
+¡Borra y recrea las tablas de la BD indicada! No usarlo contra datos reales.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, delete
+from sqlmodel import SQLModel, Session
+
+from app.models.user import User
+from app.models.project import Project
+from app.models.requirement import Requirement
+from app.models.sample_content import SampleContent
+from app.models.sample_requirement import SampleRequirement
+from app.utils.bulk_insert import bulk_insert
+
+
+def orm_samples(session, n):
+    for i in range(n):
+        session.add(SampleRequirement(text=f"Línea de ejemplo {i}", content_id=1))
+    session.commit()
+
+
+def bulk_samples(session, n):
+    bulk_insert(session, SampleRequirement, ({"text": f"Línea de ejemplo {i}", "content_id": 1} for i in range(n)))
+    session.commit()
+
+
+def orm_requirements(session, n):
+    reqs = [
+        Requirement(description=f"Requisito {i}", number=i + 1, project_id=1, owner_id=1)
+        for i in range(n)
+    ]
+    session.add_all(reqs)
+    session.flush()
+    ids = [r.id for r in reqs]  # el ORM ya necesita los ids para el snapshot
+    session.commit()
+    return ids
+
+
+def bulk_requirements(session, n):
+    now = datetime.utcnow()
+    rows = bulk_insert(session, Requirement, (
+        {"description": f"Requisito {i}", "status": "draft", "category": "functional", "priority": "must",
+         "visual_reference": None, "number": i + 1, "project_id": 1, "owner_id": 1,
+         "created_at": now, "updated_at": now}
+        for i in range(n)
+    ), returning=(Requirement.id,))
+    session.commit()
+    return [r.id for r in rows]
+
+
+CASES = [
+    ("samples ORM", orm_samples, SampleRequirement),
+    ("samples bulk", bulk_samples, SampleRequirement),
+    ("requirements ORM", orm_requirements, Requirement),
+    ("requirements bulk+RETURNING", bulk_requirements, Requirement),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL de la BD (por defecto un sqlite temporal)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    url = args.url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(url)
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, username="bench", email="bench@example.com", password_hash="x"))
+        session.add(Project(id=1, name="P", description="", owner_id=1))
+        session.add(SampleContent(id=1, sha256="bench"))
+        session.commit()
+
+    print(f"BD: {url}")
+    print(f"{'caso':<30}{'filas':>10}{'segundos':>12}{'filas/s':>14}")
+    for n in args.sizes:
+        for label, fn, model in CASES:
+            with Session(engine) as session:
+                start = time.perf_counter()
+                fn(session, n)
+                elapsed = time.perf_counter() - start
+                session.execute(delete(model))
+                session.commit()
+            print(f"{label:<30}{n:>10}{elapsed:>12.3f}{n / elapsed:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
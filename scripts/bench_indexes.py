@@ -0,0 +1,173 @@
+"""Benchmark de las consultas calientes con y sin los índices compuestos.
+
+Genera un conjunto sintético grande (proyectos, filas de ``statemachine``
+append-only, historial de chat y requisitos), muestra el plan de cada consulta
+y mide su latencia antes y después de crear los índices.
+
+Uso::
+
+    python scripts/bench_indexes.py                       # sqlite temporal
+    python scripts/bench_indexes.py --url postgresql://...  # BD vacía de pruebas
+    python scripts/bench_indexes.py --projects 500 --states 200 --messages 400
+
+¡Borra y recrea las tablas de la BD indicada! No usarlo contra datos reales.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, insert, text
+from sqlmodel import SQLModel, Session, select
+
+from app.models.user import User
+from app.models.project import Project
+from app.models.state_machine import StateMachine
+from app.models.chat_message import ChatMessage
+from app.models.requirement import Requirement
+
+CATEGORIES = ["functional", "performance", "usability", "security", "technical"]
+
+COMPOSITE_INDEXES = [
+    StateMachine.__table__.indexes,
+    ChatMessage.__table__.indexes,
+    Requirement.__table__.indexes,
+]
+
+
+def latest_state(project_id):
+    return (
+        select(StateMachine)
+        .where(StateMachine.project_id == project_id)
+        .order_by(StateMachine.last_updated.desc())
+        .limit(1)
+    )
+
+
+def recent_history(project_id):
+    return (
+        select(ChatMessage)
+        .where(ChatMessage.project_id == project_id)
+        .order_by(ChatMessage.timestamp.desc())
+        .limit(14)
+    )
+
+
+def requirements(project_id):
+    return (
+        select(Requirement)
+        .where(Requirement.project_id == project_id)
+        .order_by(Requirement.category, Requirement.number)
+    )
+
+
+QUERIES = {
+    "latest_state": latest_state,
+    "recent_history": recent_history,
+    "requirements": requirements,
+}
+
+
+def populate(engine, projects, states, messages, reqs):
+    rnd = random.Random(42)
+    base = datetime(2024, 1, 1)
+    with Session(engine) as session:
+        session.execute(insert(User), [{"id": 1, "username": "bench", "email": "bench@example.com", "password_hash": "x"}])
+        session.execute(insert(Project), [
+            {"id": p, "name": f"P{p}", "description": "", "owner_id": 1} for p in range(1, projects + 1)
+        ])
+        # Se inserta intercalando proyectos, como ocurre en producción
+        session.execute(insert(StateMachine), [
+            {"project_id": p, "state": "stall", "last_updated": base + timedelta(minutes=i * projects + p), "extra": {}}
+            for i in range(states) for p in range(1, projects + 1)
+        ])
+        session.execute(insert(ChatMessage), [
+            {"project_id": p, "sender": rnd.choice(["user", "ai"]), "content": "x" * 200, "state": "stall",
+             "timestamp": base + timedelta(seconds=i * projects + p)}
+            for i in range(messages) for p in range(1, projects + 1)
+        ])
+        session.execute(insert(Requirement), [
+            {"project_id": p, "owner_id": 1, "category": CATEGORIES[i % len(CATEGORIES)], "number": i // len(CATEGORIES) + 1,
+             "description": f"Requisito {i}", "status": "draft", "priority": "must",
+             "created_at": base, "updated_at": base}
+            for i in range(reqs) for p in range(1, projects + 1)
+        ])
+        session.commit()
+
+
+def explain(engine, stmt):
+    compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN ANALYZE "
+    with engine.connect() as conn:
+        rows = conn.execute(text(prefix + str(compiled))).all()
+    return "\n".join("    " + " | ".join(str(c) for c in row) for row in rows)
+
+
+def measure(engine, build, projects, runs):
+    timings = []
+    with Session(engine) as session:
+        for _ in range(runs):
+            project_id = random.randint(1, projects)
+            start = time.perf_counter()
+            session.exec(build(project_id)).all()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def report(engine, label, projects, runs):
+    print(f"\n=== {label} ===")
+    for name, build in QUERIES.items():
+        p50, p95 = measure(engine, build, projects, runs)
+        print(f"{name}: p50={p50:.3f} ms p95={p95:.3f} ms")
+        print(explain(engine, build(1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL de la BD (por defecto un sqlite temporal)")
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--states", type=int, default=100, help="filas de statemachine por proyecto")
+    parser.add_argument("--messages", type=int, default=300, help="mensajes de chat por proyecto")
+    parser.add_argument("--requirements", type=int, default=60, help="requisitos por proyecto")
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    url = args.url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(url)
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+
+    print(f"Poblando {url} ...")
+    populate(engine, args.projects, args.states, args.messages, args.requirements)
+
+    # Punto de partida: sólo los índices simples que existían antes
+    for indexes in COMPOSITE_INDEXES:
+        for index in indexes:
+            index.drop(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX bench_sm_project ON statemachine (project_id)"))
+        conn.execute(text("CREATE INDEX bench_chat_project ON chatmessage (project_id)"))
+        conn.execute(text("ANALYZE"))
+    report(engine, "Índices simples (project_id)", args.projects, args.runs)
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX bench_sm_project"))
+        conn.execute(text("DROP INDEX bench_chat_project"))
+    for indexes in COMPOSITE_INDEXES:
+        for index in indexes:
+            index.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    report(engine, "Índices compuestos", args.projects, args.runs)
+
+
+if __name__ == "__main__":
+    main()
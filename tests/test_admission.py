@@ -0,0 +1,214 @@
+import sys
+import os
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+os.environ.setdefault("database_url", "sqlite:///:memory:")
+os.environ.setdefault("secret_key", "testsecret")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel, Session, create_engine, select
+from sqlalchemy.pool import StaticPool
+from unittest.mock import patch
+
+from app.main import app
+from app.models.user import User
+from app.models.project import Project
+from app.models.state_machine import StateMachine
+from app.models.chat_message import ChatMessage
+from app.api.endpoints.auth import get_current_user
+from app.database import get_session
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+def test_per_user_cap_rejects_immediately():
+    controller = AdmissionController(max_concurrent=4, max_per_user=1, max_waiting=4, wait_seconds=5)
+    with controller.slot(1):
+        with pytest.raises(AdmissionRejected) as exc:
+            controller.acquire(1)
+        assert exc.value.retry_after >= 1
+        # Otro usuario sí entra
+        with controller.slot(2):
+            assert controller.stats()["active"] == 2
+    assert controller.stats()["active"] == 0
+    assert controller.stats()["rejected"] == 1
+
+
+def test_full_wait_queue_rejects_and_waiter_gets_freed_slot():
+    controller = AdmissionController(max_concurrent=1, max_per_user=1, max_waiting=1, wait_seconds=5)
+    controller.acquire(1)
+
+    admitted = threading.Event()
+
+    def waiter():
+        with controller.slot(2):
+            admitted.set()
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    while controller.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    # La cola (1 plaza) está ocupada por el usuario 2
+    with pytest.raises(AdmissionRejected):
+        controller.acquire(3)
+
+    controller.release(1)
+    t.join(timeout=5)
+    assert admitted.is_set()
+    stats = controller.stats()
+    assert stats["active"] == 0 and stats["waiting"] == 0
+    assert stats["admitted"] == 2 and stats["rejected"] == 1
+    assert stats["max_waiting_seen"] == 1
+
+
+def test_wait_timeout_rejects():
+    controller = AdmissionController(max_concurrent=1, max_per_user=1, max_waiting=2, wait_seconds=0.05)
+    with controller.slot(1):
+        with pytest.raises(AdmissionRejected):
+            controller.acquire(2)
+    assert controller.stats()["waiting"] == 0
+    # El usuario rechazado no queda contado
+    with controller.slot(2):
+        pass
+
+
+def test_endpoint_returns_429_without_persisting():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = User(id=1, username="alice", email="a@example.com", password_hash="hashed")
+        session.add(user)
+        session.add(Project(id=1, name="Proj", description="Desc", owner_id=1))
+        session.add(StateMachine(project_id=1, state="init", extra={"lang": "es"}))
+        session.commit()
+
+    def override_get_session():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    client = TestClient(app)
+
+    busy = AdmissionController(max_concurrent=1, max_per_user=1, max_waiting=0)
+    busy.acquire(99)
+    called = []
+    with patch("app.services.admission._controller", busy), \
+         patch("app.api.endpoints.state_machine.call_ollama", lambda prompt, **kw: called.append(prompt)):
+        response = client.post("/state_machine/project/1", json={"state": "analyze_requisites"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert called == []
+    with Session(engine) as session:
+        states = session.exec(select(StateMachine).where(StateMachine.project_id == 1)).all()
+        assert [s.state for s in states] == ["init"]
+
+    app.dependency_overrides.clear()
+
+
+def test_final_answer_rejected_then_retried_is_saved_once():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    user = User(id=1, username="alice", email="a@example.com", password_hash="hashed")
+    with Session(engine) as session:
+        session.add(User(id=1, username="alice", email="a@example.com", password_hash="hashed"))
+        session.add(Project(id=1, name="Proj", description="Desc", owner_id=1))
+        session.add(StateMachine(project_id=1, state="software_questions", extra={
+            "lang": "es", "questions": ["q1", "q2", "q3"], "current": 2, "answers": ["a1", "a2"],
+        }))
+        session.commit()
+
+    def override_get_session():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    client = TestClient(app)
+    body = {"content": "a3", "sender": "user", "project_id": 1, "state": "software_questions"}
+
+    busy = AdmissionController(max_concurrent=1, max_per_user=1, max_waiting=0)
+    busy.acquire(99)
+    with patch("app.services.admission._controller", busy):
+        assert client.post("/chat_messages/", json=body).status_code == 429
+
+    with Session(engine) as session:
+        assert session.exec(select(ChatMessage)).all() == []
+        sm = session.exec(select(StateMachine)).one()
+        assert sm.extra["current"] == 2 and sm.extra["answers"] == ["a1", "a2"]
+
+    with patch("app.services.admission._controller", AdmissionController()), \
+         patch("app.api.endpoints.chat_message.call_ollama", lambda prompt: "FUNCTIONAL:\n1. Login"):
+        assert client.post("/chat_messages/", json=body).status_code == 200
+
+    with Session(engine) as session:
+        user_msgs = session.exec(select(ChatMessage).where(ChatMessage.sender == "user")).all()
+        assert [m.content for m in user_msgs] == ["a3"]
+        states = session.exec(select(StateMachine).order_by(StateMachine.id)).all()
+        assert [s.state for s in states] == ["software_questions", "new_requisites"]
+        assert states[0].extra["answers"] == ["a1", "a2", "a3"]
+        assert states[1].extra["answers"] == ["a1", "a2", "a3"]
+
+    app.dependency_overrides.clear()
+
+
+def test_stream_endpoint_takes_and_releases_a_slot():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    user = User(id=1, username="alice", email="a@example.com", password_hash="hashed")
+    with Session(engine) as session:
+        session.add(User(id=1, username="alice", email="a@example.com", password_hash="hashed"))
+        session.add(Project(id=1, name="Proj", description="Desc", owner_id=1))
+        session.add(StateMachine(project_id=1, state="stall", extra={"lang": "es"}))
+        session.commit()
+
+    def override_get_session():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    client = TestClient(app)
+    body = {"content": "Hola", "sender": "user", "project_id": 1, "state": "stall"}
+
+    busy = AdmissionController(max_concurrent=1, max_per_user=1, max_waiting=0)
+    busy.acquire(99)
+    called = []
+    with patch("app.services.admission._controller", busy), \
+         patch("app.api.endpoints.chat_message.stream_ollama", lambda prompt: called.append(prompt) or iter(())):
+        response = client.post("/chat_messages/stream", json=body)
+    assert response.status_code == 429
+    assert called == []
+
+    controller = AdmissionController()
+    active = []
+
+    def fake_stream(prompt):
+        active.append(controller.stats()["active"])
+        yield "Hola"
+
+    with patch("app.services.admission._controller", controller), \
+         patch("app.api.endpoints.chat_message.stream_ollama", fake_stream):
+        response = client.post("/chat_messages/stream", json=body)
+    assert response.status_code == 200
+    assert active == [1]
+    assert controller.stats()["active"] == 0
+
+    app.dependency_overrides.clear()
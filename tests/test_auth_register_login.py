@@ -8,6 +8,7 @@ os.environ.setdefault("database_url", "sqlite:///:memory:")
 os.environ.setdefault("secret_key", "testsecret")
 
 import pytest
+from unittest.mock import patch
 from fastapi.testclient import TestClient
 from sqlmodel import SQLModel, Session, create_engine
 from sqlalchemy.pool import StaticPool
@@ -16,6 +17,8 @@ from app.main import app
 from app.models.user import User
 from app.api.endpoints.auth import get_session
 from app.core.security import get_password_hash
+from app.utils.password_hasher import PasswordHasher
+from app.utils.user_cache import get_user_cache
 
 
 engine = create_engine(
@@ -36,6 +39,8 @@ def override_get_session():
 def setup_db():
     SQLModel.metadata.drop_all(engine)
     SQLModel.metadata.create_all(engine)
+    # Cada test recrea la BD y los ids se repiten
+    get_user_cache().clear()
 
 
 @pytest.fixture
@@ -131,3 +136,62 @@ def test_login_fail_wrong_credentials_or_inactive(client):
     )
     assert inactive_resp.status_code == 403
     assert inactive_resp.json()["detail"] == "User inactive"
+
+
+def test_me_uses_user_cache_and_invalidates_on_update(client):
+    client.post(
+        "/auth/register",
+        json={"username": "frank", "email": "frank@example.com", "password": "secret"},
+    )
+    token = client.post(
+        "/auth/login", data={"username": "frank", "password": "secret"}
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    cache = get_user_cache()
+    before = cache.stats()
+
+    assert client.get("/auth/me", headers=headers).status_code == 200
+    assert client.get("/auth/me", headers=headers).json()["username"] == "frank"
+    after = cache.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+
+    # La actualización pasa por la instancia cacheada y debe persistir e invalidar
+    resp = client.put("/auth/me", json={"username": "franky"}, headers=headers)
+    assert resp.status_code == 200
+    assert client.get("/auth/me", headers=headers).json()["username"] == "franky"
+
+    # Desactivación fuera de /auth: la invalida el listener del modelo
+    with Session(engine) as session:
+        user = session.get(User, resp.json()["id"])
+        user.active = False
+        session.add(user)
+        session.commit()
+    assert client.get("/auth/me", headers=headers).json()["active"] is False
+
+    metrics = client.get("/metrics/", headers=headers).json()
+    assert metrics["user_cache"]["hits"] >= 1
+
+
+def test_login_rehashes_password_when_cost_changes(client):
+    with Session(engine) as session:
+        user = User(
+            username="gina",
+            email="gina@example.com",
+            password_hash=PasswordHasher(rounds=4, max_workers=0).hash("secret"),
+        )
+        session.add(user)
+        session.commit()
+        user_id = user.id
+
+    with patch("app.core.security.get_password_hasher", return_value=PasswordHasher(rounds=5, max_workers=1)) as hasher:
+        resp = client.post("/auth/login", data={"username": "gina", "password": "secret"})
+        assert resp.status_code == 200
+        assert hasher.return_value.stats()["rehashes"] == 1
+        hasher.return_value.shutdown()
+
+    with Session(engine) as session:
+        assert session.get(User, user_id).password_hash.startswith("$2b$05$")
+    # El hash nuevo sigue siendo válido
+    resp = client.post("/auth/login", data={"username": "gina", "password": "secret"})
+    assert resp.status_code == 200
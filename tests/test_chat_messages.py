@@ -1,21 +1,31 @@
 import sys
 import os
+import json
 from pathlib import Path
+from datetime import datetime, timedelta
+from unittest.mock import patch
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 os.environ.setdefault("database_url", "sqlite:///:memory:")
 
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel import SQLModel, Session, create_engine, select
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.models.user import User
 from app.models.project import Project
 from app.models.chat_message import ChatMessage
+from app.models.state_machine import StateMachine
+from app.models.requirement import Requirement
 from app.api.endpoints.auth import get_current_user
 from app.database import get_session
+from app.services.context_builder import load_project_context
+from app.services.conversation_summary import refresh_summary, summary_due
+from app.core.config import get_settings
+from app.services.chat_flow import PendingReply
+from app.utils.ollama_pool import OllamaError
 
 engine = create_engine(
     "sqlite://",
@@ -97,6 +107,64 @@ def test_list_messages_by_project():
     app.dependency_overrides.clear()
 
 
+def test_list_messages_keyset_pagination():
+    setup_db()
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+
+    with Session(engine) as session:
+        proj = Project(name="P1", description="d1", owner_id=user.id)
+        session.add(proj)
+        session.commit()
+        session.refresh(proj)
+        pid = proj.id
+        same_ts = datetime(2024, 1, 1)
+        # Varios mensajes con el mismo timestamp: el id desempata
+        for i in range(7):
+            session.add(ChatMessage(content=f"m{i}", sender="user", project_id=pid, state="stall",
+                                    timestamp=same_ts + timedelta(minutes=i // 2)))
+        session.commit()
+
+    def contents(resp):
+        assert resp.status_code == 200
+        return [m["content"] for m in resp.json()]
+
+    tail = client.get(f"/chat_messages/project/{pid}", params={"tail": 3})
+    assert contents(tail) == ["m4", "m5", "m6"]
+    assert tail.headers["X-Has-More"] == "true"
+
+    oldest_id = tail.json()[0]["id"]
+    older = client.get(f"/chat_messages/project/{pid}", params={"before": oldest_id, "limit": 3})
+    assert contents(older) == ["m1", "m2", "m3"]
+    rest = client.get(f"/chat_messages/project/{pid}", params={"before": older.json()[0]["id"], "limit": 3})
+    assert contents(rest) == ["m0"]
+    assert rest.headers["X-Has-More"] == "false"
+
+    newer = client.get(f"/chat_messages/project/{pid}", params={"after": older.json()[1]["id"], "limit": 2})
+    assert contents(newer) == ["m3", "m4"]
+
+    assert len(client.get(f"/chat_messages/project/{pid}").json()) == 7
+    # ``before`` sin ``limit``: todos los anteriores, también en orden ascendente
+    all_before = client.get(f"/chat_messages/project/{pid}", params={"before": tail.json()[1]["id"]})
+    assert contents(all_before) == ["m0", "m1", "m2", "m3", "m4"]
+    assert "X-Has-More" not in all_before.headers
+    assert client.get(f"/chat_messages/project/{pid}", params={"after": 9999}).status_code == 400
+
+    # El ETag depende de la página pedida y un cursor inválido nunca es un 304
+    etag = tail.headers["ETag"]
+    assert client.get(f"/chat_messages/project/{pid}", params={"tail": 3},
+                      headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/chat_messages/project/{pid}", params={"tail": 2},
+                      headers={"If-None-Match": etag}).status_code == 200
+    assert client.get(f"/chat_messages/project/{pid}", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get(f"/chat_messages/project/{pid}", params={"before": 9999},
+                      headers={"If-None-Match": "*"}).status_code == 400
+
+    app.dependency_overrides.clear()
+
+
 def test_update_message_and_404():
     setup_db()
     client = TestClient(app)
@@ -152,3 +220,257 @@ def test_delete_message_and_404():
     assert not_found.status_code == 404
 
     app.dependency_overrides.clear()
+
+
+def _create_stall_project(user):
+    with Session(engine) as session:
+        proj = Project(name="Proj", description="Desc", owner_id=user.id)
+        session.add(proj)
+        session.commit()
+        session.refresh(proj)
+        session.add(StateMachine(project_id=proj.id, state="stall", extra={"lang": "es"}))
+        session.commit()
+        return proj.id
+
+
+def test_stall_message_calls_ai_and_persists_both_messages():
+    setup_db()
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    project_id = _create_stall_project(user)
+
+    with patch("app.api.endpoints.chat_message.call_ollama", lambda prompt: " Respuesta IA "):
+        resp = client.post("/chat_messages/", json={
+            "content": "Hola", "sender": "user", "project_id": project_id, "state": "stall",
+        })
+
+    assert resp.status_code == 200
+    assert resp.json()["content"] == "Respuesta IA"
+    with Session(engine) as session:
+        msgs = session.exec(select(ChatMessage).order_by(ChatMessage.timestamp)).all()
+        assert [(m.sender, m.content) for m in msgs] == [("user", "Hola"), ("ai", "Respuesta IA")]
+
+    app.dependency_overrides.clear()
+
+
+def test_stream_stall_message_emits_tokens_then_message():
+    setup_db()
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    project_id = _create_stall_project(user)
+
+    def fake_stream(prompt):
+        yield "Hola "
+        yield "mundo"
+
+    with patch("app.api.endpoints.chat_message.stream_ollama", fake_stream):
+        resp = client.post("/chat_messages/stream", json={
+            "content": "Hola", "sender": "user", "project_id": project_id, "state": "stall",
+        })
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = [block.split("\n") for block in resp.text.strip().split("\n\n")]
+    names = [lines[0].removeprefix("event: ") for lines in events]
+    payloads = [json.loads(lines[1].removeprefix("data: ")) for lines in events]
+    assert names == ["token", "token", "message"]
+    assert payloads[0]["text"] == "Hola "
+    assert payloads[2]["content"] == "Hola mundo"
+    assert payloads[2]["sender"] == "ai"
+
+    with Session(engine) as session:
+        msgs = session.exec(select(ChatMessage)).all()
+        assert sorted(m.sender for m in msgs) == ["ai", "user"]
+
+    app.dependency_overrides.clear()
+
+
+def test_stream_emits_error_event_on_unexpected_failures():
+    setup_db()
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    project_id = _create_stall_project(user)
+    body = {"content": "Hola", "sender": "user", "project_id": project_id, "state": "stall"}
+
+    def broken_stream(prompt):
+        yield "Hola "
+        raise json.JSONDecodeError("Expecting value", "{", 1)
+
+    def fake_stream(prompt):
+        yield "Hola"
+
+    def event_names(resp):
+        return [block.split("\n")[0].removeprefix("event: ") for block in resp.text.strip().split("\n\n")]
+
+    with patch("app.api.endpoints.chat_message.stream_ollama", broken_stream):
+        resp = client.post("/chat_messages/stream", json=body)
+    assert event_names(resp) == ["token", "error"]
+
+    def broken_finish(session, text):
+        raise ValueError("db down")
+
+    with patch("app.api.endpoints.chat_message.stream_ollama", fake_stream), \
+         patch("app.api.endpoints.chat_message.dispatch_message",
+               lambda session, user, message_in: PendingReply("prompt", broken_finish)):
+        resp = client.post("/chat_messages/stream", json=body)
+    assert event_names(resp) == ["token", "error"]
+    assert '"detail": "Internal error"' in resp.text
+
+    def ollama_down(prompt):
+        raise OllamaError("Error calling Ollama at http://gpu-node-3:11434: boom", retryable=True, retry_after=7)
+        yield
+
+    with patch("app.api.endpoints.chat_message.stream_ollama", ollama_down):
+        resp = client.post("/chat_messages/stream", json=body)
+    assert event_names(resp) == ["error"]
+    assert json.loads(resp.text.split("data: ", 1)[1]) == {"detail": "AI service unavailable", "retry_after": 7}
+    assert "gpu-node-3" not in resp.text
+
+    with Session(engine) as session:
+        assert session.exec(select(ChatMessage)).all() == []
+
+    app.dependency_overrides.clear()
+
+
+def test_load_project_context_single_snapshot():
+    setup_db()
+    with Session(engine) as session:
+        proj = Project(name="Proj", description="Desc", owner_id=1)
+        session.add(proj)
+        session.commit()
+        session.refresh(proj)
+        pid = proj.id
+        base = datetime(2024, 1, 1)
+        session.add(ChatMessage(content="Mi app", sender="user", project_id=pid, state="init", timestamp=base))
+        for i in range(1, 5):
+            session.add(ChatMessage(content=f"m{i}", sender="ai", project_id=pid, state="stall",
+                                    timestamp=base + timedelta(minutes=i)))
+        session.add(Requirement(description="Rápida", category="performance", number=1, project_id=pid, owner_id=1))
+        session.add(Requirement(description="Login", category="functional", number=1, project_id=pid, owner_id=1))
+        session.commit()
+
+        ctx = load_project_context(session, pid, "es", history_limit=2)
+
+    assert ctx.description == "Mi app"
+    assert ctx.history == (("ai", "m3"), ("ai", "m4"))
+    block = ctx.requirements_block()
+    assert block.startswith("FUNCTIONAL:\n1. Login")
+    assert "PERFORMANCE:\n1. Rápida" in block
+    assert ctx.history_block() == "IA: m3\nIA: m4"
+
+
+def test_rolling_summary_replaces_old_history():
+    setup_db()
+    with Session(engine) as session:
+        proj = Project(name="Proj", description="Desc", owner_id=1)
+        session.add(proj)
+        session.commit()
+        session.refresh(proj)
+        pid = proj.id
+        base = datetime(2024, 1, 1)
+        for i in range(20):
+            session.add(ChatMessage(content=f"m{i}", sender="user" if i % 2 else "ai", project_id=pid,
+                                    state="stall", timestamp=base + timedelta(minutes=i)))
+        session.commit()
+
+        assert summary_due(session, pid)
+        prompts = []
+
+        def fake_generate(prompt):
+            prompts.append(prompt)
+            return "Resumen: el usuario quiere login."
+
+        summary = refresh_summary(session, pid, "es", fake_generate)
+        assert summary.message_count == 14
+        assert "m13" in prompts[0] and "m14" not in prompts[0]
+        assert not summary_due(session, pid)
+
+        ctx = load_project_context(session, pid, "es", history_limit=14, use_summary=True)
+
+    assert ctx.summary == "Resumen: el usuario quiere login."
+    assert [content for _, content in ctx.history] == [f"m{i}" for i in range(14, 20)]
+    block = ctx.conversation_block()
+    assert block.startswith("Resumen de la conversación anterior:\nResumen: el usuario quiere login.")
+    assert block.endswith("Usuario: m19")
+
+
+def test_stall_prompt_includes_every_unsummarised_message():
+    setup_db()
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    project_id = _create_stall_project(user)
+    with Session(engine) as session:
+        base = datetime(2024, 1, 1)
+        # 16 mensajes: aún no toca resumir (every + keep_recent = 18)
+        for i in range(16):
+            session.add(ChatMessage(content=f"mensaje-{i}", sender="user" if i % 2 else "ai",
+                                    project_id=project_id, state="stall", timestamp=base + timedelta(minutes=i)))
+        session.commit()
+        assert not summary_due(session, project_id)
+
+    prompts = []
+    with patch("app.api.endpoints.chat_message.call_ollama", lambda prompt: prompts.append(prompt) or "ok"), \
+         patch("app.services.chat_flow.schedule_summary_refresh", lambda *args: False):
+        resp = client.post("/chat_messages/", json={
+            "content": "Hola", "sender": "user", "project_id": project_id, "state": "stall",
+        })
+    assert resp.status_code == 200
+    assert all(f"mensaje-{i}" in prompts[0] for i in range(16))
+
+    app.dependency_overrides.clear()
+
+
+def test_analyze_reply_over_budget_keeps_all_requirements():
+    setup_db()
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    with Session(engine) as session:
+        proj = Project(name="Proj", description="Desc", owner_id=1)
+        session.add(proj)
+        session.commit()
+        session.refresh(proj)
+        pid = proj.id
+        for i in range(1, 31):
+            session.add(Requirement(description=f"Requisito existente número {i} " + "x" * 80,
+                                    number=i, project_id=pid, owner_id=1))
+        session.add(StateMachine(project_id=pid, state="analyze_requisites", extra={
+            "lang": "es", "questions": ["¿Algo más?"], "current": 0, "answers": [],
+        }))
+        session.commit()
+        original_ids = [r.id for r in session.exec(select(Requirement)).all()]
+
+    prompts = []
+
+    def fake_call_ollama(prompt):
+        prompts.append(prompt)
+        # El modelo sólo devuelve una parte de la lista
+        return "FUNCTIONAL:\n1. Requisito existente número 1 " + "x" * 80 + "\n2. Requisito nuevo"
+
+    # Un presupuesto mínimo obliga a recortar todo lo recortable
+    with patch.object(get_settings(), "llm_context_tokens", 100), \
+         patch.object(get_settings(), "llm_response_reserve_tokens", 0), \
+         patch("app.api.endpoints.chat_message.call_ollama", fake_call_ollama):
+        resp = client.post("/chat_messages/", json={
+            "content": "No", "sender": "user", "project_id": pid, "state": "analyze_requisites",
+        })
+
+    assert resp.status_code == 200
+    # La lista de requisitos llega completa al modelo
+    assert all(f"Requisito existente número {i} " in prompts[0] for i in range(1, 31))
+    with Session(engine) as session:
+        rows = session.exec(select(Requirement).where(Requirement.project_id == pid)).all()
+    # Ningún requisito existente se borra aunque el modelo no lo devuelva
+    assert set(original_ids) <= {r.id for r in rows}
+    assert "Requisito nuevo" in [r.description for r in rows]
+
+    app.dependency_overrides.clear()
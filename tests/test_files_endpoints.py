@@ -7,13 +7,17 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 os.environ.setdefault("database_url", "sqlite:///:memory:")
 
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, Session, create_engine
+from unittest.mock import patch
+from sqlmodel import SQLModel, Session, create_engine, select
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.models.user import User
+from app.models.sample_content import SampleContent
+from app.models.sample_requirement import SampleRequirement
 from app.api.endpoints.auth import get_current_user
 from app.database import get_session
+from app.core.config import get_settings
 
 
 engine = create_engine(
@@ -106,3 +110,102 @@ def test_upload_file_limit():
     assert len(list_resp.json()) == 5
 
     app.dependency_overrides.clear()
+
+
+def test_upload_large_sample_file_inserts_all_lines_in_order():
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+
+    # Más líneas que un lote de bulk_insert, con líneas en blanco intercaladas
+    content = "\n".join(f"Req {i}\n" for i in range(2500))
+    response = client.post(
+        "/files/upload",
+        files={"uploaded_file": ("big.txt", content, "text/plain")},
+    )
+    assert response.status_code == 201
+
+    lines = client.get(f"/files/{response.json()['id']}/requirements").json()
+    assert len(lines) == 2500
+    assert lines[0] == "Req 0" and lines[-1] == "Req 2499"
+
+    app.dependency_overrides.clear()
+
+
+def test_upload_rejects_oversized_and_invalid_files(monkeypatch):
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    client = TestClient(app)
+    user = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "sample_max_lines", 3)
+    too_many = client.post(
+        "/files/upload",
+        files={"uploaded_file": ("many.txt", "a\nb\nc\nd\n", "text/plain")},
+    )
+    assert too_many.status_code == 413
+
+    bad_encoding = client.post(
+        "/files/upload",
+        files={"uploaded_file": ("latin1.txt", "año\n".encode("latin-1"), "text/plain")},
+    )
+    assert bad_encoding.status_code == 400
+    assert "UTF-8" in bad_encoding.json()["detail"]
+
+    monkeypatch.setattr(settings, "sample_max_bytes", 10)
+    too_big = client.post(
+        "/files/upload",
+        files={"uploaded_file": ("big.txt", "x" * 50, "text/plain")},
+    )
+    assert too_big.status_code == 413
+
+    # Ningún intento fallido deja ficheros a medias
+    assert client.get("/files/").json() == []
+
+    app.dependency_overrides.clear()
+
+
+def test_identical_uploads_share_parsed_content():
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    client = TestClient(app)
+    alice = User(id=1, username="alice", email="alice@example.com", password_hash="hashed")
+    bob = User(id=2, username="bob", email="bob@example.com", password_hash="hashed")
+    app.dependency_overrides[get_session] = override_get_session
+
+    content = "Guía 1\nGuía 2\n"
+    app.dependency_overrides[get_current_user] = lambda: alice
+    first = client.post("/files/upload", files={"uploaded_file": ("guia.txt", content, "text/plain")}).json()
+
+    app.dependency_overrides[get_current_user] = lambda: bob
+    with patch("app.services.sample_ingest.ingest_sample_lines") as ingest:
+        second = client.post("/files/upload", files={"uploaded_file": ("copia.txt", content, "text/plain")})
+    assert second.status_code == 201
+    ingest.assert_not_called()
+    second = second.json()
+    assert second["id"] != first["id"]
+    assert [f["filename"] for f in client.get("/files/").json()] == ["copia.txt"]
+    assert client.get(f"/files/{second['id']}/requirements").json() == ["Guía 1", "Guía 2"]
+
+    with Session(engine) as session:
+        contents = session.exec(select(SampleContent)).all()
+        assert [(c.ref_count, c.line_count) for c in contents] == [(2, 2)]
+        assert len(session.exec(select(SampleRequirement)).all()) == 2
+
+    assert client.delete(f"/files/{second['id']}").status_code == 204
+    app.dependency_overrides[get_current_user] = lambda: alice
+    assert client.get(f"/files/{first['id']}/requirements").json() == ["Guía 1", "Guía 2"]
+    assert client.delete(f"/files/{first['id']}").status_code == 204
+    with Session(engine) as session:
+        assert session.exec(select(SampleContent)).all() == []
+        assert session.exec(select(SampleRequirement)).all() == []
+
+    app.dependency_overrides.clear()
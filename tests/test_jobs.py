@@ -0,0 +1,189 @@
+import sys
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+os.environ.setdefault("database_url", "sqlite:///:memory:")
+os.environ.setdefault("secret_key", "testsecret")
+
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel, Session, create_engine, select
+from unittest.mock import patch
+
+from app.main import app
+from app.models.user import User
+from app.models.project import Project
+from app.models.state_machine import StateMachine
+from app.models.chat_message import ChatMessage
+from app.api.endpoints.auth import get_current_user
+from app.database import get_session
+import pytest
+
+from app.models.job import Job
+from app.services.chat_flow import PendingReply
+from app.services.job_queue import JobQueue, JobQueueFull, fail_orphaned_jobs, get_job_queue
+
+
+def create_client(tmp_path):
+    # Base de datos en fichero: los workers de la cola usan sus propias conexiones
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'jobs.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+    user = User(id=1, username="alice", email="a@example.com", password_hash="hashed")
+    with Session(engine) as session:
+        session.add(User(id=1, username="alice", email="a@example.com", password_hash="hashed"))
+        session.add(Project(id=1, name="Proj", description="Desc", owner_id=1))
+        session.commit()
+
+    def override_get_session():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    return TestClient(app), engine
+
+
+def test_chat_message_async_runs_in_background_job(tmp_path):
+    client, engine = create_client(tmp_path)
+    with Session(engine) as session:
+        session.add(StateMachine(project_id=1, state="stall", extra={"lang": "es"}))
+        session.commit()
+
+    with patch("app.api.endpoints.chat_message.call_ollama", lambda prompt: "Respuesta"):
+        resp = client.post("/chat_messages/async", json={
+            "content": "Hola", "sender": "user", "project_id": 1, "state": "stall",
+        })
+        assert resp.status_code == 202
+        job_id = resp.json()["id"]
+        get_job_queue().wait(job_id, timeout=5)
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "succeeded"
+    assert job["progress"] == 100
+    assert job["result"]["content"] == "Respuesta"
+
+    with Session(engine) as session:
+        senders = [m.sender for m in session.exec(select(ChatMessage)).all()]
+        assert sorted(senders) == ["ai", "user"]
+
+    app.dependency_overrides.clear()
+
+
+def test_analyze_async_failure_is_reported(tmp_path):
+    client, engine = create_client(tmp_path)
+
+    def failing(prompt):
+        raise RuntimeError("Ollama down")
+
+    with patch("app.api.endpoints.state_machine.call_ollama", failing):
+        resp = client.post("/state_machine/project/1/async", json={"state": "analyze_requisites"})
+        assert resp.status_code == 202
+        job_id = resp.json()["id"]
+        get_job_queue().wait(job_id, timeout=5)
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "failed"
+    assert "Ollama down" in job["error"]
+    assert job["kind"] == "analyze_requisites"
+
+    app.dependency_overrides.clear()
+
+
+def test_job_not_found(tmp_path):
+    client, _ = create_client(tmp_path)
+    assert client.get("/jobs/999").status_code == 404
+    app.dependency_overrides.clear()
+
+
+def test_queue_slot_is_reserved_before_the_job_row_exists(tmp_path):
+    _, engine = create_client(tmp_path)
+    queue = JobQueue(max_workers=1, max_pending=1)
+    reply = PendingReply("prompt", lambda session, text: None)
+    kwargs = dict(kind="chat_message", project_id=1, owner_id=1, reply=reply,
+                  generate=lambda prompt: "ok", serialize=lambda result: {})
+
+    with Session(engine) as session, Session(engine) as other:
+        real_commit = session.commit
+
+        def commit_while_other_submits():
+            # Otra petición llega mientras la primera aún crea su fila
+            assert queue.pending == 1
+            with pytest.raises(JobQueueFull):
+                queue.submit(other, **kwargs)
+            real_commit()
+
+        with patch.object(session, "commit", commit_while_other_submits):
+            job = queue.submit(session, **kwargs)
+        queue.wait(job.id, timeout=5)
+
+    assert queue.pending == 0
+    queue.shutdown()
+    app.dependency_overrides.clear()
+
+
+def test_only_jobs_without_heartbeat_are_failed_as_orphans(tmp_path):
+    client, engine = create_client(tmp_path)
+    stale = datetime.utcnow() - timedelta(minutes=10)
+    with Session(engine) as session:
+        for status, updated_at in (("queued", stale), ("running", stale), ("succeeded", stale),
+                                   ("running", datetime.utcnow())):
+            session.add(Job(kind="chat_message", status=status, project_id=1, owner_id=1, updated_at=updated_at))
+        session.commit()
+
+    # El último sigue vivo en otro worker: su latido es reciente
+    assert fail_orphaned_jobs(engine) == 2
+    with Session(engine) as session:
+        jobs = session.exec(select(Job).order_by(Job.id)).all()
+        assert [j.status for j in jobs] == ["failed", "failed", "succeeded", "running"]
+        assert jobs[0].error == "Interrupted by server restart"
+        live_id = jobs[3].id
+
+    # Si el worker muere, quien consulta el trabajo lo ve fallar pasado el plazo
+    with Session(engine) as session:
+        job = session.get(Job, live_id)
+        job.updated_at = stale
+        session.add(job)
+        session.commit()
+    assert client.get(f"/jobs/{live_id}").json()["status"] == "failed"
+
+    app.dependency_overrides.clear()
+
+
+def test_heartbeat_keeps_own_jobs_alive(tmp_path):
+    _, engine = create_client(tmp_path)
+    queue = JobQueue(max_workers=1, max_pending=2, orphan_seconds=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_generate(prompt):
+        started.set()
+        release.wait(5)
+        return "ok"
+
+    with Session(engine) as session:
+        job = queue.submit(session, kind="chat_message", project_id=1, owner_id=1,
+                           reply=PendingReply("prompt", lambda session, text: None),
+                           generate=slow_generate, serialize=lambda result: {})
+        job_id = job.id
+    assert started.wait(5)
+    with Session(engine) as session:
+        row = session.get(Job, job_id)
+        row.updated_at = datetime.utcnow() - timedelta(minutes=10)
+        session.add(row)
+        session.commit()
+
+    queue.beat()
+    with Session(engine) as session:
+        row = session.get(Job, job_id)
+        assert row.status == "running"
+        assert row.updated_at > datetime.utcnow() - timedelta(seconds=30)
+
+    release.set()
+    queue.wait(job_id, timeout=5)
+    queue.shutdown()
+    app.dependency_overrides.clear()
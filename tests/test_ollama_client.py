@@ -0,0 +1,390 @@
+import sys
+import os
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+os.environ.setdefault("database_url", "sqlite:///:memory:")
+os.environ.setdefault("secret_key", "testsecret")
+
+import httpx
+import pytest
+from sqlmodel import SQLModel, create_engine
+from sqlalchemy.pool import StaticPool
+
+from app.utils.ollama_client import OllamaClient
+from app.utils.llm_cache import LLMCache
+from app.utils.ollama_pool import OllamaBackend, OllamaError, OllamaPool, parse_backends
+from app.utils.single_flight import SingleFlight
+
+
+def make_client(handler):
+    return OllamaClient("http://ollama.test/", transport=httpx.MockTransport(handler))
+
+
+def test_generate_reuses_pooled_client():
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(json.loads(request.content))
+        return httpx.Response(200, json={"response": "hola"})
+
+    client = make_client(handler)
+    assert client.generate("p1") == "hola"
+    http_client = client.client
+    assert client.generate("p2", model="other", options={"temperature": 0}) == "hola"
+    assert client.client is http_client
+
+    assert seen[0] == {"model": "llama3:8b", "prompt": "p1", "stream": False}
+    assert seen[1]["model"] == "other"
+    assert seen[1]["options"] == {"temperature": 0}
+    client.close()
+
+
+def test_agenerate_returns_response():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"response": "async"})
+
+    client = make_client(handler)
+
+    async def run():
+        try:
+            return await client.agenerate("p")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == "async"
+
+
+def test_generate_http_error_raises_runtime_error():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500, text="model not found")
+
+    client = make_client(handler)
+    with pytest.raises(RuntimeError) as exc:
+        client.generate("p")
+    assert "model not found" in str(exc.value)
+    client.close()
+
+
+def test_stream_generate_yields_tokens_until_done():
+    body = "\n".join([
+        json.dumps({"response": "Ho", "done": False}),
+        json.dumps({"response": "la", "done": False}),
+        json.dumps({"response": "", "done": True}),
+    ])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, text=body)
+
+    client = make_client(handler)
+    assert list(client.stream_generate("p")) == ["Ho", "la"]
+    client.close()
+
+
+def test_cache_hit_skips_second_request_and_bypass_regenerates():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, json={"response": f"r{len(calls)}"})
+
+    client = OllamaClient(
+        "http://ollama.test", transport=httpx.MockTransport(handler), cache=LLMCache(max_entries=10)
+    )
+    assert client.generate("p") == "r1"
+    assert client.generate("p") == "r1"
+    assert client.generate("p", options={"temperature": 0}) == "r2"
+    assert client.generate("p", use_cache=False) == "r3"
+    assert len(calls) == 3
+
+    stats = client.cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    client.close()
+
+
+def test_cache_lru_eviction_and_ttl():
+    cache = LLMCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["evictions"] == 1
+
+    expired = LLMCache(ttl_seconds=0)
+    expired.set("a", "1")
+    assert expired.get("a") is None
+
+
+def test_cache_persistent_tier_survives_memory_clear():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    cache = LLMCache(persistent=True, engine=engine)
+    key = LLMCache.make_key("llama3:8b", "p")
+    cache.set(key, "stored", model="llama3:8b")
+    cache.clear()
+    assert cache.get(key) == "stored"
+    assert cache.stats()["persistent_hits"] == 1
+
+
+def test_single_flight_coalesces_concurrent_identical_generations():
+    calls = []
+    release = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(json.loads(request.content)["prompt"])
+        release.wait(5)
+        return httpx.Response(200, json={"response": f"r{len(calls)}"})
+
+    client = OllamaClient(
+        "http://ollama.test", transport=httpx.MockTransport(handler), single_flight=SingleFlight()
+    )
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate("p"))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    while client.single_flight.stats()["coalesced"] < 2:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == ["r1", "r1", "r1"]
+    assert calls == ["p"]
+    assert client.single_flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 2}
+    # Terminada la llamada, una nueva vuelve a generar
+    assert client.generate("p") == "r2"
+    client.close()
+
+
+def test_single_flight_async_shares_result_and_errors():
+    calls = []
+
+    async def run(client, prompt):
+        try:
+            return await asyncio.gather(*(client.agenerate(prompt) for _ in range(3)), return_exceptions=True)
+        finally:
+            await client.aclose()
+
+    async def ok_handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"response": "async"})
+
+    client = OllamaClient("http://ollama.test", transport=httpx.MockTransport(ok_handler), single_flight=SingleFlight())
+    assert asyncio.run(run(client, "p")) == ["async"] * 3
+    assert len(calls) == 1
+
+    async def error_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.01)
+        return httpx.Response(500, text="boom")
+
+    client = OllamaClient("http://ollama.test", transport=httpx.MockTransport(error_handler), single_flight=SingleFlight())
+    results = asyncio.run(run(client, "p"))
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert client.single_flight.stats()["executions"] == 1
+
+
+def test_parse_backends():
+    a, b = parse_backends("http://a:11434/|llama3:8b;mistral|2, http://b:11434")
+    assert (a.url, a.models, a.weight) == ("http://a:11434", frozenset({"llama3:8b", "mistral"}), 2.0)
+    assert (b.url, b.models, b.weight) == ("http://b:11434", None, 1.0)
+    assert parse_backends("") == []
+
+
+def test_pool_routes_by_model_and_least_outstanding():
+    gpu = OllamaBackend("http://gpu", models=["llama3:8b", "mistral"], weight=2)
+    cpu = OllamaBackend("http://cpu", models=["llama3:8b"])
+    pool = OllamaPool([gpu, cpu])
+
+    # Sólo gpu tiene mistral
+    with pool.route("mistral") as backend:
+        assert backend is gpu
+        # Con una en curso gpu pesa (1+1)/2 = 1, igual que cpu vacía: desempata por peticiones
+        first = pool.pick("llama3:8b")
+        second = pool.pick("llama3:8b")
+        assert (first.backend, second.backend) == (cpu, gpu)
+    pool.release(first)
+    pool.release(second)
+    assert [b["outstanding"] for b in pool.stats()] == [0, 0]
+
+    with pytest.raises(RuntimeError):
+        pool.pick("phi3")
+
+
+def test_client_skips_failed_backend_until_health_check_recovers():
+    down = {"http://a"}
+    hits = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        origin = f"{request.url.scheme}://{request.url.host}"
+        if origin in down:
+            raise httpx.ConnectError("refused", request=request)
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": [{"name": "llama3:8b"}]})
+        hits.append(origin)
+        return httpx.Response(200, json={"response": "ok"})
+
+    client = OllamaClient(
+        "http://a",
+        transport=httpx.MockTransport(handler),
+        backends=[OllamaBackend("http://a"), OllamaBackend("http://b")],
+    )
+    with pytest.raises(RuntimeError):
+        client.generate("p")  # va a "a" (empate) y falla
+    assert client.generate("p") == "ok"
+    assert client.generate("p2") == "ok"
+    assert hits == ["http://b", "http://b"]
+    assert [b["healthy"] for b in client.pool.stats()] == [False, True]
+
+    down.clear()
+    client.check_backends()
+    stats = client.pool.stats()
+    assert [b["healthy"] for b in stats] == [True, True]
+    assert stats[0]["models"] == ["llama3:8b"]
+    # Inventario descubierto: un modelo que no tienen no se enruta
+    with pytest.raises(RuntimeError):
+        client.generate("p", model="mistral")
+    client.close()
+
+
+def test_retries_connect_errors_and_5xx_but_not_4xx():
+    responses = [503, 200]
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        status = responses.pop(0)
+        return httpx.Response(status, json={"response": "ok"})
+
+    client = OllamaClient(
+        "http://ollama.test", transport=httpx.MockTransport(handler), retries=2, retry_backoff=0
+    )
+    assert client.generate("p") == "ok"
+    assert len(calls) == 3
+    assert client.stats()["retries"] == 2
+
+    def not_found(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(404, text="model not found")
+
+    calls.clear()
+    client = OllamaClient("http://ollama.test", transport=httpx.MockTransport(not_found), retries=2, retry_backoff=0)
+    with pytest.raises(OllamaError) as exc:
+        client.generate("p")
+    assert not exc.value.retryable
+    assert len(calls) == 1
+    # Un 4xx no es culpa del nodo
+    assert client.pool.stats()[0]["circuit"] == "closed"
+
+
+def test_circuit_breaker_fails_fast_and_recovers_after_reset():
+    state = {"up": False}
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if not state["up"]:
+            return httpx.Response(500, text="boom")
+        return httpx.Response(200, json={"response": "ok"})
+
+    client = OllamaClient(
+        "http://ollama.test", transport=httpx.MockTransport(handler),
+        breaker_failures=2, breaker_reset_seconds=60,
+    )
+    for _ in range(2):
+        with pytest.raises(OllamaError):
+            client.generate("p")
+    with pytest.raises(OllamaError) as exc:
+        client.generate("p")
+    assert exc.value.retry_after >= 1
+    assert len(calls) == 2  # el tercero ni siquiera sale
+    assert client.pool.stats()[0]["circuit"] == "open"
+
+    # Pasado el plazo deja pasar una prueba que lo cierra
+    client.pool.backends[0].breaker.opened_at -= 60
+    state["up"] = True
+    assert client.generate("p") == "ok"
+    assert client.pool.stats()[0]["circuit"] == "closed"
+    client.close()
+
+
+def test_hedged_request_takes_fastest_backend():
+    release_slow = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "slow":
+            release_slow.wait(5)
+            return httpx.Response(200, json={"response": "slow"})
+        return httpx.Response(200, json={"response": "fast"})
+
+    client = OllamaClient(
+        "http://slow",
+        transport=httpx.MockTransport(handler),
+        backends=[OllamaBackend("http://slow"), OllamaBackend("http://fast")],
+        hedge=True,
+        hedge_initial_delay=0.05,
+    )
+    assert client.generate("p") == "fast"
+    release_slow.set()
+    assert client.stats()["hedges"] == 1
+    assert client.stats()["hedge_wins"] == 1
+    client.close()
+
+
+def test_async_hedged_request_cancels_loser():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "slow":
+            await asyncio.sleep(5)
+            return httpx.Response(200, json={"response": "slow"})
+        return httpx.Response(200, json={"response": "fast"})
+
+    client = OllamaClient(
+        "http://slow",
+        transport=httpx.MockTransport(handler),
+        backends=[OllamaBackend("http://slow"), OllamaBackend("http://fast")],
+        hedge=True,
+        hedge_initial_delay=0.05,
+    )
+
+    async def run():
+        try:
+            result = await client.agenerate("p")
+            await asyncio.sleep(0)  # deja que la cancelación se complete
+            return result
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == "fast"
+    assert [b["outstanding"] for b in client.pool.stats()] == [0, 0]
+    assert client.stats()["hedge_wins"] == 1
+
+
+def test_half_open_trial_is_cleared_only_by_its_own_release():
+    backend = OllamaBackend("http://a")
+    pool = OllamaPool([backend], breaker_failures=1, breaker_reset_seconds=60)
+    old = pool.pick("llama3:8b")
+    pool.record_failure(backend)
+    assert backend.breaker.state == "open"
+
+    backend.breaker.opened_at -= 60
+    trial = pool.pick("llama3:8b")
+    # Termina una petición anterior: la prueba sigue en curso y no pasa otra
+    pool.release(old)
+    with pytest.raises(OllamaError):
+        pool.pick("llama3:8b")
+
+    # Si la prueba se cancela sin resultado, el nodo vuelve a admitir otra
+    pool.release(trial)
+    pool.release(pool.pick("llama3:8b"))
+    assert backend.outstanding == 0
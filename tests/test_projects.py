@@ -14,6 +14,7 @@ from app.main import app
 from app.models.user import User
 from app.models.project import Project
 from app.models.chat_message import ChatMessage
+from app.models.requirements_snapshot import RequirementsSnapshot
 from app.api.endpoints.auth import get_current_user
 from app.database import get_session
 from app.utils.message_loader import load_message
@@ -70,6 +71,10 @@ def test_create_project_and_initial_messages():
     assert msgs[0].sender == "ai" and msgs[0].state == "init" and msgs[0].content == expected1
     assert msgs[1].sender == "ai" and msgs[1].state == "init" and msgs[1].content == expected2
 
+    with Session(engine) as session:
+        snapshot = session.get(RequirementsSnapshot, project_id)
+        assert snapshot is not None and snapshot.text_es == "Sin requisitos."
+
     app.dependency_overrides.clear()
 
 
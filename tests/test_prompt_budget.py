@@ -0,0 +1,90 @@
+import os
+
+os.environ.setdefault("database_url", "sqlite:///:memory:")
+os.environ.setdefault("secret_key", "testsecret")
+
+from app.core.config import get_settings
+from app.services.prompt_budget import (
+    TRIM_MARKER,
+    PromptSection,
+    assemble_prompt,
+    estimate_tokens,
+    prompt_budget,
+)
+
+
+def fake_loader(template, **kwargs):
+    return "\n".join(f"## {k}\n{v}" for k, v in sorted(kwargs.items()))
+
+
+def test_prompt_fits_without_trimming():
+    result = assemble_prompt(
+        "x.txt",
+        sections=[PromptSection("historial", "a\nb", priority=1)],
+        budget=1000,
+        loader=fake_loader,
+    )
+    assert result.trimmed == []
+    assert "a\nb" in result.text
+    assert result.tokens == estimate_tokens(result.text)
+
+
+def test_lowest_priority_trimmed_first_and_keeps_recent_history():
+    history = "\n".join(f"turno {i}" for i in range(200))
+    description = "descripcion importante"
+    result = assemble_prompt(
+        "x.txt",
+        sections=[
+            PromptSection("historial", history, priority=1, keep="end"),
+            PromptSection("descripcion", description, priority=5),
+        ],
+        fixed={"lang": "es"},
+        budget=200,
+        loader=fake_loader,
+    )
+    assert result.trimmed == ["historial"]
+    assert result.tokens <= 200
+    assert description in result.text
+    assert TRIM_MARKER in result.text
+    assert "turno 199" in result.text
+    assert "turno 0\n" not in result.text
+
+
+def test_optional_section_is_dropped_entirely():
+    result = assemble_prompt(
+        "x.txt",
+        sections=[
+            PromptSection("ejemplo", "x" * 2000, priority=1, keep="none"),
+            PromptSection("requisitos", "1. Req", priority=3),
+        ],
+        budget=50,
+        loader=fake_loader,
+    )
+    assert result.trimmed == ["ejemplo"]
+    assert "x" * 10 not in result.text
+    assert "1. Req" in result.text
+
+
+def test_budget_uses_model_window_map(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "llm_context_windows", "big=32000")
+    monkeypatch.setattr(settings, "llm_context_tokens", 4096)
+    monkeypatch.setattr(settings, "llm_response_reserve_tokens", 1000)
+    assert prompt_budget("big") == 31000
+    assert prompt_budget("other") == 3096
+
+
+def test_never_section_is_not_trimmed_even_over_budget():
+    requirements = "\n".join(f"{i}. requisito" for i in range(100))
+    result = assemble_prompt(
+        "x.txt",
+        sections=[
+            PromptSection("requisitos", requirements, priority=1, keep="never"),
+            PromptSection("historial", "h\n" * 50, priority=2, keep="end"),
+        ],
+        budget=50,
+        loader=fake_loader,
+    )
+    assert requirements in result.text
+    assert result.trimmed == ["historial"]
+    assert result.tokens > result.budget
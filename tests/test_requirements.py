@@ -7,8 +7,9 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 os.environ.setdefault("database_url", "sqlite:///:memory:")
 
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel import SQLModel, Session, create_engine, select
 from sqlalchemy.pool import StaticPool
+from unittest.mock import patch
 
 from app.main import app
 from app.api.endpoints.auth import get_current_user
@@ -18,6 +19,10 @@ from app.models.project import Project
 from app.models.requirement import Requirement
 from app.models.state_machine import StateMachine
 from app.models.chat_message import ChatMessage
+from app.models.requirements_snapshot import RequirementsSnapshot
+from app.services.requirements_snapshot import get_requirements_block
+from app.services.requirement_service import parse_requirements_block, replace_requirements, reserve_requirement_numbers
+from app.models.requirement_counter import RequirementCounter
 
 import app.api.endpoints.requirements as req_api
 
@@ -183,3 +188,287 @@ def test_update_delete_nonexistent_requirement():
     assert delete_resp.status_code == 404
 
     app.dependency_overrides.clear()
+
+
+def test_requirements_snapshot_tracks_every_mutation():
+    client, engine = create_test_client()
+    with Session(engine) as session:
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+
+    r1 = client.post("/requirements/?project_id=1", json={"description": "Login"}).json()
+    r2 = client.post(
+        "/requirements/?project_id=1", json={"description": "Rápida", "category": "performance"}
+    ).json()
+    client.put(f"/requirements/{r1['id']}", json={"description": "Login con SSO"})
+    client.delete(f"/requirements/{r2['id']}")
+
+    with Session(engine) as session:
+        snapshot = session.get(RequirementsSnapshot, 1)
+        assert snapshot.version == 4
+        assert "1. Login con SSO" in snapshot.text_es
+        assert "Rápida" not in snapshot.text_es
+        assert "PERFORMANCE:\n(empty)" in snapshot.text_en
+        assert get_requirements_block(session, 1, "es") == snapshot.text_es
+
+    app.dependency_overrides.clear()
+
+
+def test_list_requirements_conditional_get():
+    client, engine = create_test_client()
+    with Session(engine) as session:
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+
+    first = client.get("/requirements/project/1")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+
+    cached = client.get("/requirements/project/1", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    req = client.post("/requirements/?project_id=1", json={"description": "Login"}).json()
+    changed = client.get("/requirements/project/1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert [r["description"] for r in changed.json()] == ["Login"]
+    assert changed.headers["ETag"] != etag
+
+    etag = changed.headers["ETag"]
+    client.put(f"/requirements/{req['id']}", json={"status": "approved"})
+    assert client.get("/requirements/project/1", headers={"If-None-Match": etag}).status_code == 200
+
+    # Sólo cambian los mensajes: el ETag de requisitos sigue valiendo
+    etag = client.get("/requirements/project/1").headers["ETag"]
+    with Session(engine) as session:
+        session.add(ChatMessage(content="hola", sender="user", project_id=1, state="stall"))
+        session.commit()
+    assert client.get("/requirements/project/1", headers={"If-None-Match": etag}).status_code == 304
+
+    app.dependency_overrides.clear()
+
+
+def test_batch_requirements_mixed_operations():
+    client, engine = create_test_client()
+    with Session(engine) as session:
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+
+    keep = client.post("/requirements/?project_id=1", json={"description": "Login"}).json()
+    drop = client.post("/requirements/?project_id=1", json={"description": "Logout"}).json()
+
+    resp = client.post("/requirements/project/1/batch", json={"operations": [
+        {"op": "create", "description": "Exportar PDF"},
+        {"op": "create", "description": "Rápida", "category": "performance"},
+        {"op": "update", "id": keep["id"], "status": "approved"},
+        {"op": "delete", "id": drop["id"]},
+        {"op": "update", "id": 9999, "status": "approved"},
+        {"op": "create"},
+    ]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["applied"], data["failed"]) == (4, 2)
+    results = data["results"]
+    assert [r["requirement"]["number"] for r in results[:2]] == [3, 4]
+    assert results[2]["requirement"]["status"] == "approved"
+    assert results[3]["ok"] and results[3]["id"] == drop["id"]
+    assert results[4]["error"] == "Requirement not found"
+    assert results[5]["error"] == "description is required"
+
+    listed = client.get("/requirements/project/1").json()
+    assert [r["description"] for r in listed] == ["Login", "Exportar PDF", "Rápida"]
+    with Session(engine) as session:
+        snapshot = session.get(RequirementsSnapshot, 1)
+        assert "Logout" not in snapshot.text_es
+        assert "Exportar PDF" in snapshot.text_es
+
+    atomic = client.post("/requirements/project/1/batch", json={"atomic": True, "operations": [
+        {"op": "create", "description": "No debe quedar"},
+        {"op": "delete", "id": drop["id"]},
+    ]})
+    assert atomic.status_code == 409
+    assert len(client.get("/requirements/project/1").json()) == 3
+
+    app.dependency_overrides.clear()
+
+
+def test_batch_update_rejects_null_for_required_fields():
+    client, engine = create_test_client()
+    with Session(engine) as session:
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+
+    req = client.post("/requirements/?project_id=1", json={"description": "Login"}).json()
+    resp = client.post("/requirements/project/1/batch", json={"operations": [
+        {"op": "update", "id": req["id"], "description": None},
+        {"op": "update", "id": req["id"], "category": None, "status": "approved"},
+        {"op": "update", "id": req["id"], "priority": "should", "visual_reference": None},
+        {"op": "create", "description": "Exportar PDF"},
+    ]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["applied"], data["failed"]) == (2, 2)
+    assert data["results"][0]["error"] == "description cannot be null"
+    assert data["results"][1]["error"] == "category cannot be null"
+
+    listed = client.get("/requirements/project/1").json()
+    assert [(r["description"], r["status"], r["priority"]) for r in listed] == [
+        ("Login", "draft", "should"), ("Exportar PDF", "draft", "must"),
+    ]
+
+    app.dependency_overrides.clear()
+
+
+def test_requirement_numbers_reserved_from_counter():
+    client, engine = create_test_client()
+    with Session(engine) as session:
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        # Requisitos previos al contador: se inicializa desde el máximo
+        session.add(Requirement(description="Viejo", number=7, project_id=1, owner_id=1))
+        session.commit()
+
+        assert reserve_requirement_numbers(session, 1, 3) == 8
+        assert reserve_requirement_numbers(session, 1) == 11
+        session.commit()
+        assert session.get(RequirementCounter, 1).last_number == 11
+
+    # Borrar el último no reutiliza su número
+    created = client.post("/requirements/?project_id=1", json={"description": "Nuevo"}).json()
+    assert created["number"] == 12
+    client.delete(f"/requirements/{created['id']}")
+    assert client.post("/requirements/?project_id=1", json={"description": "Otro"}).json()["number"] == 13
+
+    app.dependency_overrides.clear()
+
+
+def test_replace_requirements_reconciles_existing_rows():
+    client, engine = create_test_client()
+    with Session(engine) as session:
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+        replace_requirements(session, 1, parse_requirements_block(
+            "FUNCTIONAL:\n1. El usuario puede iniciar sesión\n2. El usuario puede exportar a PDF\n"
+            "3. Se envían notificaciones por correo\n"
+            "SECURITY:\n1. Las contraseñas se guardan cifradas\n"
+        ), owner_id=1)
+        before = {r.description: r for r in session.exec(select(Requirement)).all()}
+        for desc in ("El usuario puede iniciar sesión", "Las contraseñas se guardan cifradas"):
+            before[desc].status = "approved"
+            session.add(before[desc])
+        session.commit()
+        ids = {desc: r.id for desc, r in before.items()}
+        created = {desc: r.created_at for desc, r in before.items()}
+
+        stats = replace_requirements(session, 1, parse_requirements_block(
+            "FUNCTIONAL:\n1. El usuario puede iniciar sesión\n2. El usuario puede exportar a PDF y CSV\n"
+            "3. Se avisa por correo de cada notificación\n4. El sistema guarda un historial de cambios\n"
+            "SECURITY:\n1. Se registran todos los accesos al sistema\n"
+        ), owner_id=1)
+        assert stats == {"inserted": 2, "updated": 2, "deleted": 1, "unchanged": 1}
+
+        after = {r.description: r for r in session.exec(select(Requirement)).all()}
+        assert after["El usuario puede iniciar sesión"].id == ids["El usuario puede iniciar sesión"]
+        assert after["El usuario puede iniciar sesión"].status == "approved"
+        assert after["El usuario puede iniciar sesión"].created_at == created["El usuario puede iniciar sesión"]
+        # Reformulado: mismo id
+        assert after["El usuario puede exportar a PDF y CSV"].id == ids["El usuario puede exportar a PDF"]
+        # Mismo número y algo parecido: mismo id
+        assert after["Se avisa por correo de cada notificación"].id == ids["Se envían notificaciones por correo"]
+        # Mismo número pero texto completamente distinto: requisito nuevo, no hereda la aprobación
+        accesos = after["Se registran todos los accesos al sistema"]
+        assert accesos.id not in ids.values()
+        assert accesos.status == "draft"
+        assert "Las contraseñas se guardan cifradas" not in after
+        assert "exportar a PDF y CSV" in session.get(RequirementsSnapshot, 1).text_es
+
+        stats = replace_requirements(session, 1, parse_requirements_block(
+            "FUNCTIONAL:\n1. El usuario puede iniciar sesión\n2. Modo oscuro en toda la app\n"
+        ), owner_id=1)
+        assert (stats["inserted"], stats["updated"], stats["deleted"]) == (1, 0, 4)
+        assert len(session.exec(select(Requirement)).all()) == 2
+
+    app.dependency_overrides.clear()
+
+
+def test_concurrent_snapshot_changes_do_not_overwrite_each_other(tmp_path):
+    from app.services.requirements_snapshot import apply_requirement_changes, rebuild_snapshot
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'snap.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, username="alice", email="alice@example.com", password_hash="hashed"))
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+        rebuild_snapshot(session, 1)
+        session.commit()
+
+    with Session(engine) as first, Session(engine) as second:
+        # El segundo ya tiene el snapshot en memoria antes de que el primero escriba
+        stale = second.get(RequirementsSnapshot, 1)
+        assert stale.items == {}
+
+        a = Requirement(description="Alta A", status="draft", category="functional",
+                        priority="must", project_id=1, owner_id=1, number=1)
+        first.add(a)
+        apply_requirement_changes(first, 1, upserted=[a])
+        first.commit()
+
+        b = Requirement(description="Alta B", status="draft", category="functional",
+                        priority="must", project_id=1, owner_id=1, number=2)
+        second.add(b)
+        apply_requirement_changes(second, 1, upserted=[b])
+        second.commit()
+
+    with Session(engine) as session:
+        snapshot = session.get(RequirementsSnapshot, 1)
+        assert "1. Alta A" in snapshot.text_es
+        assert "2. Alta B" in snapshot.text_es
+        assert snapshot.version == 3
+
+
+def test_bump_project_version_upserts_first_row():
+    from app.models.project_version import ProjectVersion, bump_project_version
+
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        bump_project_version(connection, 1, ["requirements"])
+        bump_project_version(connection, 1, ["requirements", "messages"])
+    with Session(engine) as session:
+        version = session.get(ProjectVersion, 1)
+        assert (version.messages, version.requirements, version.state) == (1, 2, 0)
+
+
+def test_snapshot_created_concurrently_does_not_raise(tmp_path):
+    import app.services.requirements_snapshot as snapshots
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'snap.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, username="alice", email="alice@example.com", password_hash="hashed"))
+        session.add(Project(id=1, name="P1", description="desc", owner_id=1))
+        session.commit()
+
+    with Session(engine) as other:
+        snapshots.rebuild_snapshot(other, 1)
+        other.commit()
+
+    real_locked = snapshots._locked_snapshot
+    calls = []
+
+    def racing_locked(session, project_id):
+        # Las lecturas previas al alta no ven la fila que otra transacción acaba de crear
+        calls.append(project_id)
+        return None if len(calls) <= 2 else real_locked(session, project_id)
+
+    with Session(engine) as session, patch.object(snapshots, "_locked_snapshot", racing_locked):
+        req = Requirement(description="Alta", status="draft", category="functional",
+                          priority="must", project_id=1, owner_id=1, number=1)
+        session.add(req)
+        snapshots.apply_requirement_changes(session, 1, upserted=[req])
+        session.commit()
+
+    with Session(engine) as session:
+        snapshot = session.get(RequirementsSnapshot, 1)
+        assert "1. Alta" in snapshot.text_es
+        assert snapshot.version == 2
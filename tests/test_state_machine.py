@@ -17,8 +17,11 @@ from app.models.project import Project
 from app.models.requirement import Requirement
 from app.models.state_machine import StateMachine
 from app.models.chat_message import ChatMessage
+from app.models.project_state import ProjectState
+from app.services.project_state import get_current_state
 from app.api.endpoints.auth import get_current_user
 from app.database import get_session
+from app.utils.ollama_pool import OllamaError
 
 
 def create_engine_and_tables():
@@ -162,3 +165,67 @@ def test_post_state_machine_generic_lang_persisted():
     assert data["extra"]["lang"] == "fr"
 
     app.dependency_overrides.clear()
+
+
+def test_project_state_head_follows_transitions():
+    engine = create_engine_and_tables()
+    with Session(engine) as session:
+        session.add(User(id=1, username="alice", email="a@example.com", password_hash="hashed"))
+        session.add(Project(id=1, name="Proj", description="Desc", owner_id=1))
+        session.commit()
+
+        first = StateMachine(project_id=1, state="software_questions", extra={"current": 0})
+        session.add(first)
+        session.commit()
+        head = session.get(ProjectState, 1)
+        assert (head.state_machine_id, head.state, head.version) == (first.id, "software_questions", 1)
+
+        # Actualización in situ de extra sobre la fila actual
+        first.extra = {"current": 1}
+        session.add(first)
+        session.commit()
+        session.refresh(head)
+        assert head.version == 2
+
+        second = StateMachine(project_id=1, state="stall", extra={"lang": "es"})
+        session.add(second)
+        session.commit()
+        session.refresh(head)
+        assert (head.state_machine_id, head.state, head.version) == (second.id, "stall", 3)
+
+        current = get_current_state(session, 1)
+        assert current.id == second.id
+        assert current.extra == {"lang": "es"}
+        assert get_current_state(session, 2) is None
+
+
+def test_post_state_machine_analyze_ollama_down_returns_503():
+    engine = create_engine_and_tables()
+    with Session(engine) as session:
+        user = User(id=1, username="alice", email="a@example.com", password_hash="hashed")
+        session.add(user)
+        session.add(Project(id=1, name="Proj", description="Desc", owner_id=1))
+        session.add(StateMachine(project_id=1, state="stall", extra={"lang": "es"}))
+        session.commit()
+
+    def override_get_session():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_session] = override_get_session
+    client = TestClient(app)
+
+    def failing_call_ollama(prompt: str, **kwargs) -> str:
+        raise OllamaError("circuit open", retry_after=7)
+
+    with patch("app.api.endpoints.state_machine.call_ollama", failing_call_ollama):
+        response = client.post("/state_machine/project/1", json={"state": "analyze_requisites"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    with Session(engine) as session:
+        assert get_current_state(session, 1).state == "stall"
+        assert session.exec(select(ChatMessage)).all() == []
+
+    app.dependency_overrides.clear()
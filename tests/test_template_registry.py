@@ -0,0 +1,47 @@
+import sys
+import os
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+from app.utils.template_registry import TemplateRegistry, TemplateError
+from app.utils.prompt_loader import prompts
+from app.utils.message_loader import messages, load_localized_message
+
+
+def test_bundled_templates_are_valid():
+    assert "stall_chat.txt" in prompts.load_all()
+    assert "project_welcome_ia1.txt" in messages.load_all()
+
+
+def test_missing_and_unexpected_placeholders_fail_validation(tmp_path):
+    (tmp_path / "greet.txt").write_text("Hola {nombre} {extra}", encoding="utf-8")
+    registry = TemplateRegistry(str(tmp_path), {"greet.txt": {"nombre", "apellido"}})
+    with pytest.raises(TemplateError) as exc:
+        registry.load_all()
+    assert "apellido" in str(exc.value)
+    assert "extra" in str(exc.value)
+
+
+def test_template_reloads_when_mtime_changes(tmp_path):
+    path = tmp_path / "greet.txt"
+    path.write_text("Hola {nombre}", encoding="utf-8")
+    registry = TemplateRegistry(str(tmp_path), {"greet.txt": {"nombre"}}, reload_interval=0.0001)
+    registry.load_all()
+    assert registry.render("greet.txt", nombre="Ana") == "Hola Ana"
+
+    path.write_text("Adiós {nombre}", encoding="utf-8")
+    mtime = os.stat(path).st_mtime + 5
+    os.utime(path, (mtime, mtime))
+    assert registry.render("greet.txt", nombre="Ana") == "Adiós Ana"
+
+
+def test_resolve_language_variants():
+    messages.load_all()
+    assert messages.resolve("add_req_done", "es-ES") == "add_req_done_es.txt"
+    assert messages.resolve("add_req_done", "fr") == "add_req_done_en.txt"
+    assert load_localized_message("add_req_done", "en", category="security").strip() == (
+        "AI has added new security requirements."
+    )